@@ -1,99 +1,44 @@
 import argparse
 import time
-import requests
-import cv2
-from functools import lru_cache
 from picamera2 import MappedArray, Picamera2
 from picamera2.devices.imx500 import IMX500
+from pipeline import DetectionPipeline, FrameBackend
+from replay import Recorder
+from uploader import Uploader
 
-last_detections = []
-SERVER_URL = "http://0.0.0.0:5000/qr-data"  
-LABEL = "qr-code"  
-CONFIDENCE_THRESHOLD = 0.3  # Only process detections with confidence >= 0.3
-
-
-class Detection:
-    def __init__(self, coords, category, conf, metadata):
-        """Create a Detection object, recording the bounding box, category, and confidence."""
-        self.category = category
-        self.conf = conf
-        self.box = imx500.convert_inference_coords(coords, metadata, picam2)
-
-
-def parse_and_draw_detections(request):
-    """Analyse the detected objects in the output tensor, draw them, and send QR data."""
-    detections = parse_detections(request.get_metadata())
-    draw_detections(request, detections)
-    send_qr_data(request, detections)  # Now also decodes the QR code
-
-
-def parse_detections(metadata: dict):
-    """Parse the output tensor into detected objects, only keeping valid ones."""
-    global last_detections
-
-    np_outputs = imx500.get_outputs(metadata, add_batch=True)
-    if np_outputs is None:
-        return last_detections
-
-    boxes, scores, classes = np_outputs[0][0], np_outputs[2][0], np_outputs[1][0]
-    filtered_detections = [
-        Detection(box, category, score, metadata)
-        for box, score, category in zip(boxes, scores, classes)
-        if score >= CONFIDENCE_THRESHOLD  # ✅ Only keep high-confidence detections
-    ]
-
-    last_detections = filtered_detections
-    return filtered_detections
-
-
-def draw_detections(request, detections, stream="main"):
-    """Draw only high-confidence detections onto the ISP output."""
-    with MappedArray(request, stream) as m:
-        for detection in detections:
-            x, y, w, h = detection.box
-            label = f"{LABEL} ({detection.conf:.2f})"
-            cv2.putText(
-                m.array,
-                label,
-                (x + 5, y + 15),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.5,
-                (0, 255, 0),
-                1,
-            )
-            cv2.rectangle(m.array, (x, y), (x + w, y + h), (0, 255, 0), 2)
-
-
-def decode_qr_code(frame, x, y, w, h):
-    """Extracts the QR code from the detected region and decodes it."""
-    roi = frame[y : y + h, x : x + w]  # Crop the detected region
-    qr_decoder = cv2.QRCodeDetector()
-    data, _, _ = qr_decoder.detectAndDecode(roi)  # Try to decode the QR code
-    return data if data else None  # Return decoded data or None if not found
-
-
-def send_qr_data(request, detections):
-    """Send only high-confidence QR code detections with decoded data."""
-    with MappedArray(request, "main") as m:
-        for detection in detections:
-            x, y, w, h = detection.box
-            qr_data = decode_qr_code(m.array, x, y, w, h)  # Decode the QR code
-
-            if qr_data:  # ✅ Send only if QR code is successfully decoded
-                data = {"qr_data": qr_data}
-                try:
-                    response = requests.post(SERVER_URL, json=data, timeout=2)
-                    if response.status_code == 200:
-                        print("[✅] QR Data Sent:", response.json())
-                    else:
-                        print(f"[❌] Failed to send QR data. Status Code: {response.status_code}")
-                except requests.exceptions.RequestException as e:
-                    print(f"[⚠️] Error sending QR data: {e}")
+SERVER_URL = "http://0.0.0.0:8000/api/store_qr/batch/"  # Backend endpoint taking batches of scans
+BUFFER_PATH = "qr_buffer.bin"  # Unsent scans survive restarts here
+
+
+class Picamera2Backend(FrameBackend):
+    """Frames from the Picamera2 ISP output and detection tensors from the IMX500."""
+
+    def __init__(self, imx500, picam2):
+        self.imx500 = imx500
+        self.picam2 = picam2
+
+    def metadata(self, request):
+        return request.get_metadata()
+
+    def get_outputs(self, metadata):
+        np_outputs = self.imx500.get_outputs(metadata, add_batch=True)
+        if np_outputs is None:
+            return None
+        return np_outputs[0][0], np_outputs[2][0], np_outputs[1][0]
+
+    def convert_box(self, coords, metadata):
+        return self.imx500.convert_inference_coords(coords, metadata, self.picam2)
+
+    def frame(self, request, stream="main"):
+        return MappedArray(request, stream)
 
 
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--model", type=str, required=True, help="Path of the model")
+    parser.add_argument("--server-url", type=str, default=SERVER_URL, help="Batch endpoint scans are uploaded to")
+    parser.add_argument("--buffer", type=str, default=BUFFER_PATH, help="Ring-buffer file for unsent scans")
+    parser.add_argument("--record", type=str, help="Save frames and detections to this directory for replay.py")
     return parser.parse_args()
 
 
@@ -104,10 +49,26 @@ if __name__ == "__main__":
     imx500 = IMX500(args.model)
     picam2 = Picamera2()
 
+    backend = Picamera2Backend(imx500, picam2)
+    uploader = Uploader(args.server_url, args.buffer).start()
+    pipeline = DetectionPipeline(backend, uploader)
+
     imx500.show_network_fw_progress_bar()
     config = picam2.create_preview_configuration(buffer_count=28)
     picam2.start(config, show_preview=True)
-    picam2.pre_callback = parse_and_draw_detections
-
-    while True:
-        time.sleep(0.5)
+    picam2.pre_callback = pipeline.parse_and_draw_detections
+    if args.record:
+        recorder = Recorder(args.record, backend)
+
+        def record_and_process(request):
+            recorder.record(request)  # Before drawing, so the saved frame is clean
+            pipeline.parse_and_draw_detections(request)
+
+        picam2.pre_callback = record_and_process
+
+    try:
+        while True:
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        picam2.stop()
+        uploader.stop()  # Anything still unsent stays in the buffer file for next time
@@ -0,0 +1,91 @@
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from pipeline import CONFIDENCE_THRESHOLD, DetectionPipeline
+from replay import ReplayBackend, load_recording, synthesize
+
+
+class CountingSink:
+    """Stands in for the Uploader and remembers what would have been sent."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, qr_text):
+        self.sent.append(qr_text)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Replay frames through the detection pipeline and time it")
+    parser.add_argument("--recording", type=str, help="Directory written by app.py --record (default: synthetic frames)")
+    parser.add_argument("--frames", type=int, default=600, help="Synthetic frames to generate")
+    parser.add_argument("--codes", type=int, default=20, help="Distinct codes in the synthetic frames")
+    parser.add_argument("--confidence", type=float, default=CONFIDENCE_THRESHOLD)
+    parser.add_argument("--roi-margin", type=float, default=0.0, help="Widen the decode crop by this fraction per side")
+    parser.add_argument("--no-track", action="store_true", help="Decode every box on every frame (the old behaviour)")
+    parser.add_argument("--upload", action="store_true", help="Send through the Uploader to a local stand-in server")
+    return parser.parse_args()
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1000 if values else 0.0
+
+
+if __name__ == "__main__":
+    args = get_args()
+
+    if args.recording:
+        frames, expected = load_recording(args.recording), None
+    else:
+        frames, expected = synthesize(frames=args.frames, codes=args.codes)
+
+    server = None
+    if args.upload:
+        from standin_server import StandInServer
+        from uploader import Uploader
+
+        server = StandInServer().start()
+        sink = Uploader(server.url, os.path.join(tempfile.mkdtemp(), "qr_buffer.bin")).start()
+    else:
+        sink = CountingSink()
+
+    # Replayed time, so tracking and dedup windows behave as at the camera's real frame rate
+    current = {"timestamp": 0.0}
+    pipeline = DetectionPipeline(
+        ReplayBackend(), sink,
+        confidence=args.confidence,
+        track=not args.no_track,
+        roi_margin=args.roi_margin,
+        clock=lambda: current["timestamp"],
+        profile=True,
+    )
+
+    started = time.perf_counter()
+    for frame in frames:
+        current["timestamp"] = frame.timestamp
+        pipeline.parse_and_draw_detections(frame)
+    elapsed = time.perf_counter() - started
+
+    if args.upload:
+        sink.stop()
+        server.stop()
+        sent = server.scan_ids
+        decoded = set()
+    else:
+        sent = sink.sent
+        decoded = set(sink.sent)
+
+    print(f"frames:          {len(frames)}")
+    print(f"frames/s:        {len(frames) / elapsed:.1f}")
+    for stage in ("parse", "draw", "decode"):
+        print(f"{stage + ' ms/frame:':<17}{pipeline.timings[stage] / len(frames) * 1000:.3f}")
+    print(f"decode calls:    {len(pipeline.decode_times)}")
+    print(
+        f"decode ms:       p50 {percentile(pipeline.decode_times, 50):.2f}  "
+        f"p95 {percentile(pipeline.decode_times, 95):.2f}  p99 {percentile(pipeline.decode_times, 99):.2f}"
+    )
+    print(f"uploads:         {len(sent)}")
+    if expected is not None and not args.upload:
+        print(f"codes decoded:   {len(decoded & set(expected))}/{len(expected)}")
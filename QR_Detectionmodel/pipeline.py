@@ -0,0 +1,215 @@
+import time
+from collections import defaultdict
+import cv2
+
+LABEL = "qr-code"
+CONFIDENCE_THRESHOLD = 0.3  # Only process detections with confidence >= 0.3
+IOU_THRESHOLD = 0.3  # Boxes overlapping at least this much on consecutive frames are the same code
+TRACK_TTL = 1.0  # Seconds a tracked box may go undetected before it counts as gone
+DECODE_RETRY_INTERVAL = 0.1  # Seconds between decode attempts on a box that did not decode yet
+DEDUP_SECONDS = 10.0  # The same payload is sent once within this window
+
+
+class FrameBackend:
+    """
+    Where frames and detection tensors come from.
+
+    The pipeline only talks to this interface, so the same code runs on the
+    Picamera2/IMX500 hardware (app.py) and on recorded or synthetic frames
+    (replay.py).
+    """
+
+    def metadata(self, request):
+        """The per-frame metadata the detection tensors are read from."""
+        raise NotImplementedError
+
+    def get_outputs(self, metadata):
+        """(boxes, scores, classes) for one frame, or None when the network produced nothing new."""
+        raise NotImplementedError
+
+    def convert_box(self, coords, metadata):
+        """A box from the tensor as (x, y, w, h) in frame pixels."""
+        raise NotImplementedError
+
+    def frame(self, request, stream="main"):
+        """Context manager giving the frame as a writable image array."""
+        raise NotImplementedError
+
+
+class Detection:
+    def __init__(self, box, category, conf):
+        """Create a Detection object, recording the bounding box, category, and confidence."""
+        self.category = category
+        self.conf = conf
+        self.box = box
+
+
+class Track:
+    """One physical code followed across frames, decoded once."""
+
+    def __init__(self, box, now):
+        self.box = box
+        self.last_seen = now
+        self.data = None
+        self.next_decode = now
+
+
+def iou(a, b):
+    """Intersection over union of two (x, y, w, h) boxes."""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    ih = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = iw * ih
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+
+class BoxTracker:
+    """Matches each frame's boxes to the codes seen on earlier frames by IoU."""
+
+    def __init__(self, iou_threshold=IOU_THRESHOLD, ttl=TRACK_TTL):
+        self.iou_threshold = iou_threshold
+        self.ttl = ttl
+        self.tracks = []
+
+    def update(self, boxes, now):
+        """Return the Track for every box, starting tracks for new codes and dropping stale ones."""
+        self.tracks = [track for track in self.tracks if now - track.last_seen <= self.ttl]
+        unmatched = list(self.tracks)
+        matched = []
+
+        for box in boxes:
+            best = max(unmatched, key=lambda track: iou(track.box, box), default=None)
+            if best is not None and iou(best.box, box) >= self.iou_threshold:
+                unmatched.remove(best)
+            else:
+                best = Track(box, now)
+                self.tracks.append(best)
+            best.box = box
+            best.last_seen = now
+            matched.append(best)
+        return matched
+
+
+class Deduplicator:
+    """Lets each payload through once per ``window`` seconds."""
+
+    def __init__(self, window=DEDUP_SECONDS):
+        self.window = window
+        self.seen = {}
+
+    def first_seen(self, payload, now):
+        if now - self.seen.get(payload, float("-inf")) < self.window:
+            return False
+        self.seen[payload] = now
+        if len(self.seen) > 1024:
+            self.seen = {p: t for p, t in self.seen.items() if now - t < self.window}
+        return True
+
+
+class DetectionPipeline:
+    """
+    Parses detections, draws them and decodes each physical code once.
+
+    ``sink`` is anything with a ``send(qr_text)`` method, normally the
+    Uploader. With ``track=False`` every box is decoded on every frame, as the
+    app originally did, which is useful as a baseline. ``roi_margin`` widens
+    the decode crop by that fraction of the box on each side. With
+    ``profile=True`` the seconds spent in each stage are collected in
+    ``timings``, and each decode call in ``decode_times``.
+    """
+
+    def __init__(self, backend, sink, confidence=CONFIDENCE_THRESHOLD, track=True, roi_margin=0.0,
+                 dedup_window=DEDUP_SECONDS, clock=time.monotonic, profile=False):
+        self.backend = backend
+        self.sink = sink
+        self.confidence = confidence
+        self.track = track
+        self.roi_margin = roi_margin
+        self.clock = clock
+        self.profile = profile
+        self.qr_decoder = cv2.QRCodeDetector()  # ✅ Built once; constructing it per box is expensive
+        self.tracker = BoxTracker()
+        self.deduplicator = Deduplicator(dedup_window)
+        self.last_detections = []
+        self.timings = defaultdict(float)
+        self.decode_times = []
+
+    def parse_and_draw_detections(self, request):
+        """Analyse the detected objects in the output tensor, draw them, and send QR data."""
+        detections = self._timed("parse", self.parse_detections, self.backend.metadata(request))
+        self._timed("draw", self.draw_detections, request, detections)
+        self._timed("decode", self.send_qr_data, request, detections)  # Now also decodes the QR code
+
+    def parse_detections(self, metadata):
+        """Parse the output tensor into detected objects, only keeping valid ones."""
+        np_outputs = self.backend.get_outputs(metadata)
+        if np_outputs is None:
+            return self.last_detections
+
+        boxes, scores, classes = np_outputs
+        filtered_detections = [
+            Detection(self.backend.convert_box(box, metadata), category, score)
+            for box, score, category in zip(boxes, scores, classes)
+            if score >= self.confidence  # ✅ Only keep high-confidence detections
+        ]
+
+        self.last_detections = filtered_detections
+        return filtered_detections
+
+    def draw_detections(self, request, detections, stream="main"):
+        """Draw only high-confidence detections onto the ISP output."""
+        with self.backend.frame(request, stream) as frame:
+            for detection in detections:
+                x, y, w, h = detection.box
+                label = f"{LABEL} ({detection.conf:.2f})"
+                cv2.putText(
+                    frame,
+                    label,
+                    (x + 5, y + 15),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    0.5,
+                    (0, 255, 0),
+                    1,
+                )
+                cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+
+    def decode_qr_code(self, frame, x, y, w, h):
+        """Extracts the QR code from the detected region and decodes it."""
+        pad_x, pad_y = int(w * self.roi_margin), int(h * self.roi_margin)
+        roi = frame[max(y - pad_y, 0) : y + h + pad_y, max(x - pad_x, 0) : x + w + pad_x]  # Crop the detected region
+        started = time.perf_counter()
+        data, _, _ = self.qr_decoder.detectAndDecode(roi)  # Try to decode the QR code
+        if self.profile:
+            self.decode_times.append(time.perf_counter() - started)
+        return data if data else None  # Return decoded data or None if not found
+
+    def send_qr_data(self, request, detections):
+        """Decode each physical code once and hand new payloads to the sink."""
+        now = self.clock()
+        if self.track:
+            tracks = self.tracker.update([detection.box for detection in detections], now)
+            # ✅ Codes already decoded on an earlier frame are skipped, so most frames decode nothing
+            due = [track for track in tracks if track.data is None and now >= track.next_decode]
+        else:
+            due = [Track(detection.box, now) for detection in detections]
+        if not due:
+            return
+
+        with self.backend.frame(request, "main") as frame:
+            for track in due:
+                x, y, w, h = track.box
+                track.data = self.decode_qr_code(frame, x, y, w, h)  # Decode the QR code
+                track.next_decode = now + DECODE_RETRY_INTERVAL
+
+                if track.data and (not self.track or self.deduplicator.first_seen(track.data, now)):
+                    self.sink.send(track.data)  # ✅ Send only new codes
+
+    def _timed(self, stage, function, *args):
+        if not self.profile:
+            return function(*args)
+        started = time.perf_counter()
+        result = function(*args)
+        self.timings[stage] += time.perf_counter() - started
+        return result
@@ -0,0 +1,133 @@
+import os
+import random
+import time
+from contextlib import contextmanager
+import cv2
+import numpy as np
+from pipeline import FrameBackend
+
+
+class ReplayFrame:
+    """One frame with the detection tensors the camera produced for it (boxes already in frame pixels)."""
+
+    def __init__(self, frame, boxes, scores, classes, timestamp):
+        self.frame = frame
+        self.boxes = boxes
+        self.scores = scores
+        self.classes = classes
+        self.timestamp = timestamp
+
+
+class ReplayBackend(FrameBackend):
+    """Feeds ReplayFrames to the pipeline in place of the camera; the frame itself is the request."""
+
+    def metadata(self, request):
+        return request
+
+    def get_outputs(self, metadata):
+        if metadata.boxes is None:
+            return None
+        return metadata.boxes, metadata.scores, metadata.classes
+
+    def convert_box(self, coords, metadata):
+        return tuple(int(v) for v in coords)
+
+    @contextmanager
+    def frame(self, request, stream="main"):
+        yield request.frame
+
+
+class Recorder:
+    """Saves each frame and its detections (all of them, before the confidence filter) for replay."""
+
+    def __init__(self, directory, backend):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.backend = backend
+        self.count = 0
+        self.started = time.monotonic()
+
+    def record(self, request):
+        metadata = self.backend.metadata(request)
+        outputs = self.backend.get_outputs(metadata)
+        with self.backend.frame(request) as frame:
+            image = np.array(frame, copy=True)
+
+        arrays = {"frame": image, "timestamp": np.float64(time.monotonic() - self.started)}
+        if outputs is not None:
+            boxes, scores, classes = outputs
+            arrays["boxes"] = np.array([self.backend.convert_box(box, metadata) for box in boxes], dtype=np.int32)
+            arrays["scores"] = np.asarray(scores, dtype=np.float32)
+            arrays["classes"] = np.asarray(classes)
+        np.savez_compressed(os.path.join(self.directory, f"frame_{self.count:06d}.npz"), **arrays)
+        self.count += 1
+
+
+def load_recording(directory):
+    """The ReplayFrames saved by a Recorder, in order, with timestamps counted from the first frame."""
+    frames = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".npz"):
+            continue
+        with np.load(os.path.join(directory, name)) as data:
+            has_outputs = "boxes" in data
+            frames.append(ReplayFrame(
+                data["frame"],
+                data["boxes"] if has_outputs else None,
+                data["scores"] if has_outputs else None,
+                data["classes"] if has_outputs else None,
+                float(data["timestamp"]),
+            ))
+    if frames:
+        start = frames[0].timestamp
+        for frame in frames:
+            frame.timestamp -= start
+    return frames
+
+
+def synthesize(frames=300, codes=10, width=640, height=480, fps=30.0, code_size=120, seed=42):
+    """
+    Frames of QR labels moving across a conveyor, as the camera would see them.
+
+    Each code stays in view for a couple of seconds, its box jitters by a few
+    pixels between frames, and low-confidence false positives are mixed in.
+    Returns (frames, payloads of the codes shown).
+    """
+    rnd = random.Random(seed)
+    encoder = cv2.QRCodeEncoder.create()
+    payloads = [f"name=item-{i}|category=synthetic|quantity={rnd.randint(1, 20)}" for i in range(codes)]
+    images = []
+    for payload in payloads:
+        image = cv2.resize(encoder.encode(payload), (code_size, code_size), interpolation=cv2.INTER_NEAREST)
+        images.append(cv2.cvtColor(image, cv2.COLOR_GRAY2BGR))
+
+    background = np.full((height, width, 3), 90, dtype=np.uint8)
+    # Codes enter one after another and cross the frame in about two seconds
+    speed = (width + code_size) / (2 * fps)
+    spacing = max(frames // max(codes, 1), 1)
+
+    result = []
+    for i in range(frames):
+        frame = background.copy()
+        boxes, scores = [], []
+        for k, image in enumerate(images):
+            x = int((i - k * spacing) * speed) - code_size
+            if x < 0 or x + code_size > width:
+                continue
+            y = (height - code_size) // 2 + (k % 3 - 1) * code_size // 2
+            frame[y : y + code_size, x : x + code_size] = image
+            jitter = rnd.randint(-3, 3)
+            boxes.append((x + jitter, y + jitter, code_size, code_size))
+            scores.append(rnd.uniform(0.5, 0.95))
+        if rnd.random() < 0.3:
+            boxes.append((rnd.randint(0, width - 60), rnd.randint(0, height - 60), 60, 60))
+            scores.append(rnd.uniform(0.05, 0.35))
+
+        result.append(ReplayFrame(
+            frame,
+            np.array(boxes, dtype=np.int32).reshape(-1, 4),
+            np.array(scores, dtype=np.float32),
+            np.zeros(len(boxes), dtype=np.int32),
+            i / fps,
+        ))
+    return result, payloads
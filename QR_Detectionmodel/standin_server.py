@@ -0,0 +1,94 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StandInServer:
+    """
+    A local stand-in for the backend's /api/store_qr/batch/ endpoint.
+
+    Counts scans by scan_id the way the backend deduplicates them, and can be
+    taken offline and back (set_online) to simulate network outages.
+    """
+
+    def __init__(self, port=0, latency=0.0):
+        self.port = port
+        self.latency = latency  # Seconds added to every response
+        self.scan_ids = set()
+        self.requests = 0
+        self.duplicates = 0
+        self.lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}/api/store_qr/batch/"
+
+    def start(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                try:
+                    scans = json.loads(body)["scans"]
+                except (ValueError, KeyError):
+                    return self._reply(400, {"error": "scans must be a list"})
+
+                time.sleep(stand_in.latency)
+                accepted = stand_in.receive(scans)
+                self._reply(202, {"success": True, "accepted": accepted, "duplicates": len(scans) - accepted})
+
+            def _reply(self, status, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        ThreadingHTTPServer.allow_reuse_address = True
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def set_online(self, online):
+        """Refuse connections (offline) or accept them again on the same port."""
+        if online:
+            self.start()
+        else:
+            self.stop()
+
+    def receive(self, scans):
+        with self.lock:
+            self.requests += 1
+            fresh = {scan["scan_id"] for scan in scans} - self.scan_ids
+            self.duplicates += len(scans) - len(fresh)
+            self.scan_ids |= fresh
+        return len(fresh)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stand-in QR batch endpoint")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = StandInServer(args.port, args.latency).start()
+    print(f"Stand-in server listening on {server.url}")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"{len(server.scan_ids)} scans received in {server.requests} requests ({server.duplicates} duplicates)")
+    except KeyboardInterrupt:
+        server.stop()
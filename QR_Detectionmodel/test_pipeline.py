@@ -0,0 +1,147 @@
+import unittest
+import numpy as np
+from benchmark import CountingSink
+from pipeline import DECODE_RETRY_INTERVAL, BoxTracker, Deduplicator, DetectionPipeline, iou
+from replay import ReplayBackend, ReplayFrame, synthesize
+
+
+class IouTest(unittest.TestCase):
+    def test_overlap(self):
+        self.assertEqual(iou((0, 0, 10, 10), (0, 0, 10, 10)), 1.0)
+        self.assertAlmostEqual(iou((0, 0, 10, 10), (5, 0, 10, 10)), 50 / 150)
+        self.assertEqual(iou((0, 0, 10, 10), (20, 20, 10, 10)), 0.0)
+        self.assertEqual(iou((0, 0, 0, 0), (0, 0, 0, 0)), 0.0)
+
+
+class BoxTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.tracker = BoxTracker(iou_threshold=0.3, ttl=1.0)
+
+    def test_a_box_that_moves_a_little_keeps_its_track(self):
+        (first,) = self.tracker.update([(100, 100, 50, 50)], now=0.0)
+        first.data = "name=Widget|category=Tools|quantity=1"
+
+        (second,) = self.tracker.update([(104, 98, 50, 50)], now=0.1)
+
+        self.assertIs(second, first)
+        self.assertEqual(second.box, (104, 98, 50, 50))
+        self.assertEqual(second.data, "name=Widget|category=Tools|quantity=1")
+
+    def test_each_box_gets_its_own_track(self):
+        left, right = self.tracker.update([(0, 0, 50, 50), (200, 0, 50, 50)], now=0.0)
+        # Listed in the other order on the next frame
+        right_again, left_again = self.tracker.update([(202, 0, 50, 50), (2, 0, 50, 50)], now=0.1)
+
+        self.assertIsNot(left, right)
+        self.assertIs(left_again, left)
+        self.assertIs(right_again, right)
+
+    def test_two_boxes_never_share_a_track(self):
+        (track,) = self.tracker.update([(0, 0, 50, 50)], now=0.0)
+
+        first, second = self.tracker.update([(0, 0, 50, 50), (5, 5, 50, 50)], now=0.1)
+
+        self.assertIs(first, track)
+        self.assertIsNot(second, track)
+        self.assertEqual(len(self.tracker.tracks), 2)
+
+    def test_a_box_far_from_every_track_starts_a_new_one(self):
+        (track,) = self.tracker.update([(0, 0, 50, 50)], now=0.0)
+
+        (other,) = self.tracker.update([(300, 300, 50, 50)], now=0.1)
+
+        self.assertIsNot(other, track)
+        self.assertIsNone(other.data)
+
+    def test_tracks_unseen_for_longer_than_the_ttl_are_dropped(self):
+        (track,) = self.tracker.update([(0, 0, 50, 50)], now=0.0)
+        self.tracker.update([], now=0.9)
+        self.assertEqual(self.tracker.tracks, [track])
+
+        (again,) = self.tracker.update([(0, 0, 50, 50)], now=2.0)
+
+        self.assertIsNot(again, track)
+        self.assertEqual(self.tracker.tracks, [again])
+
+
+class DeduplicatorTest(unittest.TestCase):
+    def test_a_payload_passes_once_per_window(self):
+        deduplicator = Deduplicator(window=10.0)
+
+        self.assertTrue(deduplicator.first_seen("a", now=0.0))
+        self.assertFalse(deduplicator.first_seen("a", now=9.9))
+        self.assertTrue(deduplicator.first_seen("b", now=9.9))
+        self.assertTrue(deduplicator.first_seen("a", now=10.0))
+        self.assertFalse(deduplicator.first_seen("a", now=19.0))
+
+    def test_expired_payloads_are_forgotten(self):
+        deduplicator = Deduplicator(window=1.0)
+        for i in range(1025):
+            deduplicator.first_seen(f"old-{i}", now=0.0)
+
+        deduplicator.first_seen("new", now=5.0)
+
+        self.assertEqual(deduplicator.seen, {"new": 5.0})
+
+
+class DetectionPipelineTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.frames, cls.payloads = synthesize(frames=150, codes=4)
+
+    def replay(self, frames, **options):
+        sink = CountingSink()
+        current = {"timestamp": 0.0}
+        pipeline = DetectionPipeline(ReplayBackend(), sink, clock=lambda: current["timestamp"], profile=True, **options)
+        for frame in frames:
+            current["timestamp"] = frame.timestamp
+            pipeline.parse_and_draw_detections(frame)
+        return pipeline, sink.sent
+
+    def blank_frames(self, count, interval, boxes=((10, 10, 50, 50),)):
+        return [
+            ReplayFrame(
+                np.zeros((120, 120, 3), dtype=np.uint8),
+                np.array(boxes, dtype=np.int32).reshape(-1, 4),
+                np.full(len(boxes), 0.9, dtype=np.float32),
+                np.zeros(len(boxes), dtype=np.int32),
+                i * interval,
+            )
+            for i in range(count)
+        ]
+
+    def test_each_code_is_decoded_once_and_sent_once(self):
+        tracked, sent = self.replay(self.frames)
+        untracked, sent_untracked = self.replay(self.frames, track=False)
+
+        self.assertEqual(sorted(sent), sorted(self.payloads))
+        self.assertEqual(set(sent_untracked), set(self.payloads))
+        self.assertLess(len(tracked.decode_times), len(untracked.decode_times) / 4)
+
+    def test_low_confidence_boxes_are_ignored(self):
+        frame = self.blank_frames(1, 0.1, boxes=((0, 0, 40, 40), (50, 50, 40, 40)))[0]
+        frame.scores = np.array([0.2, 0.8], dtype=np.float32)
+        pipeline = DetectionPipeline(ReplayBackend(), CountingSink())
+
+        self.assertEqual([detection.box for detection in pipeline.parse_detections(frame)], [(50, 50, 40, 40)])
+
+    def test_frames_without_new_outputs_keep_the_last_detections(self):
+        first, second = self.blank_frames(2, 0.1)
+        second.boxes = None
+        pipeline = DetectionPipeline(ReplayBackend(), CountingSink())
+
+        detections = pipeline.parse_detections(first)
+
+        self.assertIs(pipeline.parse_detections(second), detections)
+
+    def test_a_box_that_does_not_decode_is_retried_at_an_interval(self):
+        frames = self.blank_frames(10, DECODE_RETRY_INTERVAL * 0.6)
+
+        pipeline, sent = self.replay(frames)
+
+        self.assertEqual(sent, [])
+        self.assertEqual(len(pipeline.decode_times), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import tempfile
+import time
+import unittest
+from standin_server import StandInServer
+from uploader import SLOT_SIZE, Uploader
+
+
+class UploaderTest(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.uploader = Uploader(
+            self.server.url, os.path.join(tempfile.mkdtemp(), "qr_buffer.bin"), flush_interval=0.05
+        ).start()
+
+    def tearDown(self):
+        self.uploader.stop(timeout=5)
+        self.server.stop()
+
+    def wait_until_sent(self, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        while len(self.server.scan_ids) < count and time.monotonic() < deadline:
+            time.sleep(0.02)
+
+    def test_oversized_scan_is_dropped_and_later_scans_still_upload(self):
+        self.uploader.send("x" * (SLOT_SIZE + 100))
+        self.uploader.send("name=Widget|category=Tools|quantity=3")
+        self.wait_until_sent(1)
+
+        self.assertTrue(self.uploader._thread.is_alive())
+        self.assertEqual(len(self.server.scan_ids), 1)
+        self.assertEqual(self.uploader.stats()["dropped"], 1)
+        self.assertEqual(self.uploader.pending, 0)
+
+    def test_scans_sent_while_offline_are_uploaded_once_back(self):
+        self.server.set_online(False)
+        for i in range(20):
+            self.uploader.send(f"name=item-{i}|category=Tools|quantity=1")
+        time.sleep(0.2)
+        self.server.set_online(True)
+        self.wait_until_sent(20, timeout=10)
+
+        self.assertEqual(len(self.server.scan_ids), 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,209 @@
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import uuid
+import requests
+
+BATCH_SIZE = 50  # Most scans per POST
+FLUSH_INTERVAL = 0.5  # Seconds a scan may wait for its batch to fill
+BUFFER_CAPACITY = 10000  # Scans the ring buffer holds before the oldest is overwritten
+SLOT_SIZE = 512  # Bytes per scan on disk, length prefix included
+MAX_RETRY_DELAY = 30.0  # Longest wait between attempts while the server is unreachable
+
+
+class ScanTooLarge(ValueError):
+    pass
+
+
+class RingBuffer:
+    """
+    A fixed-size file of scan slots, used as a FIFO that survives restarts.
+
+    The header holds two ever-increasing counters: the sequence number of the
+    oldest unsent scan (head) and of the next free slot (tail). Slot i lives
+    at position i % capacity, so when the buffer is full the oldest scan is
+    overwritten and counted in ``overwritten``.
+    """
+
+    HEADER = struct.Struct("<QQ")
+    LENGTH = struct.Struct("<I")
+
+    def __init__(self, path, capacity=BUFFER_CAPACITY, slot_size=SLOT_SIZE):
+        self.capacity = capacity
+        self.slot_size = slot_size
+        self.overwritten = 0
+
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(self.HEADER.pack(0, 0))
+                f.truncate(self.HEADER.size + capacity * slot_size)
+        self.file = open(path, "r+b")
+        self.head, self.tail = self.HEADER.unpack(self.file.read(self.HEADER.size))
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def append(self, scan):
+        data = json.dumps(scan).encode("utf-8")
+        if len(data) > self.slot_size - self.LENGTH.size:
+            raise ScanTooLarge(f"Scan is larger than a {self.slot_size} byte slot")
+
+        self.file.seek(self._offset(self.tail))
+        self.file.write(self.LENGTH.pack(len(data)) + data)
+        self.tail += 1
+        if len(self) > self.capacity:
+            self.head += 1
+            self.overwritten += 1
+        self._write_header()
+
+    def peek(self, count):
+        """The oldest ``count`` scans, left in the buffer."""
+        scans = []
+        for sequence in range(self.head, min(self.head + count, self.tail)):
+            self.file.seek(self._offset(sequence))
+            (length,) = self.LENGTH.unpack(self.file.read(self.LENGTH.size))
+            scans.append(json.loads(self.file.read(length)))
+        return scans
+
+    def pop(self, count):
+        self.head = min(self.head + count, self.tail)
+        self._write_header()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+    def _offset(self, sequence):
+        return self.HEADER.size + (sequence % self.capacity) * self.slot_size
+
+    def _write_header(self):
+        self.file.seek(0)
+        self.file.write(self.HEADER.pack(self.head, self.tail))
+        self.file.flush()
+
+
+class Uploader:
+    """
+    Sends decoded scans to the backend's batch endpoint from a background thread.
+
+    Every scan gets a scan_id and is written to the ring buffer before any
+    attempt to send it. The thread posts up to ``batch_size`` scans at a time
+    over one pooled connection, and removes them from the buffer only once the
+    server has accepted them. While the server is unreachable, attempts back
+    off exponentially and scans pile up on disk; once it answers again, the
+    buffer drains batch by batch. Because scan_ids travel with the scans, a
+    batch that was stored but whose reply got lost can be re-sent safely.
+    """
+
+    def __init__(self, url, buffer_path, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 capacity=BUFFER_CAPACITY, timeout=5):
+        self.url = url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.buffer = RingBuffer(buffer_path, capacity)
+        self.session = requests.Session()
+        self.sent = 0
+        self.failed_attempts = 0
+        self.dropped = 0  # Scans too large for a buffer slot
+        self._incoming = queue.Queue()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="qr-uploader", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def send(self, qr_text):
+        """Queue a decoded scan; never blocks the caller."""
+        self._incoming.put({"qr_text": qr_text, "scan_id": uuid.uuid4().hex})
+
+    def stop(self, timeout=None):
+        """Try once more to send what is buffered, then stop; anything unsent stays on disk."""
+        self._stopping.set()
+        self._thread.join(timeout)
+
+    @property
+    def pending(self):
+        return len(self.buffer) + self._incoming.qsize()
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "pending": self.pending,
+            "failed_attempts": self.failed_attempts,
+            "dropped": self.dropped,
+            "overwritten": self.buffer.overwritten,
+        }
+
+    def _run(self):
+        delay = self.flush_interval
+        retry_at = 0.0
+        oldest = None  # When the oldest scan still waiting for a full batch arrived
+
+        while True:
+            stopping = self._stopping.is_set()
+            self._take_incoming(timeout=0 if stopping else self.flush_interval / 5)
+            if len(self.buffer) and oldest is None:
+                oldest = time.monotonic()
+
+            now = time.monotonic()
+            due = len(self.buffer) >= self.batch_size or (oldest is not None and now - oldest >= self.flush_interval)
+            if len(self.buffer) and (due or stopping) and (now >= retry_at or stopping):
+                if self._post_batch():
+                    delay = self.flush_interval
+                    retry_at = 0.0
+                    oldest = time.monotonic() if len(self.buffer) else None
+                else:
+                    retry_at = now + delay
+                    delay = min(delay * 2, MAX_RETRY_DELAY)
+
+            if stopping:
+                self.buffer.close()
+                return
+
+    def _take_incoming(self, timeout):
+        try:
+            scan = self._incoming.get(timeout=timeout) if timeout else self._incoming.get_nowait()
+        except queue.Empty:
+            return
+        while True:
+            try:
+                self.buffer.append(scan)
+            except ScanTooLarge as e:
+                # One unstorable scan must not stop the thread and strand everything queued after it
+                self.dropped += 1
+                print(f"[❌] Dropped QR scan {scan['scan_id']}: {e}")
+            try:
+                scan = self._incoming.get_nowait()
+            except queue.Empty:
+                break
+        self.buffer.sync()
+
+    def _post_batch(self):
+        batch = self.buffer.peek(self.batch_size)
+        try:
+            response = self.session.post(self.url, json={"scans": batch}, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            self.failed_attempts += 1
+            print(f"[⚠️] Error sending {len(batch)} QR scans, kept for retry: {e}")
+            return False
+
+        if response.status_code >= 500:
+            self.failed_attempts += 1
+            print(f"[❌] Server error {response.status_code}, kept {len(batch)} QR scans for retry")
+            return False
+        if response.status_code >= 400:
+            # Retrying a request the server refuses would block the buffer forever
+            print(f"[❌] Server refused {len(batch)} QR scans ({response.status_code}): {response.text[:200]}")
+        else:
+            self.sent += len(batch)
+        self.buffer.pop(len(batch))
+        return True
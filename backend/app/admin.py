@@ -1,6 +1,9 @@
 from django.contrib import admin
 from django.contrib.auth.models import User
-from .models import Category, Product, Retailer, Order, Employee, Truck, Shipment, QRScan
+from .models import (
+    Category, Product, Retailer, Order, Employee, Truck, Shipment, QRScan, AllocationCheckpoint, AllocationJob,
+    InventoryMovement, StockSnapshot
+)
 
 # ✅ Category Admin
 @admin.register(Category)
@@ -61,6 +64,46 @@ class ShipmentAdmin(admin.ModelAdmin):
 # ✅ QRScan Admin
 @admin.register(QRScan)
 class QRScanAdmin(admin.ModelAdmin):
-    list_display = ('data', 'timestamp', 'processed')
+    list_display = ('data', 'scan_id', 'timestamp', 'processed', 'processed_at', 'error')
     list_filter = ('processed', 'timestamp')
-    search_fields = ('data',)
\ No newline at end of file
+    search_fields = ('data', 'scan_id')
+
+# ✅ Allocation Checkpoint Admin
+@admin.register(AllocationCheckpoint)
+class AllocationCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('last_order_id', 'last_order_date', 'stock_checked_at', 'updated_at')
+
+
+# ✅ Allocation Job Admin
+@admin.register(AllocationJob)
+class AllocationJobAdmin(admin.ModelAdmin):
+    list_display = ('job_id', 'status', 'allocated_count', 'skipped_count', 'created_at', 'finished_at')
+    list_filter = ('status', 'created_at')
+
+
+class ReadOnlyAdmin(admin.ModelAdmin):
+    """Rows written only by the code that keeps them in step with the Product counters."""
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+# ✅ Inventory Ledger Admin (append-only, so read-only here)
+@admin.register(InventoryMovement)
+class InventoryMovementAdmin(ReadOnlyAdmin):
+    list_display = ('movement_id', 'product', 'kind', 'available_delta', 'shipped_delta', 'required_delta', 'reference', 'created_at')
+    list_filter = ('kind', 'created_at')
+    search_fields = ('product__name', 'reference')
+
+
+# ✅ Stock Snapshot Admin (written by compact_snapshots, so read-only here)
+@admin.register(StockSnapshot)
+class StockSnapshotAdmin(ReadOnlyAdmin):
+    list_display = ('product', 'as_of', 'available_quantity', 'total_shipped', 'total_required_quantity')
+    search_fields = ('product__name',)
@@ -1,109 +1,748 @@
+import heapq
 import logging
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from datetime import timedelta
+from django.conf import settings
 from django.db import transaction
-from django.db.models import F
+from django.db.models import Q
+from django.db.models.functions import Mod
+from django.utils import timezone
 from rest_framework.response import Response
-from .models import Order, Employee, Shipment, Product
+from .models import Order, Employee, Shipment, Product, Truck, AllocationCheckpoint, InventoryMovement
+from .routing import DEFAULT_BAND_WIDTH, Route, plan_routes, route_summary
 
 logger = logging.getLogger(__name__)
 
-def allocate_shipments(request):
+
+DEFAULT_STRATEGY = 'first_fit'
+# Batches nearby retailers onto shared trucks instead of placing orders one by one
+ROUTE_STRATEGY = 'route'
+
+# shard key -> Order field whose value modulo the shard count picks the shard.
+# Both keep every order of a product in one shard, so parallel shards lock
+# disjoint product rows. (Sharding by retailer does not: retailers share
+# products, and shards ended up skipping each other's locked rows.)
+SHARD_KEYS = {
+    'product': 'product_id',
+    'category': 'product__category_id',
+}
+LOCKED_REASON = "Locked by a concurrent allocation run"
+CHANGED_REASON = "Order changed during allocation"
+# Orders skipped for these reasons were never decided on, so the next incremental run retries them
+RETRY_REASONS = {LOCKED_REASON, CHANGED_REASON}
+
+
+class FirstFitIndex:
     """
-    Allocate shipments dynamically based on truck capacity, retailer distance, and product stock.
+    Max segment tree over remaining truck capacities, kept in employee order.
+
+    Finds the first employee whose truck still fits a quantity in O(log trucks),
+    which is exactly what the original linear scan returned.
+    """
+
+    def __init__(self, employees):
+        self.employees = employees
+        self.size = 1
+        while self.size < max(len(employees), 1):
+            self.size *= 2
+        self.tree = [0] * (2 * self.size)
+        for i, emp in enumerate(employees):
+            self.tree[self.size + i] = emp.truck.capacity
+        for node in range(self.size - 1, 0, -1):
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+
+    def place(self, quantity):
+        """Reserve quantity on the first truck that fits it and return its employee, or None."""
+        if self.tree[1] < quantity:
+            return None
+        node = 1
+        while node < self.size:
+            node = 2 * node if self.tree[2 * node] >= quantity else 2 * node + 1
+        self.tree[node] -= quantity
+        position = node - self.size
+        node //= 2
+        while node:
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+            node //= 2
+        return self.employees[position]
+
+
+class BestFitIndex:
+    """
+    Trucks bucketed by remaining capacity, with a Fenwick tree counting the buckets.
+
+    Finds the truck with the smallest remaining capacity that still fits a
+    quantity (the lowest employee position on ties), so each placement leaves
+    the least slack. Both the lookup and moving the truck to its new bucket
+    cost O(log max capacity); the tree is a dict, so only the capacities
+    actually reached take memory.
+    """
+
+    def __init__(self, employees):
+        self.employees = employees
+        self.size = 1  # Tree index i counts trucks with i - 1 left, up to the largest capacity
+        while self.size <= max((emp.truck.capacity for emp in employees), default=0):
+            self.size *= 2
+        self.counts = defaultdict(int)
+        self.buckets = defaultdict(list)  # remaining capacity -> heap of employee positions
+        for i, emp in enumerate(employees):
+            self._add(emp.truck.capacity, i)
+
+    def place(self, quantity):
+        """Reserve quantity on the tightest truck that fits it and return its employee, or None."""
+        remaining = self._tightest(quantity)
+        if remaining is None:
+            return None
+        position = heapq.heappop(self.buckets[remaining])
+        self._count(remaining, -1)
+        self._add(remaining - quantity, position)
+        return self.employees[position]
+
+    def _add(self, remaining, position):
+        heapq.heappush(self.buckets[remaining], position)
+        self._count(remaining, 1)
+
+    def _count(self, remaining, delta):
+        index = remaining + 1
+        while index <= self.size:
+            self.counts[index] += delta
+            index += index & -index
+
+    def _tightest(self, quantity):
+        """The smallest remaining capacity of at least quantity that some truck has, or None."""
+        # Trucks with less than quantity left...
+        too_small, index = 0, min(quantity, self.size)
+        while index:
+            too_small += self.counts.get(index, 0)
+            index -= index & -index
+        if too_small == len(self.employees):
+            return None
+        # ...then descend to the last tree index they fill; the next one holds a truck
+        index, step = 0, self.size
+        while step:
+            if index + step <= self.size and self.counts.get(index + step, 0) <= too_small:
+                index += step
+                too_small -= self.counts.get(index, 0)
+            step //= 2
+        return index
+
+
+def _retailer_distance(order):
+    return order.retailer.distance_from_warehouse if order.retailer else float('inf')
+
+
+# strategy name -> (order sort key or None to keep order_date order, capacity index)
+STRATEGIES = {
+    # Oldest order first, onto the first truck that fits (the historical behaviour)
+    'first_fit': (None, FirstFitIndex),
+    # Largest orders first, each onto the tightest truck that fits
+    'best_fit_decreasing': (lambda order: -order.required_qty, BestFitIndex),
+    # Nearest retailers first so short round trips are served before long ones
+    'priority': (_retailer_distance, BestFitIndex),
+}
+
+
+class AllocationPlan:
+    """In-memory result of planning one allocation run, before anything is written."""
+
+    def __init__(self):
+        self.assignments = []  # (order, employee) pairs, in allocation order
+        self.skipped_orders = []
+        self.stock_used = defaultdict(int)  # product_id -> quantity taken from available_quantity
+        self.shortfall = defaultdict(int)  # product_id -> quantity added to total_required_quantity
+        self.loads = defaultdict(int)  # employee_id -> quantity loaded onto their truck
+        self.farthest = defaultdict(float)  # employee_id -> distance of their farthest retailer
+        self.routes = None  # routing.Route list when planned with ROUTE_STRATEGY
+        self.claimed_trucks = set()  # truck_ids this run has already written shipments for
+
+
+def load_pending_orders(checkpoint=None, shard=None, lock=False):
+    """
+    Fetch pending orders with their product and retailer in a single query.
+
+    With a checkpoint only the delta since that run is returned: orders newer
+    than its high-water mark, older ones that changed or whose product gained
+    stock since it ran, and the ones it left to retry. With a shard ({"key", "index", "count"}) only that
+    slice of SHARD_KEYS is returned. With lock, the order rows are locked and
+    rows another run holds are skipped.
+    """
+    orders = _pending_orders(checkpoint, shard)
+
+    if lock:
+        orders = orders.select_for_update(skip_locked=True, of=('self',))
+
+    return list(orders.select_related('product', 'retailer').order_by('order_date', 'order_id'))
+
+
+def _pending_orders(checkpoint=None, shard=None):
+    orders = Order.objects.filter(status='pending')
+
+    if checkpoint is not None and checkpoint.last_order_date is not None:
+        changed = Q(order_date__gt=checkpoint.last_order_date) | Q(
+            order_date=checkpoint.last_order_date, order_id__gt=checkpoint.last_order_id
+        )
+        if checkpoint.stock_checked_at is not None:
+            changed |= Q(updated_at__gt=checkpoint.stock_checked_at)
+            changed |= Q(product__stock_updated_at__gt=checkpoint.stock_checked_at)
+        if checkpoint.retry_order_ids:
+            changed |= Q(order_id__in=checkpoint.retry_order_ids)
+        orders = orders.filter(changed)
+
+    if shard is not None:
+        orders = orders.annotate(shard=Mod(SHARD_KEYS[shard["key"]], shard["count"])).filter(shard=shard["index"])
+
+    return orders
+
+
+def lock_order_products(orders):
+    """
+    Lock the products of the given orders, skipping rows another run holds.
+
+    Orders whose product is locked elsewhere are set aside and stay pending for
+    a later run; the rest get the freshly read, locked product so stock is
+    checked against current values. Returns (lockable orders, skipped entries).
+    """
+    products = {
+        product.product_id: product
+        for product in Product.objects.select_for_update(skip_locked=True).filter(
+            product_id__in={order.product_id for order in orders}
+        )
+    }
+
+    lockable = []
+    skipped = []
+    for order in orders:
+        if order.product_id in products:
+            order.product = products[order.product_id]
+            lockable.append(order)
+        else:
+            skipped.append({"order_id": order.order_id, "reason": LOCKED_REASON})
+    return lockable, skipped
+
+
+def load_available_employees(shard=None, lock=False):
+    """
+    Fetch employees whose truck has no shipment in transit, in a single query.
+
+    With a shard, trucks are split by employee_id so parallel shards draw on
+    disjoint trucks. With lock, the employee and truck rows are locked and rows
+    another run holds are skipped.
+    """
+    # A shipment whose employee has no truck would put a NULL in the NOT IN list, which then matches nothing
+    in_transit_trucks = Shipment.objects.filter(
+        status='in_transit', employee__truck__isnull=False
+    ).values('employee__truck')
+    employees = Employee.objects.filter(truck__isnull=False).exclude(truck__in=in_transit_trucks)
+
+    if shard is not None:
+        employees = employees.annotate(shard=Mod('employee_id', shard["count"])).filter(shard=shard["index"])
+
+    if lock:
+        employees = employees.select_for_update(skip_locked=True, of=('self', 'truck'))
+
+    return list(employees.select_related('truck').order_by('employee_id'))
+
+
+def plan_allocation(orders, employees, strategy=DEFAULT_STRATEGY):
+    """
+    Decide every assignment in Python without touching the database.
+
+    Stock and truck capacity are tracked in memory, so several orders for the
+    same product see each other's reservations. ``strategy`` picks the order in
+    which orders are considered and how a truck is chosen (see STRATEGIES).
+    """
+    sort_key, index_class = STRATEGIES[strategy]
+    if sort_key:
+        # sorted() is stable, so ties keep their order_date order
+        orders = sorted(orders, key=sort_key)
+
+    plan = AllocationPlan()
+    trucks = index_class(employees)
+    remaining_stock = {}
+
+    for order in orders:
+        if not _has_stock(plan, order, remaining_stock):
+            continue
+
+        employee = trucks.place(order.required_qty)
+
+        if not employee:
+            plan.skipped_orders.append({"order_id": order.order_id, "reason": "No suitable truck available"})
+            continue
+
+        remaining_stock[order.product.product_id] -= order.required_qty
+        _assign(plan, order, employee)
+
+    return plan
+
+
+def plan_routed_allocation(orders, employees, band_width=DEFAULT_BAND_WIDTH):
+    """
+    Plan with the route-batching stage (see routing.plan_routes).
+
+    Stock is reserved oldest order first, then every order that has stock is
+    routed in one batch. Orders left without a truck give their stock back, so
+    orders that were short of it are reserved and routed again onto the trucks
+    still free, until no more stock comes back.
+    """
+    plan = AllocationPlan()
+    remaining_stock = {}
+    free = list(employees)
+    routes = []
+    waiting = [order for order in orders if _is_valid(plan, order)]
+
+    while True:
+        stocked, short = [], []
+        for order in waiting:
+            available = remaining_stock.setdefault(order.product.product_id, order.product.available_quantity)
+            if available < order.required_qty:
+                short.append(order)
+                continue
+            remaining_stock[order.product.product_id] -= order.required_qty
+            stocked.append(order)
+
+        new_routes, unrouted = plan_routes(stocked, free, band_width)
+        routes.extend(new_routes)
+        loaded = {route.employee.employee_id for route in new_routes}
+        free = [emp for emp in free if emp.employee_id not in loaded]
+
+        for order in unrouted:
+            remaining_stock[order.product.product_id] += order.required_qty
+            plan.skipped_orders.append({"order_id": order.order_id, "reason": "No suitable truck available"})
+
+        waiting = short
+        if not unrouted or not short:
+            break
+
+    for order in waiting:
+        _skip_for_stock(plan, order)
+
+    for route in routes:
+        for order in route.orders:
+            _assign(plan, order, route.employee)
+
+    plan.routes = routes
+    return plan
+
+
+def _has_stock(plan, order, remaining_stock):
+    """Check an order against the stock left in this run, recording why it is skipped if not."""
+    if not _is_valid(plan, order):
+        return False
+
+    available = remaining_stock.setdefault(order.product.product_id, order.product.available_quantity)
+
+    if available < order.required_qty:
+        _skip_for_stock(plan, order)
+        return False
+
+    return True
+
+
+def _is_valid(plan, order):
+    if not order.product or not order.retailer:
+        plan.skipped_orders.append({"order_id": order.order_id, "reason": "Invalid product or retailer"})
+        return False
+    return True
+
+
+def _skip_for_stock(plan, order):
+    plan.skipped_orders.append({"order_id": order.order_id, "reason": "Insufficient stock"})
+    plan.shortfall[order.product.product_id] += order.required_qty
+
+
+def _assign(plan, order, employee):
+    plan.loads[employee.employee_id] += order.required_qty
+    plan.farthest[employee.employee_id] = max(plan.farthest[employee.employee_id], order.retailer.distance_from_warehouse)
+    plan.stock_used[order.product.product_id] += order.required_qty
+    plan.assignments.append((order, employee))
+
+
+def advance_checkpoint(checkpoint, orders, employees, started_at, retry_order_ids=()):
+    """
+    Move the high-water mark past everything this run has seen.
+
+    Orders it saw or skipped without deciding on (retry_order_ids) may fall
+    below the new mark, so they are kept on the checkpoint for the next run.
     """
-    allocated_orders = []
-    skipped_orders = []
+    if orders:
+        newest = max(orders, key=lambda order: (order.order_date, order.order_id))
+        if checkpoint.last_order_date is None or (newest.order_date, newest.order_id) > (
+            checkpoint.last_order_date, checkpoint.last_order_id
+        ):
+            checkpoint.last_order_date = newest.order_date
+            checkpoint.last_order_id = newest.order_id
+    checkpoint.stock_checked_at = started_at
+    checkpoint.truck_ids = sorted(emp.truck.truck_id for emp in employees)
+    checkpoint.retry_order_ids = sorted(retry_order_ids)
+    checkpoint.save()
+
 
+def _claim_expired():
+    """Claims made before this belong to a run that died without releasing them (see ALLOCATION_JOB_TIMEOUT)."""
+    return timezone.now() - timedelta(seconds=settings.ALLOCATION_JOB_TIMEOUT)
+
+
+@contextmanager
+def claimed_checkpoint():
+    """
+    Hold the incremental checkpoint for a chunked run, from its read to its advance.
+
+    Each chunk commits on its own, so a row lock would not outlive the first
+    one; the run instead sets claimed_at with a compare-and-set UPDATE and
+    clears it when done. Raises AllocationError if another run holds it.
+    """
+    AllocationCheckpoint.load()
+    claimable = Q(claimed_at__isnull=True) | Q(claimed_at__lt=_claim_expired())
+    if not AllocationCheckpoint.objects.filter(claimable, pk=1).update(claimed_at=timezone.now()):
+        raise AllocationError("Another incremental allocation run is in progress")
     try:
+        yield
+    finally:
+        AllocationCheckpoint.objects.filter(pk=1).update(claimed_at=None)
+
+
+def truck_utilization(plan, employees):
+    """Summarise how full each available truck ends up under the plan."""
+    trucks = []
+    for emp in employees:
+        loaded = plan.loads.get(emp.employee_id, 0)
+        trucks.append({
+            "truck_id": emp.truck.truck_id,
+            "license_plate": emp.truck.license_plate,
+            "capacity": emp.truck.capacity,
+            "loaded": loaded,
+            "utilization": round(loaded / emp.truck.capacity, 4) if emp.truck.capacity else 0.0,
+            # Out to the farthest retailer and back
+            "distance": round(2 * plan.farthest.get(emp.employee_id, 0.0), 2),
+        })
+
+    used = [truck for truck in trucks if truck["loaded"]]
+    used_capacity = sum(truck["capacity"] for truck in used)
+    return {
+        "trucks_used": len(used),
+        "trucks_available": len(trucks),
+        # Fill rate of the trucks that actually leave the warehouse
+        "average_utilization": round(sum(truck["loaded"] for truck in used) / used_capacity, 4) if used_capacity else 0.0,
+        "total_distance": round(sum(truck["distance"] for truck in used), 2),
+        "trucks": trucks,
+    }
+
+
+def request_param(request, name, default=None):
+    """Read an allocation option from the POST body, falling back to the query string."""
+    if request is None:
+        return default
+    value = request.data.get(name) if hasattr(request.data, 'get') else None
+    if value in (None, ''):
+        value = request.query_params.get(name)
+    return default if value in (None, '') else value
+
+
+def request_flag(request, name):
+    return str(request_param(request, name, False)).lower() in ('1', 'true', 'yes')
+
+
+def apply_plan(plan, chunk_size=None, progress=None):
+    """
+    Write a plan with a fixed number of queries per chunk, regardless of how many orders it holds.
+
+    Shipments are bulk-inserted, orders are flipped to 'allocated' in one UPDATE,
+    every touched product gets a single aggregated stock UPDATE and their status
+    is then recomputed in one more. Without ``chunk_size`` everything is written
+    as one chunk; otherwise each chunk of assignments commits in its own
+    transaction and ``progress(done, total)`` is called after each one.
+
+    Returns the (order, shipment) pairs that were written.
+    """
+    assignments = list(plan.assignments)
+    size = chunk_size or max(len(assignments), 1)
+    written = []
+    # Shortfall is bookkept once, with the first chunk
+    shortfall = plan.shortfall
+
+    for start in range(0, max(len(assignments), 1), size):
         with transaction.atomic():
-            # Fetch all pending orders with related product and retailer
-            orders = Order.objects.filter(status='pending').select_related('product', 'retailer').order_by('order_date')
+            written.extend(_apply_chunk(plan, assignments[start:start + size], shortfall))
+        shortfall = {}
+        if progress:
+            progress(min(start + size, len(assignments)), len(assignments))
+
+    return written
+
+
+def _apply_chunk(plan, assignments, shortfall):
+    if not assignments and not shortfall:
+        return []
+
+    assignments = _revalidate(plan, assignments)
+
+    stock_used = defaultdict(int)
+    for order, _ in assignments:
+        stock_used[order.product.product_id] += order.required_qty
+
+    shipments = Shipment.objects.bulk_create([
+        Shipment(order=order, employee=employee, status='in_transit')
+        for order, employee in assignments
+    ])
+
+    # pending -> allocated leaves total_required_quantity unchanged, so the Order
+    # signals skipped by update() have nothing to contribute here.
+    Order.objects.filter(order_id__in=[order.order_id for order, _ in assignments]).update(
+        status='allocated', updated_at=timezone.now()
+    )
+
+    Product.objects.add_quantities(
+        available_quantity={product_id: -quantity for product_id, quantity in stock_used.items()},
+        total_required_quantity=shortfall,
+    )
+    InventoryMovement.objects.record(
+        'allocation', available={product_id: -quantity for product_id, quantity in stock_used.items()}
+    )
+    InventoryMovement.objects.record('demand', required=shortfall)
+    Product.objects.filter(product_id__in=set(stock_used) | set(shortfall)).refresh_status()
+
+    # Mirrors the Shipment post_save signal, which bulk_create does not send
+    Truck.objects.filter(
+        truck_id__in={employee.truck.truck_id for _, employee in assignments}
+    ).update(is_available=False)
+
+    plan.claimed_trucks.update(employee.truck.truck_id for _, employee in assignments)
+    return [(order, shipment) for (order, _), shipment in zip(assignments, shipments)]
+
+
+def _revalidate(plan, assignments):
+    """
+    Re-check a chunk under row locks just before it is written.
+
+    Chunked runs plan from an unlocked read, so between planning and writing
+    another run may have taken an order, a product's stock or a truck. Rows
+    another run is holding are skipped rather than waited on. Whatever no
+    longer holds is dropped from the plan; the rest is returned.
+    """
+    still_pending = set(
+        Order.objects.select_for_update(skip_locked=True, of=('self',))
+        .filter(order_id__in=[order.order_id for order, _ in assignments], status='pending')
+        .values_list('order_id', flat=True)
+    )
+    stock = dict(
+        Product.objects.select_for_update(skip_locked=True)
+        .filter(product_id__in={order.product_id for order, _ in assignments})
+        .values_list('product_id', 'available_quantity')
+    )
+    # Trucks this run has not loaded yet must still be free of other runs' shipments
+    taken_trucks = set(
+        Shipment.objects.filter(
+            status='in_transit',
+            employee__truck__in={employee.truck.truck_id for _, employee in assignments} - plan.claimed_trucks,
+        ).values_list('employee__truck', flat=True)
+    )
+
+    valid = []
+    dropped = set()
+    for order, employee in assignments:
+        if order.order_id not in still_pending:
+            reason = CHANGED_REASON
+        elif order.product_id not in stock:
+            reason = LOCKED_REASON
+        elif stock[order.product_id] < order.required_qty:
+            reason = "Insufficient stock"
+        elif employee.truck.truck_id in taken_trucks:
+            reason = "No suitable truck available"
+        else:
+            stock[order.product_id] -= order.required_qty
+            valid.append((order, employee))
+            continue
+
+        dropped.add(order.order_id)
+        plan.skipped_orders.append({"order_id": order.order_id, "reason": reason})
 
-            # Get truck IDs currently in transit
-            assigned_truck_ids = set(
-                Shipment.objects.filter(status='in_transit').values_list('employee__truck__truck_id', flat=True)
-            )
+    if dropped:
+        _drop(plan, dropped)
+    return valid
 
-            # Get employees who have available trucks
-            available_employees = Employee.objects.exclude(truck__truck_id__in=assigned_truck_ids).select_related('truck')
 
-            if not available_employees.exists():
-                return Response({"error": "No available employees with trucks"}, status=400)
+def _drop(plan, order_ids):
+    """Take orders out of a plan, recomputing the totals and routes derived from its assignments."""
+    assignments = [(order, employee) for order, employee in plan.assignments if order.order_id not in order_ids]
+    plan.assignments = []
+    plan.loads.clear()
+    plan.farthest.clear()
+    plan.stock_used.clear()
+    for order, employee in assignments:
+        _assign(plan, order, employee)
 
-            # Map truck capacities
-            truck_capacity_map = {emp.truck.truck_id: emp.truck.capacity for emp in available_employees}
+    if plan.routes is not None:
+        routes = [
+            Route(route.employee, [order for order in route.orders if order.order_id not in order_ids])
+            for route in plan.routes
+        ]
+        plan.routes = [route for route in routes if route.orders]
 
-            for order in orders:
-                product = order.product
-                retailer = order.retailer
 
-                if not product or not retailer:
-                    skipped_orders.append({"order_id": order.order_id, "reason": "Invalid product or retailer"})
-                    continue
+class AllocationError(Exception):
+    """A run that cannot start, reported to the client as a 400."""
 
-                if product.available_quantity < order.required_qty:
-                    skipped_orders.append({"order_id": order.order_id, "reason": "Insufficient stock"})
 
-                    # Increase total required quantity
-                    Product.objects.filter(product_id=product.product_id).update(
-                        total_required_quantity=F('total_required_quantity') + order.required_qty
-                    )
+def run_allocation(strategy=DEFAULT_STRATEGY, dry_run=False, incremental=False,
+                   band_width=DEFAULT_BAND_WIDTH, shard=None, chunk_size=None, progress=None):
+    """
+    Plan and write one allocation run and return its response payload.
+
+    Without ``chunk_size`` the whole run is a single transaction that locks the
+    orders, products and trucks it loads, skipping rows a concurrent run holds,
+    so parallel runs (typically one per ``shard``) work on disjoint rows. With
+    it, the plan is built from one unlocked read and written chunk by chunk
+    (see apply_plan), each chunk re-validated under the same skip-locked locks;
+    an incremental chunked run holds the checkpoint through claimed_checkpoint().
+    """
+    locking = chunk_size is None
+    claiming = incremental and not locking and not dry_run
+
+    with claimed_checkpoint() if claiming else nullcontext(), transaction.atomic() if locking else nullcontext():
+        employees = load_available_employees(shard, lock=locking)
+
+        if not employees:
+            raise AllocationError("No available employees with trucks")
+
+        checkpoint = None
+        if incremental:
+            started_at = timezone.now()
+            checkpoint = AllocationCheckpoint.load(lock=locking)
+            if locking and not dry_run and checkpoint.claimed_at and checkpoint.claimed_at >= _claim_expired():
+                raise AllocationError("Another incremental allocation run is in progress")
+            # A truck that came back frees capacity for orders skipped earlier,
+            # so those runs have to look at every pending order again.
+            delta = None if {emp.truck.truck_id for emp in employees} - set(checkpoint.truck_ids) else checkpoint
+            orders = load_pending_orders(delta, lock=locking)
+        else:
+            orders = load_pending_orders(shard=shard, lock=locking)
+        loaded = orders
+
+        locked_out = []
+        if locking:
+            orders, locked_out = lock_order_products(orders)
+
+        if strategy == ROUTE_STRATEGY:
+            plan = plan_routed_allocation(orders, employees, band_width)
+        else:
+            plan = plan_allocation(orders, employees, strategy)
+        plan.skipped_orders.extend(locked_out)
+
+        # A dry run reports the plan without writing shipments, orders or stock
+        if dry_run:
+            written = [(order, None) for order, _ in plan.assignments]
+        else:
+            written = apply_plan(plan, chunk_size, progress)
 
-                    # Refresh and update status
-                    product.refresh_from_db()
-                    product.update_status()
-                    product.save(update_fields=['status'])
+        if checkpoint is not None and not dry_run:
+            retry = {entry["order_id"] for entry in plan.skipped_orders if entry["reason"] in RETRY_REASONS}
+            if locking:
+                # The locked read skipped order rows other runs held without ever seeing them
+                seen = {order.order_id for order in loaded}
+                retry |= set(_pending_orders(delta).values_list('order_id', flat=True)) - seen
+            advance_checkpoint(checkpoint, loaded, employees, started_at, retry)
 
-                    continue
+    mode = [strategy]
+    if incremental:
+        mode.append("incremental")
+    if dry_run:
+        mode.append("dry run")
+    if shard:
+        mode.append(f"shard {shard['index']}/{shard['count']} by {shard['key']}")
+    logger.info(
+        f"Allocation run ({', '.join(mode)}): {len(orders)} orders considered, {len(written)} allocated, "
+        f"{len(plan.skipped_orders)} skipped, {len(plan.stock_used)} products drawn down"
+    )
 
-                # Find an employee with a truck that has enough capacity
-                employee = next(
-                    (emp for emp in available_employees if truck_capacity_map.get(emp.truck.truck_id, 0) >= order.required_qty),
-                    None
-                )
+    payload = {
+        "allocated_orders": [
+            {
+                "order_id": order.order_id,
+                "shipment_id": shipment.shipment_id if shipment else None,
+                "status": "planned" if dry_run else "allocated"
+            }
+            for order, shipment in written
+        ],
+        "skipped_orders": plan.skipped_orders,
+        "strategy": strategy,
+        "dry_run": dry_run,
+        "incremental": incremental,
+        "shard": shard,
+        "truck_utilization": truck_utilization(plan, employees),
+    }
+    if plan.routes is not None:
+        payload["routes"] = [route.as_dict() for route in plan.routes]
+        payload["route_summary"] = route_summary(plan.routes, [order for order, _ in plan.assignments])
 
-                if not employee:
-                    skipped_orders.append({"order_id": order.order_id, "reason": "No suitable truck available"})
-                    continue
+    return payload
 
-                truck = employee.truck  
 
-                # Create a new shipment
-                shipment = Shipment.objects.create(
-                    order=order,
-                    employee=employee,
-                    status='in_transit'
-                )
+def allocation_options(request):
+    """
+    Validate the allocation options sent with a request into run_allocation() kwargs.
 
-                # Log product details before update
-                logger.info(f"Before update: Product {product.name} - Available: {product.available_quantity}, Required: {product.total_required_quantity}, Status: {product.status}")
+    ``strategy`` selects one of STRATEGIES or ROUTE_STRATEGY (default first_fit),
+    ``band_width`` tunes route batching, ``dry_run`` only reports the plan and
+    ``incremental`` re-plans just the orders changed since the last incremental
+    run (see AllocationCheckpoint). ``shard_key`` with ``shard_index`` and
+    ``shard_count`` restricts the run to one slice of SHARD_KEYS so several runs
+    can proceed in parallel. Raises AllocationError on bad input.
+    """
+    strategy = request_param(request, "strategy", DEFAULT_STRATEGY)
+    if strategy not in STRATEGIES and strategy != ROUTE_STRATEGY:
+        choices = ', '.join([*STRATEGIES, ROUTE_STRATEGY])
+        raise AllocationError(f"Unknown allocation strategy '{strategy}'. Choose one of: {choices}")
 
-                # Reduce available quantity
-                Product.objects.filter(product_id=product.product_id).update(
-                    available_quantity=F('available_quantity') - order.required_qty
-                )
+    try:
+        band_width = float(request_param(request, "band_width", DEFAULT_BAND_WIDTH))
+    except (TypeError, ValueError):
+        raise AllocationError("band_width must be a number")
 
-                # Refresh and update status
-                product.refresh_from_db()
-                product.update_status()
-                product.save(update_fields=['status'])
+    incremental = request_flag(request, "incremental")
 
-                # Log product details after update
-                logger.info(f"After update: Product {product.name} - Available: {product.available_quantity}, Required: {product.total_required_quantity}, Status: {product.status}")
+    shard = None
+    shard_key = request_param(request, "shard_key")
+    if shard_key is not None:
+        if shard_key not in SHARD_KEYS:
+            raise AllocationError(f"Unknown shard_key '{shard_key}'. Choose one of: {', '.join(SHARD_KEYS)}")
+        if incremental:
+            # The checkpoint is a single high-water mark shared by every run
+            raise AllocationError("Incremental runs cannot be sharded")
+        try:
+            shard = {
+                "key": shard_key,
+                "index": int(request_param(request, "shard_index", 0)),
+                "count": int(request_param(request, "shard_count", 1)),
+            }
+        except (TypeError, ValueError):
+            raise AllocationError("shard_index and shard_count must be integers")
+        if not 0 <= shard["index"] < shard["count"]:
+            raise AllocationError("shard_index must be between 0 and shard_count - 1")
 
-                # Update truck capacity
-                truck_capacity_map[truck.truck_id] -= order.required_qty
+    return {
+        "strategy": strategy,
+        "band_width": band_width,
+        "dry_run": request_flag(request, "dry_run"),
+        "incremental": incremental,
+        "shard": shard,
+    }
 
-                # Mark order as allocated
-                order.status = 'allocated'
-                order.save()
 
-                allocated_orders.append({
-                    "order_id": order.order_id,
-                    "shipment_id": shipment.shipment_id,
-                    "status": "allocated"
-                })
+def allocate_shipments(request):
+    """
+    Allocate shipments dynamically based on truck capacity, retailer distance, and product stock.
+
+    Pending orders, stock and truck capacity are loaded once, every assignment is
+    decided in memory and the result is written back with bulk queries. See
+    allocation_options() for the request parameters.
+    """
+    try:
+        return Response(run_allocation(**allocation_options(request)))
 
-        return Response({"allocated_orders": allocated_orders, "skipped_orders": skipped_orders})
+    except AllocationError as e:
+        return Response({"error": str(e)}, status=400)
 
     except Exception as e:
         logger.error(f"Error: {str(e)}")
@@ -0,0 +1,106 @@
+import orjson
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework import serializers
+
+# Fields whose to_representation returns the database value unchanged
+PASSTHROUGH_FIELDS = (
+    serializers.BooleanField,
+    serializers.CharField,
+    serializers.ChoiceField,
+    serializers.IntegerField,
+    serializers.PrimaryKeyRelatedField,
+)
+# Fields rendered with their own to_representation (timezone, formatting)
+CONVERTED_FIELDS = (serializers.DateTimeField, serializers.DateField, serializers.DecimalField)
+# Passthrough subclasses that still change the value
+UNSUPPORTED_FIELDS = (serializers.MultipleChoiceField,)
+
+# DRF's JSONRenderer escapes these so its output is also valid JavaScript
+JS_ESCAPES = (("\u2028".encode(), b"\\u2028"), ("\u2029".encode(), b"\\u2029"))
+
+
+class UnsupportedField(Exception):
+    pass
+
+
+class ValuesSerializer:
+    """
+    Read-only rendering of a ModelSerializer's fields straight from .values_list() rows.
+
+    No model instances or per-field pipeline: each row is a tuple from the
+    database turned into a dict and encoded with orjson. The output is byte for
+    byte what the serializer and DRF's JSONRenderer produce. Fields whose
+    representation orjson would spell differently (floats, nested serializers,
+    method fields) raise UnsupportedField, so callers fall back to the
+    serializer.
+    """
+
+    def __init__(self, serializer):
+        self.names, self.lookups, self.converters = [], [], []
+        for field in serializer.fields.values():
+            if field.write_only:
+                continue
+            if field.source == "*" or isinstance(field, UNSUPPORTED_FIELDS):
+                raise UnsupportedField(field.field_name)
+            if isinstance(field, CONVERTED_FIELDS):
+                self.converters.append((len(self.names), field.to_representation))
+            elif not isinstance(field, PASSTHROUGH_FIELDS):
+                raise UnsupportedField(field.field_name)
+            self.names.append(field.field_name)
+            self.lookups.append(field.source.replace(".", "__"))
+
+    @classmethod
+    def for_serializer(cls, serializer):
+        """A ValuesSerializer for these fields, or None when one of them needs the serializer."""
+        try:
+            return cls(serializer)
+        except UnsupportedField:
+            return None
+
+    def rows(self, queryset, chunk_size=None):
+        """Each row of the queryset as the dict the serializer would have produced."""
+        names, converters = self.names, self.converters
+        tuples = queryset.values_list(*self.lookups)
+        if chunk_size:
+            tuples = tuples.iterator(chunk_size=chunk_size)
+        for values in tuples:
+            if converters:
+                values = list(values)
+                for index, convert in converters:
+                    if values[index] is not None:
+                        values[index] = convert(values[index])
+            yield dict(zip(names, values))
+
+    def stream(self, queryset, chunk_size=None):
+        """The queryset as one JSON array, in byte chunks of chunk_size rows."""
+        chunk_size = chunk_size or settings.STREAM_CHUNK_SIZE
+        yield b"["
+        chunk, first = [], True
+        for row in self.rows(queryset, chunk_size):
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield self._encode(chunk, first)
+                chunk, first = [], False
+        if chunk:
+            yield self._encode(chunk, first)
+        yield b"]"
+
+    def render(self, queryset):
+        return b"".join(self.stream(queryset))
+
+    def streaming_response(self, queryset, chunk_size=None):
+        return StreamingHttpResponse(self.stream(queryset, chunk_size), content_type="application/json")
+
+    def _encode(self, rows, first):
+        body = orjson.dumps(rows)[1:-1]
+        for char, escaped in JS_ESCAPES:
+            if char in body:
+                body = body.replace(char, escaped)
+        return body if first else b"," + body
+
+
+def wants_plain_json(request):
+    """True when DRF would render compact JSON, which is all ValuesSerializer produces."""
+    renderer = getattr(request, "accepted_renderer", None)
+    return renderer is not None and renderer.format == "json" and "indent" not in (request.accepted_media_type or "")
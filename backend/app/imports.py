@@ -0,0 +1,390 @@
+import bisect
+import csv
+import time
+from collections import defaultdict
+import orjson
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Category, InventoryMovement, Order, Product, Retailer
+from .response_cache import bump_version
+from .stock import record_required_quantities
+
+FORMATS = ("csv", "ndjson")
+MAX_REPORTED_ERRORS = 100
+
+
+class InvalidImport(Exception):
+    pass
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+class ImportResult:
+    """What happened to the rows of one import."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.rows = 0
+        self.imported = 0
+        self.rejected = 0
+        self.errors = []  # {"line", "error"} for the first MAX_REPORTED_ERRORS rejected rows, by line
+        self.seconds = 0.0
+
+    def reject(self, line, error):
+        self.rejected += 1
+        # Rows of a chunk are rejected in several passes, so errors do not arrive in line order
+        bisect.insort(self.errors, {"line": line, "error": error}, key=lambda entry: entry["line"])
+        del self.errors[MAX_REPORTED_ERRORS:]
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def as_dict(self):
+        return {
+            "kind": self.kind,
+            "rows": self.rows,
+            "imported": self.imported,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "seconds": round(self.seconds, 3),
+            "rows_per_second": round(self.rows_per_second, 1),
+        }
+
+
+def read_records(lines, fmt):
+    """(line number, record dict or InvalidRow) for each row of CSV (with a header) or NDJSON lines."""
+    if fmt not in FORMATS:
+        raise InvalidImport(f"Unknown import format: {fmt} (use csv or ndjson)")
+    text = (line.decode("utf-8") if isinstance(line, bytes) else line for line in lines)
+
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for record in reader:
+            if None in record:
+                yield reader.line_num, InvalidRow("More values than header columns")
+            else:
+                yield reader.line_num, record
+        return
+
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = orjson.loads(line)
+        except orjson.JSONDecodeError as e:
+            yield number, InvalidRow(f"Invalid JSON: {e}")
+            continue
+        yield number, record if isinstance(record, dict) else InvalidRow("Each line must be a JSON object")
+
+
+def _required(record, key):
+    value = record.get(key)
+    if value is None or value == "":
+        raise InvalidRow(f"Missing {key}")
+    return value
+
+
+def _text(record, key):
+    value = _required(record, key)
+    # Numbers are fine (an NDJSON phone number, say), objects and lists are not
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise InvalidRow(f"{key} must be text")
+    return str(value)
+
+
+def _integer(record, key, minimum=0, default=None):
+    value = record.get(key)
+    if (value is None or value == "") and default is not None:
+        return default
+    try:
+        number = int(_required(record, key))
+    except (TypeError, ValueError):
+        raise InvalidRow(f"{key} must be an integer")
+    if number < minimum:
+        raise InvalidRow(f"{key} must be at least {minimum}")
+    return number
+
+
+def _number(record, key):
+    try:
+        return float(_required(record, key))
+    except (TypeError, ValueError):
+        raise InvalidRow(f"{key} must be a number")
+
+
+def _clean(obj, exclude=()):
+    """Run the model fields' own checks (max_length, choices, ranges) on one row."""
+    try:
+        obj.clean_fields(exclude=exclude)
+    except ValidationError as e:
+        raise InvalidRow("; ".join(
+            f"{field}: {' '.join(messages)}" for field, messages in sorted(e.message_dict.items())
+        ))
+    return obj
+
+
+class Importer:
+    """
+    Validates and loads one kind of row. Subclasses turn a chunk of records
+    into unsaved model instances (build) and may adjust derived data once
+    everything is loaded (finish).
+    """
+
+    model = None
+    # Load with COPY where available; off when the loaded rows' ids are needed
+    copy = True
+    # auto_now_add fields whose imported value bulk_create would overwrite
+    preserve = ()
+
+    def build(self, records, result):
+        raise NotImplementedError
+
+    def loaded(self, objects):
+        """Called with each chunk once it is in the database."""
+
+    def finish(self):
+        """Called once after the last chunk, inside the same transaction."""
+
+
+class RetailerImporter(Importer):
+    model = Retailer
+
+    def build(self, records, result):
+        retailers = []
+        for line, record in records:
+            try:
+                retailers.append(_clean(Retailer(
+                    name=_text(record, "name"),
+                    address=_text(record, "address"),
+                    contact=_text(record, "contact"),
+                    distance_from_warehouse=_number(record, "distance_from_warehouse"),
+                )))
+            except InvalidRow as e:
+                result.reject(line, str(e))
+        return retailers
+
+
+class ProductImporter(Importer):
+    """
+    New products with their opening stock; categories are created as needed.
+
+    Rows naming a product that already exists in that category are rejected,
+    so re-running an import does not duplicate the catalogue. Products are
+    always loaded with bulk_create, as the opening balance needs their ids.
+    """
+
+    model = Product
+    copy = False
+
+    def __init__(self):
+        self.category_ids = {}
+
+    def build(self, records, result):
+        rows = []
+        for line, record in records:
+            try:
+                name, category = _text(record, "name"), _text(record, "category")
+                quantity = _integer(record, "available_quantity", default=0)
+                _clean(Category(name=category))
+                # The category is looked up per chunk below, once it has an id
+                _clean(Product(name=name, available_quantity=quantity), exclude=["category"])
+                rows.append((line, name, category, quantity))
+            except InvalidRow as e:
+                result.reject(line, str(e))
+
+        missing = {category for _, _, category, _ in rows} - self.category_ids.keys()
+        if missing:
+            Category.objects.bulk_create([Category(name=name) for name in missing], ignore_conflicts=True)
+            self.category_ids.update(Category.objects.filter(name__in=missing).values_list("name", "category_id"))
+
+        existing = set(Product.objects.filter(
+            name__in={name for _, name, _, _ in rows},
+            category_id__in={self.category_ids[category] for _, _, category, _ in rows},
+        ).values_list("name", "category_id"))
+
+        products = []
+        for line, name, category, quantity in rows:
+            key = (name, self.category_ids[category])
+            if key in existing:
+                result.reject(line, "Product already exists")
+                continue
+            existing.add(key)
+            product = Product(name=name, category_id=key[1], available_quantity=quantity)
+            product.update_status()
+            products.append(product)
+        return products
+
+    def loaded(self, products):
+        InventoryMovement.objects.record(
+            "opening", "import", available={product.product_id: product.available_quantity for product in products}
+        )
+
+
+class OrderImporter(Importer):
+    """
+    Orders, historical or open, by retailer and product id (the columns of the order export).
+
+    Loading skips the Order signals; the total_required_quantity they would
+    have added for pending and allocated orders is summed per product while
+    loading and applied in one UPDATE (and one ledger INSERT) at the end.
+    Only order_date keeps its imported value: updated_at is stamped with the
+    import time, which is how incremental allocation finds backdated pending
+    orders below its high-water mark.
+    """
+
+    model = Order
+    preserve = ("order_date",)
+    statuses = {value for value, _ in Order.STATUS_CHOICES}
+
+    def __init__(self):
+        self.required = defaultdict(int)
+
+    def build(self, records, result):
+        rows = []
+        for line, record in records:
+            try:
+                order_status = _text(record, "status") if record.get("status") else "pending"
+                if order_status not in self.statuses:
+                    raise InvalidRow(f"Unknown status: {order_status}")
+                order_date = None  # Stamped with the time of the import when loaded
+                if record.get("order_date"):
+                    order_date = parse_datetime(str(record["order_date"]))
+                    if order_date is None:
+                        raise InvalidRow(f"Invalid order_date: {record['order_date']}")
+                    if timezone.is_naive(order_date):
+                        order_date = timezone.make_aware(order_date)
+                rows.append((line, _clean(Order(
+                    retailer_id=_integer(record, "retailer", minimum=1),
+                    product_id=_integer(record, "product", minimum=1),
+                    required_qty=_integer(record, "required_qty", minimum=1),
+                    status=order_status,
+                    order_date=order_date,
+                ), exclude=["retailer", "product"])))
+            except InvalidRow as e:
+                result.reject(line, str(e))
+
+        # Foreign keys checked with one query per table per chunk
+        retailer_ids = set(Retailer.objects.filter(
+            retailer_id__in={order.retailer_id for _, order in rows}
+        ).values_list("retailer_id", flat=True))
+        product_ids = set(Product.objects.filter(
+            product_id__in={order.product_id for _, order in rows}
+        ).values_list("product_id", flat=True))
+
+        orders = []
+        for line, order in rows:
+            if order.retailer_id not in retailer_ids:
+                result.reject(line, f"Unknown retailer: {order.retailer_id}")
+            elif order.product_id not in product_ids:
+                result.reject(line, f"Unknown product: {order.product_id}")
+            else:
+                orders.append(order)
+        return orders
+
+    def loaded(self, orders):
+        for order in orders:
+            self.required[order.product_id] += Order.required_quantity_delta(None, 0, order.status, order.required_qty)
+
+    def finish(self):
+        deltas = {product_id: delta for product_id, delta in self.required.items() if delta}
+        record_required_quantities(deltas, "demand")
+        Product.objects.filter(product_id__in=deltas).refresh_status()
+
+
+IMPORTERS = {"retailers": RetailerImporter, "products": ProductImporter, "orders": OrderImporter}
+
+
+def can_copy():
+    """True when rows can be streamed with PostgreSQL COPY (psycopg 3)."""
+    if connection.vendor != "postgresql":
+        return False
+    from django.db.backends.postgresql.psycopg_any import is_psycopg3
+    return is_psycopg3
+
+
+def import_rows(kind, lines, fmt, chunk_size=None, use_copy=True):
+    """
+    Import retailers, products or orders from CSV or NDJSON lines.
+
+    Rows are read and validated chunk_size at a time (IMPORT_CHUNK_SIZE by
+    default) and loaded with COPY on PostgreSQL, bulk_create elsewhere; no
+    per-row signals run. Invalid rows are reported and skipped. All valid
+    rows, and the counters derived from them, are committed together.
+    Returns an ImportResult.
+    """
+    if kind not in IMPORTERS:
+        raise InvalidImport(f"Unknown import: {kind} (use {', '.join(IMPORTERS)})")
+    importer = IMPORTERS[kind]()
+    chunk_size = chunk_size or settings.IMPORT_CHUNK_SIZE
+    use_copy = use_copy and importer.copy and can_copy()
+    result = ImportResult(kind)
+
+    started = time.perf_counter()
+    with transaction.atomic():
+        chunk = []
+        for line, record in read_records(lines, fmt):
+            result.rows += 1
+            if isinstance(record, InvalidRow):
+                result.reject(line, str(record))
+                continue
+            chunk.append((line, record))
+            if len(chunk) == chunk_size:
+                _load_chunk(importer, chunk, result, use_copy)
+                chunk = []
+        if chunk:
+            _load_chunk(importer, chunk, result, use_copy)
+        importer.finish()
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+def _load_chunk(importer, records, result, use_copy):
+    objects = importer.build(records, result)
+    if not objects:
+        return
+    if use_copy:
+        _copy(importer.model, objects)
+    else:
+        _bulk_create(importer, objects)
+    importer.loaded(objects)
+    result.imported += len(objects)
+
+
+def _copy(model, objects):
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ", ".join(connection.ops.quote_name(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        with cursor.copy(f"COPY {table} ({columns}) FROM STDIN") as copy:
+            for obj in objects:
+                copy.write_row([_column_value(field, obj) for field in fields])
+    # COPY bypasses VersionedQuerySet, so cached responses are invalidated here
+    bump_version(model)
+
+
+def _column_value(field, obj):
+    """The value a save would write: auto_now fields, and unset auto_now_add ones, are stamped as save() does."""
+    if getattr(field, "auto_now", False) or (getattr(field, "auto_now_add", False) and getattr(obj, field.attname) is None):
+        return field.pre_save(obj, add=True)
+    return getattr(obj, field.attname)
+
+
+def _bulk_create(importer, objects):
+    # bulk_create stamps auto_now_add fields with now(); put imported values back with one bulk_update
+    preserved = [[getattr(obj, name) for name in importer.preserve] for obj in objects]
+    importer.model.objects.bulk_create(objects)
+    restored = []
+    for obj, values in zip(objects, preserved):
+        if any(value is not None for value in values):
+            for name, value in zip(importer.preserve, values):
+                if value is not None:
+                    setattr(obj, name, value)
+            restored.append(obj)
+    if restored:
+        importer.model.objects.bulk_update(restored, importer.preserve)
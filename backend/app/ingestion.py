@@ -0,0 +1,351 @@
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from . import lookup_cache
+from .models import Category, Product, QRScan, InventoryMovement
+from .qr_payload import InvalidScan, parse_qr_text
+
+logger = logging.getLogger(__name__)
+
+SCAN_ID_MAX_LENGTH = QRScan._meta.get_field('scan_id').max_length
+
+
+def content_hash(qr_text):
+    return hashlib.sha256(qr_text.encode("utf-8")).hexdigest()
+
+
+class IngestionResult:
+    """What happened to each scan of a batch."""
+
+    def __init__(self):
+        self.accepted = 0
+        self.duplicates = 0
+        self.rejected = []  # {"index", "error"} per scan that could not be parsed
+
+    def as_dict(self):
+        return {
+            "accepted": self.accepted,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+        }
+
+
+def validate_scan(scan):
+    """(qr_text, scan_id) of one incoming scan, or InvalidScan saying what is wrong with it."""
+    if not isinstance(scan, dict):
+        raise InvalidScan("Scan must be an object with qr_text")
+    qr_text = scan.get("qr_text")
+    if qr_text is None:
+        qr_text = ""
+    if not isinstance(qr_text, str):
+        raise InvalidScan("qr_text must be a string")
+    qr_text = qr_text.strip()
+    parse_qr_text(qr_text)
+
+    scan_id = scan.get("scan_id")
+    if scan_id in (None, ""):
+        return qr_text, None
+    if isinstance(scan_id, bool) or not isinstance(scan_id, (str, int)):
+        raise InvalidScan("scan_id must be a string")
+    scan_id = str(scan_id)
+    if len(scan_id) > SCAN_ID_MAX_LENGTH:
+        raise InvalidScan(f"scan_id must be at most {SCAN_ID_MAX_LENGTH} characters")
+    return qr_text, scan_id
+
+
+class StaleLookup(Exception):
+    """A cached category or product id points at a row another process has deleted."""
+
+
+class DrainResult:
+    """What one drain_scans() pass did."""
+
+    def __init__(self):
+        self.processed = 0
+        self.failed = 0
+        self.created_products = 0
+
+
+_executor = None
+_drain_lock = threading.Lock()
+_drain_scheduled = False
+
+
+def enqueue_scans(scans, dedup_window=0):
+    """
+    Append a batch of QR scans to the QRScan staging table.
+
+    ``scans`` is a list of {"qr_text": ..., "scan_id": optional}. Payloads are
+    validated straight away so the client learns about bad scans, but stock is
+    only booked later by drain_scans(). A scan with a scan_id is queued at most
+    once, however often it is re-sent. A scan without one is always queued,
+    since two identical labels are two items, unless ``dedup_window`` is given:
+    then it is dropped if the same payload arrived in the last that many
+    seconds. Returns an IngestionResult.
+    """
+    result = IngestionResult()
+    valid = []  # (qr_text, scan_id, hash)
+
+    for index, scan in enumerate(scans):
+        try:
+            qr_text, scan_id = validate_scan(scan)
+        except InvalidScan as e:
+            result.rejected.append({"index": index, "error": str(e)})
+            continue
+        valid.append((qr_text, scan_id, content_hash(qr_text)))
+
+    # Idempotency: scan_ids already queued, plus payloads seen inside the window
+    seen_ids = set(
+        QRScan.objects.filter(scan_id__in=[v[1] for v in valid if v[1]]).values_list('scan_id', flat=True)
+    )
+    seen_hashes = set()
+    if dedup_window:
+        since = timezone.now() - timedelta(seconds=dedup_window)
+        seen_hashes = set(
+            QRScan.objects.filter(content_hash__in=[v[2] for v in valid if not v[1]], timestamp__gte=since)
+            .values_list('content_hash', flat=True)
+        )
+
+    fresh = []
+    for qr_text, scan_id, digest in valid:
+        if scan_id:
+            duplicate = scan_id in seen_ids
+            seen_ids.add(scan_id)
+        else:
+            duplicate = digest in seen_hashes
+            if dedup_window:
+                seen_hashes.add(digest)
+        if duplicate:
+            result.duplicates += 1
+        else:
+            fresh.append(QRScan(data=qr_text, scan_id=scan_id, content_hash=digest))
+
+    result.accepted = _insert_scans(fresh)
+    # A concurrent request that queued the same scan_id first wins
+    result.duplicates += len(fresh) - result.accepted
+
+    if result.accepted and settings.QR_DRAIN_IN_PROCESS:
+        transaction.on_commit(_schedule_drain)
+    return result
+
+
+def _insert_scans(scans):
+    """Insert the scans in one statement; returns how many rows were really inserted."""
+    try:
+        with transaction.atomic():
+            QRScan.objects.bulk_create(scans)
+        return len(scans)
+    except IntegrityError:
+        pass
+
+    # Another request queued one of these scan_ids since we looked: insert row by row, skipping those
+    inserted = 0
+    for scan in scans:
+        scan.pk = None
+        try:
+            with transaction.atomic():
+                QRScan.objects.bulk_create([scan])
+            inserted += 1
+        except IntegrityError:
+            continue
+    return inserted
+
+
+def drain_scans(batch_size=None):
+    """
+    Book one batch of unprocessed scans into stock and mark them processed.
+
+    The batch is claimed with SELECT ... FOR UPDATE SKIP LOCKED, so several
+    drainers can work through the queue side by side. Categories and products
+    are resolved in bulk and each product gets one aggregated increment, in
+    the same transaction that flips ``processed``. Scans that no longer parse
+    are marked processed with their error. Cached ids that turn out to be
+    stale are dropped and the batch is booked again from the database.
+    Returns a DrainResult.
+    """
+    batch_size = batch_size or settings.QR_DRAIN_BATCH_SIZE
+    result = DrainResult()
+
+    try:
+        with transaction.atomic():
+            claimed = list(
+                QRScan.objects.select_for_update(skip_locked=True)
+                .filter(processed=False)
+                .order_by('id')
+                .values_list('id', 'data')[:batch_size]
+            )
+            if not claimed:
+                return result
+
+            parsed = []  # (scan id, QRPayload)
+            errors = defaultdict(list)  # message -> scan ids
+            for scan_pk, data in claimed:
+                try:
+                    parsed.append((scan_pk, parse_qr_text(data)))
+                except InvalidScan as e:
+                    errors[str(e)].append(scan_pk)
+
+            # Compact payloads name the product by id, which must exist
+            known_ids = set(
+                Product.objects.filter(product_id__in={p.product_id for _, p in parsed if p.product_id is not None})
+                .values_list('product_id', flat=True)
+            )
+            booked = []
+            booked_ids = []
+            for scan_pk, payload in parsed:
+                if payload.product_id is not None and payload.product_id not in known_ids:
+                    errors["Unknown product"].append(scan_pk)
+                    continue
+                booked.append(payload)
+                booked_ids.append(scan_pk)
+
+            try:
+                with transaction.atomic():
+                    result.created_products = _book(booked)
+            except StaleLookup:
+                # Another process deleted a category or product this process still had cached
+                lookup_cache.clear()
+                result.created_products = _book(booked)
+
+            now = timezone.now()
+            QRScan.objects.filter(id__in=booked_ids).update(processed=True, processed_at=now)
+            for message, scan_pks in errors.items():
+                QRScan.objects.filter(id__in=scan_pks).update(processed=True, processed_at=now, error=message)
+    except IntegrityError:
+        # Foreign keys are only checked at COMMIT, so a stale id _book() did not
+        # catch fails here; the next drain must resolve every id afresh
+        lookup_cache.clear()
+        raise
+
+    result.processed = len(booked_ids)
+    result.failed = len(claimed) - len(booked_ids)
+    logger.debug(f"Drained {result.processed} QR scans ({result.failed} failed)")
+    return result
+
+
+def _book(payloads):
+    """
+    Add the quantities of parsed QRPayloads to stock with a fixed number of queries.
+
+    Category and product ids come from app.lookup_cache where possible, so a
+    batch of labels that have all been seen before needs no lookups at all.
+    Cached ids are checked against what the writes actually hit (the rows the
+    stock UPDATE matched, the categories of new products), because a stale id
+    would otherwise only fail at COMMIT; StaleLookup is raised if one is gone.
+
+    Returns the number of products that had to be created.
+    """
+    if not payloads:
+        return 0
+
+    by_id = defaultdict(int)  # Compact payloads that already carry the product id
+    by_name = []
+    for payload in payloads:
+        if payload.product_id is not None:
+            by_id[payload.product_id] += payload.quantity
+        else:
+            by_name.append(payload)
+
+    # Categories in bulk, through the lookup cache: create what is missing, then read those ids back
+    category_names = {payload.category for payload in by_name}
+    cached_categories = lookup_cache.category_ids.get_many(category_names)
+    category_ids = dict(cached_categories)
+    missing = category_names - category_ids.keys()
+    if missing:
+        Category.objects.bulk_create([Category(name=name) for name in missing], ignore_conflicts=True)
+        fetched = dict(Category.objects.filter(name__in=missing).values_list('name', 'category_id'))
+        lookup_cache.category_ids.set_many(fetched)
+        category_ids.update(fetched)
+
+    # Products in bulk: the oldest match per (name, category), like .first() did
+    quantities = defaultdict(int)
+    for payload in by_name:
+        quantities[(payload.name, category_ids[payload.category])] += payload.quantity
+
+    product_ids = lookup_cache.product_ids.get_many(quantities)
+    missing = [key for key in quantities if key not in product_ids]
+    if missing:
+        fetched = {}
+        matches = Product.objects.filter(
+            name__in={name for name, _ in missing}, category_id__in={category_id for _, category_id in missing}
+        ).order_by('product_id').values_list('name', 'category_id', 'product_id')
+        for name, category_id, product_id in matches:
+            fetched.setdefault((name, category_id), product_id)
+        product_ids.update(fetched)
+
+    new_products = [
+        Product(name=name, category_id=category_id, available_quantity=quantities[(name, category_id)])
+        for name, category_id in missing
+        if (name, category_id) not in product_ids
+    ]
+    for product in new_products:
+        product.update_status()
+    unchecked = {product.category_id for product in new_products} & set(cached_categories.values())
+    if unchecked and Category.objects.filter(category_id__in=unchecked).count() < len(unchecked):
+        raise StaleLookup("A cached category no longer exists")
+    Product.objects.bulk_create(new_products)
+    if missing:
+        lookup_cache.product_ids.set_many({
+            **fetched, **{(product.name, product.category_id): product.product_id for product in new_products}
+        })
+    InventoryMovement.objects.record(
+        'receipt', 'qr', available={product.product_id: product.available_quantity for product in new_products}
+    )
+
+    for key, quantity in quantities.items():
+        if key in product_ids:
+            by_id[product_ids[key]] += quantity
+    if Product.objects.receive(by_id, 'qr') < len(by_id):
+        raise StaleLookup("A cached product no longer exists")
+    return len(new_products)
+
+
+def backlog_stats():
+    """Queue depth and recent throughput of the QRScan staging table."""
+    pending = QRScan.objects.filter(processed=False)
+    oldest = pending.order_by('id').values_list('timestamp', flat=True).first()
+    minute_ago = timezone.now() - timedelta(minutes=1)
+    return {
+        "pending": pending.count(),
+        "oldest_pending_seconds": (timezone.now() - oldest).total_seconds() if oldest else 0.0,
+        "processed_last_minute": QRScan.objects.filter(processed_at__gte=minute_ago).count(),
+        "failed": QRScan.objects.filter(processed=True).exclude(error='').count(),
+    }
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="qr-drain")
+    return _executor
+
+
+def _schedule_drain():
+    # A burst of requests needs only one pending drain; it empties the whole queue
+    global _drain_scheduled
+    with _drain_lock:
+        if _drain_scheduled:
+            return
+        _drain_scheduled = True
+    _get_executor().submit(_drain_in_thread)
+
+
+def _drain_in_thread():
+    global _drain_scheduled
+    with _drain_lock:
+        _drain_scheduled = False
+    try:
+        while True:
+            result = drain_scans()
+            if not result.processed and not result.failed:
+                break
+    except Exception as e:
+        logger.error(f"Error draining QR scans: {str(e)}")
+    finally:
+        connection.close()
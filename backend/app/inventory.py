@@ -0,0 +1,160 @@
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery, Sum
+from django.utils import timezone
+from .models import InventoryMovement, Product, StockSnapshot
+
+# Product counter -> InventoryMovement column folded into it
+DELTAS = {
+    'available_quantity': 'available_delta',
+    'total_shipped': 'shipped_delta',
+    'total_required_quantity': 'required_delta',
+}
+
+# Movements younger than this are left out of snapshots, so a transaction that
+# took a movement id earlier but commits later is never skipped over
+SETTLE_SECONDS = 60
+
+# Products whose ledger tails are read per query; each is one OR term (an index range scan)
+TAIL_BATCH_SIZE = 200
+
+
+def _snapshots_of(product_id, as_of=None):
+    snapshots = StockSnapshot.objects.filter(product_id=product_id)
+    if as_of is not None:
+        snapshots = snapshots.filter(as_of__lte=as_of)
+    return snapshots.order_by('-last_movement_id')
+
+
+def _latest_snapshots(product_ids=None, as_of=None):
+    """
+    product_id -> its most recent snapshot (taken no later than as_of, if given).
+
+    One probe of the (product, -last_movement_id) index per product, so older
+    snapshots are never read however many compactions have run.
+    """
+    products = Product.objects.all() if product_ids is None else Product.objects.filter(product_id__in=product_ids)
+    latest_ids = products.annotate(
+        latest_snapshot=Subquery(_snapshots_of(OuterRef('product_id'), as_of).values('snapshot_id')[:1])
+    ).values('latest_snapshot')
+    return {snapshot.product_id: snapshot for snapshot in StockSnapshot.objects.filter(snapshot_id__in=latest_ids)}
+
+
+def _unfolded_totals(latest, product_ids, movements):
+    """
+    Sum, per product, the movements its latest snapshot does not cover yet.
+
+    Each product's tail is read from its own snapshot onwards, so a product
+    that has not moved in a long time does not drag the others' reads back to
+    its old snapshot. Returns product_id ->
+    {counter: summed delta, 'last_movement_id': ..., 'as_of': ...}.
+    """
+    product_ids = sorted(product_ids)
+    totals = {}
+    for start in range(0, len(product_ids), TAIL_BATCH_SIZE):
+        batch = product_ids[start:start + TAIL_BATCH_SIZE]
+        tails = Q(product_id__in=[product_id for product_id in batch if product_id not in latest])
+        for product_id in batch:
+            if product_id in latest:
+                tails |= Q(product_id=product_id, movement_id__gt=latest[product_id].last_movement_id)
+
+        rows = movements.filter(tails).order_by('movement_id').values(
+            'product_id', 'movement_id', 'created_at', *DELTAS.values()
+        )
+        for movement in rows.iterator():
+            total = totals.setdefault(movement['product_id'], dict.fromkeys(DELTAS, 0))
+            for counter, column in DELTAS.items():
+                total[counter] += movement[column]
+            total['last_movement_id'] = movement['movement_id']
+            total['as_of'] = movement['created_at']
+    return totals
+
+
+def _combine(snapshot, total):
+    return {
+        counter: (getattr(snapshot, counter) if snapshot else 0) + (total or {}).get(counter, 0)
+        for counter in DELTAS
+    }
+
+
+def stock_at(product_id, as_of=None):
+    """
+    A product's counters reconstructed from the ledger, now or at a past moment.
+
+    Reads the latest snapshot taken by then plus one aggregate over the
+    movements recorded after it, so the cost depends on how recently
+    compact_snapshots() ran rather than on the product's whole history.
+    """
+    snapshot = _snapshots_of(product_id, as_of).first()
+    movements = InventoryMovement.objects.filter(product_id=product_id)
+    if snapshot is not None:
+        movements = movements.filter(movement_id__gt=snapshot.last_movement_id)
+    if as_of is not None:
+        movements = movements.filter(created_at__lte=as_of)
+
+    sums = movements.aggregate(**{counter: Sum(column) for counter, column in DELTAS.items()})
+    return _combine(snapshot, {counter: value or 0 for counter, value in sums.items()})
+
+
+def current_stock(product_id):
+    """A product's counters as the ledger has them right now."""
+    return stock_at(product_id)
+
+
+def compact_snapshots(settle_seconds=SETTLE_SECONDS):
+    """
+    Fold each product's movements since its last snapshot into a new snapshot row.
+
+    Reads only the unfolded tail of the ledger and writes with one bulk INSERT;
+    movements themselves are never modified. Returns the number of snapshots written.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settle_seconds)
+
+    with transaction.atomic():
+        latest = _latest_snapshots()
+        product_ids = Product.objects.values_list('product_id', flat=True)
+        totals = _unfolded_totals(latest, product_ids, InventoryMovement.objects.filter(created_at__lte=cutoff))
+
+        snapshots = StockSnapshot.objects.bulk_create([
+            StockSnapshot(
+                product_id=product_id,
+                last_movement_id=total['last_movement_id'],
+                as_of=total['as_of'],
+                **_combine(latest.get(product_id), total),
+            )
+            for product_id, total in totals.items()
+        ])
+    return len(snapshots)
+
+
+def rebuild_counters(product_ids=None):
+    """
+    Overwrite the cached Product counters (and status) with what the ledger says.
+
+    Corrected products get a new stock_updated_at, as any other change to their
+    stock does, so incremental allocation looks at their orders again.
+    Returns the product_ids whose cached counters had drifted from the ledger.
+    """
+    with transaction.atomic():
+        products = Product.objects.select_for_update().order_by('product_id')
+        if product_ids is not None:
+            products = products.filter(product_id__in=product_ids)
+        products = list(products)
+
+        product_ids = [product.product_id for product in products]
+        latest = _latest_snapshots(product_ids)
+        totals = _unfolded_totals(latest, product_ids, InventoryMovement.objects.all())
+
+        now = timezone.now()
+        drifted = []
+        for product in products:
+            ledger = _combine(latest.get(product.product_id), totals.get(product.product_id))
+            if any(getattr(product, counter) != value for counter, value in ledger.items()):
+                for counter, value in ledger.items():
+                    setattr(product, counter, value)
+                product.update_status()
+                product.stock_updated_at = now
+                drifted.append(product)
+
+        Product.objects.bulk_update(drifted, [*DELTAS, 'status', 'stock_updated_at'])
+    return [product.product_id for product in drifted]
@@ -0,0 +1,125 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .allocation import run_allocation
+from .models import AllocationJob
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.ALLOCATION_JOB_WORKERS,
+            thread_name_prefix="allocation-job",
+        )
+        # Jobs queued before a restart were lost with the old pool; a job another process
+        # already claimed is simply not claimed again (see claim_job)
+        recover_stale_jobs()
+        for job_id in AllocationJob.objects.filter(status='queued').values_list('job_id', flat=True):
+            _executor.submit(_run_in_thread, job_id)
+    return _executor
+
+
+def enqueue_allocation(options, user=None):
+    """
+    Queue an allocation run and return its AllocationJob straight away.
+
+    The job is handed to the in-process worker pool once the surrounding
+    transaction commits. With ALLOCATION_JOBS_IN_PROCESS off, jobs wait in the
+    table for the run_allocation_jobs management command instead.
+    """
+    job = AllocationJob.objects.create(
+        options=options,
+        requested_by=user if user is not None and user.is_authenticated else None,
+    )
+    if settings.ALLOCATION_JOBS_IN_PROCESS:
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_thread, job.job_id))
+    return job
+
+
+def claim_job(job_id=None):
+    """
+    Move the oldest queued job (or the given one) to 'running' and return it.
+
+    Returns None when there is nothing to claim, including when another worker
+    holds the row, so several workers can poll the same table.
+    """
+    with transaction.atomic():
+        queryset = AllocationJob.objects.select_for_update(skip_locked=True).filter(status='queued')
+        if job_id is not None:
+            queryset = queryset.filter(job_id=job_id)
+        job = queryset.order_by('created_at').first()
+        if job is None:
+            return None
+
+        job.status = 'running'
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'started_at'])
+    return job
+
+
+def recover_stale_jobs(timeout=None):
+    """
+    Fail jobs left 'running' by a worker that died, so they stop showing as in progress.
+
+    A job still running ALLOCATION_JOB_TIMEOUT seconds after it started is
+    taken to have lost its worker. The chunks it committed stay written and
+    its remaining orders are still pending for the next run. Called when a
+    worker starts; returns the number of jobs failed.
+    """
+    timeout = settings.ALLOCATION_JOB_TIMEOUT if timeout is None else timeout
+    failed = AllocationJob.objects.filter(
+        status='running', started_at__lt=timezone.now() - timedelta(seconds=timeout)
+    ).update(
+        status='failed',
+        error=f"Timed out: no result {timeout}s after it started, its worker stopped",
+        finished_at=timezone.now(),
+    )
+    if failed:
+        logger.warning(f"Failed {failed} allocation jobs left running by a stopped worker")
+    return failed
+
+
+def execute_job(job):
+    """Run a claimed job in chunked transactions, recording progress and the outcome on the row."""
+
+    def progress(done, total):
+        AllocationJob.objects.filter(job_id=job.job_id).update(processed_orders=done, total_orders=total)
+
+    try:
+        result = run_allocation(chunk_size=settings.ALLOCATION_JOB_CHUNK_SIZE, progress=progress, **job.options)
+    except Exception as e:
+        logger.error(f"Allocation job {job.job_id} failed: {str(e)}")
+        job.status = 'failed'
+        job.error = str(e)
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at'])
+        return job
+
+    job.status = 'completed'
+    job.result = result
+    job.allocated_count = len(result["allocated_orders"])
+    job.skipped_count = len(result["skipped_orders"])
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'result', 'allocated_count', 'skipped_count', 'finished_at'])
+    # The totals are the ones progress() wrote to the row
+    job.refresh_from_db(fields=['total_orders', 'processed_orders'])
+    logger.info(f"Allocation job {job.job_id} completed in {job.duration:.2f}s")
+    return job
+
+
+def _run_in_thread(job_id):
+    try:
+        job = claim_job(job_id)
+        if job is not None:
+            execute_job(job)
+    finally:
+        # Each pool thread has its own connection; don't leave it open between jobs
+        connection.close()
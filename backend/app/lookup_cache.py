@@ -0,0 +1,90 @@
+import threading
+from collections import OrderedDict
+from django.conf import settings
+
+
+class LRUCache:
+    """
+    A bounded, thread-safe mapping that evicts the least recently used entry.
+
+    Counts hits and misses so its effectiveness can be checked under load.
+    Keeps the keys of each value as well, so discarding every entry that
+    points at a value does not scan the whole cache.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._keys = {}  # value -> set of keys mapping to it
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        """{key: value} for the keys that are cached; the rest count as misses."""
+        found = {}
+        with self._lock:
+            for key in keys:
+                value = self._data.get(key)
+                if value is None:
+                    self.misses += 1
+                    continue
+                self._data.move_to_end(key)
+                found[key] = value
+                self.hits += 1
+        return found
+
+    def set_many(self, mapping):
+        with self._lock:
+            for key, value in mapping.items():
+                self._remove(key)
+                self._data[key] = value
+                self._keys.setdefault(value, set()).add(key)
+            while len(self._data) > self.maxsize:
+                self._remove(next(iter(self._data)))
+
+    def discard(self, key=None, value=None):
+        """Drop the entry for ``key`` and every entry pointing at ``value``."""
+        with self._lock:
+            self._remove(key)
+            if value is not None:
+                for stale in list(self._keys.get(value, ())):
+                    self._remove(stale)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._keys.clear()
+
+    def _remove(self, key):
+        if key not in self._data:
+            return
+        value = self._data.pop(key)
+        keys = self._keys[value]
+        keys.discard(key)
+        if not keys:
+            del self._keys[value]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Category name -> category_id
+category_ids = LRUCache(settings.LOOKUP_CACHE_SIZE)
+# (product name, category_id) -> product_id of the oldest such product
+product_ids = LRUCache(settings.LOOKUP_CACHE_SIZE)
+
+
+def clear():
+    category_ids.clear()
+    product_ids.clear()
+
+
+def stats():
+    return {"categories": category_ids.stats(), "products": product_ids.stats()}
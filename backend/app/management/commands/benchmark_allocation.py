@@ -0,0 +1,105 @@
+import multiprocessing
+import random
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from app.allocation import SHARD_KEYS, run_allocation
+from app.models import Category, Product, Retailer, Order, Truck, Employee, Shipment
+
+
+def _worker(shard, results):
+    """Run one shard in a forked process and report (allocated, skipped, seconds)."""
+    started = time.perf_counter()
+    payload = run_allocation(shard=shard)
+    results.put((len(payload["allocated_orders"]), len(payload["skipped_orders"]), time.perf_counter() - started))
+    connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures sharded allocation throughput for an increasing number of parallel worker processes. "
+        "Runs against a throwaway test database (PostgreSQL only, as it needs row locks)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+        parser.add_argument("--orders", type=int, default=20000)
+        parser.add_argument("--categories", type=int, default=64)
+        parser.add_argument("--products-per-category", type=int, default=20)
+        parser.add_argument("--retailers", type=int, default=500)
+        parser.add_argument("--trucks", type=int, default=256)
+        parser.add_argument("--shard-key", choices=list(SHARD_KEYS), default="product")
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("benchmark_allocation needs PostgreSQL (skip-locked row locks)")
+
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            baseline = None
+            self.stdout.write(f"{'workers':>8} {'allocated':>10} {'skipped':>8} {'seconds':>8} {'orders/s':>10} {'speedup':>8}")
+
+            for workers in options["workers"]:
+                self._seed(options)
+                allocated, skipped, elapsed = self._run(workers, options["shard_key"])
+                rate = allocated / elapsed if elapsed else 0.0
+                baseline = baseline or rate
+                self.stdout.write(
+                    f"{workers:>8} {allocated:>10} {skipped:>8} {elapsed:>8.2f} {rate:>10.0f} {rate / baseline:>7.2f}x"
+                )
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _run(self, workers, shard_key):
+        # Forked children must not share the parent's connection
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        processes = [
+            context.Process(target=_worker, args=({"key": shard_key, "index": i, "count": workers}, results))
+            for i in range(workers)
+        ]
+
+        started = time.perf_counter()
+        for process in processes:
+            process.start()
+        outcomes = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - started
+
+        return sum(o[0] for o in outcomes), sum(o[1] for o in outcomes), elapsed
+
+    def _seed(self, options):
+        """Replace the benchmark data with a fresh, deterministic data set."""
+        rnd = random.Random(options["seed"])
+        for model in (Shipment, Order, Employee, Truck, Product, Category, Retailer):
+            model.objects.all().delete()
+
+        categories = Category.objects.bulk_create(
+            [Category(name=f"bench-category-{i}") for i in range(options["categories"])]
+        )
+        products = Product.objects.bulk_create([
+            Product(name=f"bench-product-{c.category_id}-{i}", category=c, available_quantity=10 ** 6)
+            for c in categories
+            for i in range(options["products_per_category"])
+        ])
+        retailers = Retailer.objects.bulk_create([
+            Retailer(name=f"bench-retailer-{i}", address="-", contact="-", distance_from_warehouse=rnd.uniform(1, 100))
+            for i in range(options["retailers"])
+        ])
+        orders = [
+            Order(retailer=rnd.choice(retailers), product=rnd.choice(products), required_qty=rnd.randint(1, 20))
+            for _ in range(options["orders"])
+        ]
+        Order.objects.bulk_create(orders, batch_size=5000)
+
+        # Enough capacity for every order, so the runs measure throughput rather than rejections
+        capacity = sum(order.required_qty for order in orders) // options["trucks"] * 2 + 20
+        trucks = Truck.objects.bulk_create(
+            [Truck(license_plate=f"BENCH-{i}", capacity=capacity) for i in range(options["trucks"])]
+        )
+        Employee.objects.bulk_create([Employee(truck=truck) for truck in trucks])
@@ -0,0 +1,309 @@
+import json
+import shlex
+import socket
+import socketserver
+import struct
+import subprocess
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+import paho.mqtt.client as mqtt
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections
+from django.test.utils import override_settings
+from app.models import QRScan
+from app.mqtt_pipeline import ScanPipeline, connect_listener
+
+TOPIC = "warehouse/qr"
+
+
+# ===================== STAND-IN BROKER =====================
+# Just enough MQTT 3.1.1 (QoS 0/1, persistent sessions, exact topics) to
+# measure the listener without a mosquitto install.
+
+def _read_exact(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("closed")
+        data += chunk
+    return data
+
+
+def _read_packet(sock):
+    header = _read_exact(sock, 1)[0]
+    length, shift = 0, 0
+    while True:
+        byte = _read_exact(sock, 1)[0]
+        length += (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+    return header, _read_exact(sock, length)
+
+
+def _packet(header, body=b""):
+    length, encoded = len(body), b""
+    while True:
+        byte, length = length % 128, length // 128
+        encoded += bytes([byte | (0x80 if length else 0)])
+        if not length:
+            return bytes([header]) + encoded + body
+
+
+def _string(data, offset):
+    size = struct.unpack_from("!H", data, offset)[0]
+    return data[offset + 2:offset + 2 + size].decode(), offset + 2 + size
+
+
+class _Session:
+    def __init__(self):
+        self.subscriptions = {}  # topic -> granted qos
+        self.inflight = OrderedDict()  # packet id -> (topic, payload), sent but not acknowledged
+        self.pending = deque()  # (topic, payload, qos) waiting for the client to come back
+        self.next_id = 0
+        self.handler = None
+
+    def packet_id(self):
+        self.next_id = self.next_id % 65535 + 1
+        return self.next_id
+
+
+class StandInBroker:
+    """An in-process MQTT broker that keeps persistent sessions across restart()."""
+
+    def __init__(self, port=0):
+        self.port = port
+        self.sessions = {}
+        self.lock = threading.RLock()
+        self._server = None
+
+    def start(self):
+        broker = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                self.write_lock = threading.Lock()
+                broker._serve(self)
+
+            def send(self, data):
+                with self.write_lock:
+                    self.request.sendall(data)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        socketserver.ThreadingTCPServer.daemon_threads = True
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", self.port), Handler)
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        with self.lock:
+            for session in self.sessions.values():
+                if session.handler is not None:
+                    session.handler.request.shutdown(socket.SHUT_RDWR)
+                    session.handler = None
+
+    def restart(self, downtime):
+        """Drop every connection and refuse new ones for ``downtime`` seconds; sessions survive."""
+        self.stop()
+        time.sleep(downtime)
+        self.start()
+
+    def _serve(self, handler):
+        session = None
+        try:
+            header, body = _read_packet(handler.request)
+            if header >> 4 != 1:
+                return
+            _, offset = _string(body, 0)
+            clean = bool(body[offset + 1] & 0x02)
+            client_id, _ = _string(body, offset + 4)
+
+            with self.lock:
+                present = client_id in self.sessions and not clean
+                if not present:
+                    self.sessions[client_id] = _Session()
+                session = self.sessions[client_id]
+                session.handler = handler
+                session.clean = clean
+                handler.send(_packet(0x20, bytes([int(present), 0])))
+                # Redeliver what the client never acknowledged, then what it missed
+                for packet_id, (topic, payload) in session.inflight.items():
+                    self._send_publish(handler, topic, payload, 1, packet_id, dup=True)
+                while session.pending:
+                    self._deliver(session, *session.pending.popleft())
+
+            while True:
+                header, body = _read_packet(handler.request)
+                kind = header >> 4
+                if kind == 3:
+                    self._on_publish(handler, header, body)
+                elif kind == 4:
+                    with self.lock:
+                        session.inflight.pop(struct.unpack("!H", body[:2])[0], None)
+                elif kind == 8:
+                    packet_id, offset, granted = struct.unpack("!H", body[:2])[0], 2, []
+                    while offset < len(body):
+                        topic, offset = _string(body, offset)
+                        granted.append(min(body[offset], 1))
+                        with self.lock:
+                            session.subscriptions[topic] = granted[-1]
+                        offset += 1
+                    handler.send(_packet(0x90, struct.pack("!H", packet_id) + bytes(granted)))
+                elif kind == 12:
+                    handler.send(_packet(0xD0))
+                elif kind == 14:
+                    return
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            if session is not None:
+                with self.lock:
+                    if session.handler is handler:
+                        session.handler = None
+                        if session.clean:
+                            self.sessions = {k: v for k, v in self.sessions.items() if v is not session}
+
+    def _on_publish(self, handler, header, body):
+        qos = (header >> 1) & 0x03
+        topic, offset = _string(body, 0)
+        if qos:
+            packet_id = body[offset:offset + 2]
+            offset += 2
+        payload = body[offset:]
+
+        with self.lock:
+            for session in self.sessions.values():
+                if topic in session.subscriptions:
+                    self._deliver(session, topic, payload, min(qos, session.subscriptions[topic]))
+        if qos:
+            handler.send(_packet(0x40, packet_id))
+
+    def _deliver(self, session, topic, payload, qos):
+        if session.handler is None:
+            if qos:
+                session.pending.append((topic, payload, qos))
+            return
+        packet_id = None
+        if qos:
+            packet_id = session.packet_id()
+            session.inflight[packet_id] = (topic, payload)
+        try:
+            self._send_publish(session.handler, topic, payload, qos, packet_id)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _send_publish(handler, topic, payload, qos, packet_id, dup=False):
+        encoded = topic.encode()
+        body = struct.pack("!H", len(encoded)) + encoded
+        if qos:
+            body += struct.pack("!H", packet_id)
+        handler.send(_packet(0x30 | (0x08 if dup else 0) | (qos << 1), body + payload))
+
+
+# ===================== BENCHMARK =====================
+
+class Command(BaseCommand):
+    help = (
+        "Publishes QR scans through an MQTT broker into the listener pipeline, restarts the broker "
+        "half way and reports throughput and lost scans. Uses an in-process stand-in broker unless "
+        "--host is given, and a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=5000)
+        parser.add_argument("--rate", type=float, default=1000.0, help="Messages published per second")
+        parser.add_argument("--qos", type=int, choices=[0, 1], default=1)
+        parser.add_argument("--downtime", type=float, default=2.0, help="Seconds the stand-in broker stays down")
+        parser.add_argument("--host", help="Use a real broker (e.g. a local mosquitto) instead of the stand-in")
+        parser.add_argument("--port", type=int, default=1883)
+        parser.add_argument(
+            "--restart-command",
+            help="Shell command that restarts the real broker, e.g. 'systemctl restart mosquitto'",
+        )
+        parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for stragglers")
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            # Measure delivery into QRScan only; booking stock is the drainer's job
+            with override_settings(QR_DRAIN_IN_PROCESS=False):
+                self._run(options)
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _run(self, options):
+        broker = None
+        if options["host"]:
+            host, port = options["host"], options["port"]
+            restart = lambda: subprocess.run(shlex.split(options["restart_command"]), check=True)
+            if not options["restart_command"]:
+                restart = None
+        else:
+            broker = StandInBroker().start()
+            host, port = "127.0.0.1", broker.port
+            restart = lambda: broker.restart(options["downtime"])
+
+        qos = options["qos"]
+        run_id = uuid.uuid4().hex[:8]
+        pipeline = ScanPipeline().start()
+        listener = connect_listener(pipeline, host, port, TOPIC, f"bench-listener-{run_id}", qos=qos)
+
+        publisher = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"bench-publisher-{run_id}", clean_session=False)
+        publisher.max_inflight_messages_set(1000)
+        publisher.reconnect_delay_set(min_delay=0.1, max_delay=2)
+        publisher.connect_async(host, port)
+        publisher.loop_start()
+        while not (listener.is_connected() and publisher.is_connected()):
+            time.sleep(0.05)
+        time.sleep(0.2)  # Let the listener's subscription land
+
+        total = options["messages"]
+        started = time.perf_counter()
+        for i in range(total):
+            if i == total // 2 and restart is not None:
+                threading.Thread(target=restart, daemon=True).start()
+            payload = json.dumps({"qr_text": f"name=bench-{i % 50}|category=bench|quantity=1", "scan_id": f"{run_id}-{i}"})
+            publisher.publish(TOPIC, payload, qos=qos)
+            # Pace the run so the restart lands in the middle of the traffic
+            ahead = started + (i + 1) / options["rate"] - time.perf_counter()
+            if ahead > 0:
+                time.sleep(ahead)
+
+        recorded = 0
+        deadline = time.monotonic() + options["timeout"]
+        while time.monotonic() < deadline:
+            try:
+                recorded = QRScan.objects.filter(scan_id__startswith=f"{run_id}-").count()
+            except OperationalError:
+                # SQLite's shared in-memory test database locks tables against the writer thread
+                time.sleep(0.2)
+                continue
+            if recorded >= total:
+                break
+            time.sleep(0.2)
+        elapsed = time.perf_counter() - started
+
+        publisher.disconnect()
+        publisher.loop_stop()
+        listener.disconnect()
+        listener.loop_stop()
+        pipeline.stop()
+        if broker is not None:
+            broker.stop()
+
+        self.stdout.write(f"QoS {qos}, broker restart: {'yes' if restart else 'no'}")
+        self.stdout.write(f"published:  {total}")
+        self.stdout.write(f"recorded:   {recorded}")
+        self.stdout.write(f"lost:       {total - recorded}")
+        self.stdout.write(f"redelivered: {pipeline.written - recorded}")
+        self.stdout.write(f"seconds:    {elapsed:.2f}")
+        self.stdout.write(f"scans/s:    {recorded / elapsed:.0f}")
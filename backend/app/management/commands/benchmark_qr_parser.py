@@ -0,0 +1,66 @@
+import random
+import timeit
+from django.core.management.base import BaseCommand
+from app.qr_payload import QRPayload, _parse, parse_qr_text
+
+
+def legacy_parse(qr_data):
+    """The hand-rolled parsing store_qr_code used to do, kept as the baseline."""
+    qr_data = qr_data.strip()
+    data_dict = {}
+    for item in qr_data.split("|"):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            data_dict[key] = value
+
+    product_name = data_dict.get("name", "").strip()
+    category_name = data_dict.get("category", "").strip()
+    quantity_str = data_dict.get("quantity", "0").strip()
+    if not quantity_str.isdigit():
+        raise ValueError("Quantity must be a positive integer")
+    return product_name, category_name, int(quantity_str)
+
+
+class Command(BaseCommand):
+    help = "Compares the QR payload parser (cold and cached, v1 and compact v2) against the old hand-rolled parsing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scans", type=int, default=100000)
+        parser.add_argument("--distinct-labels", type=int, default=200, help="Labels repeat, as on a real line")
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options["seed"])
+        labels = [
+            QRPayload(quantity=rnd.randint(1, 50), name=f"Product {i}", category=f"Category {i % 12}", product_id=i + 1)
+            for i in range(options["distinct_labels"])
+        ]
+        scans = [rnd.choice(labels) for _ in range(options["scans"])]
+        v1 = [label.encode(1) for label in scans]
+        v2 = [QRPayload(quantity=label.quantity, name=label.name, category=label.category).encode(2) for label in scans]
+        v2_sku = [label.encode(2) for label in scans]
+
+        def uncached(texts):
+            return lambda: [_parse.__wrapped__(text.strip()) for text in texts]
+
+        def cached(texts):
+            return lambda: [parse_qr_text(text) for text in texts]
+
+        cases = [
+            ("legacy split (v1)", lambda: [legacy_parse(text) for text in v1], v1),
+            ("compiled (v1)", uncached(v1), v1),
+            ("compiled + cache (v1)", cached(v1), v1),
+            ("compiled (v2)", uncached(v2), v2),
+            ("compiled + cache (v2)", cached(v2), v2),
+            ("compiled + cache (v2 id)", cached(v2_sku), v2_sku),
+        ]
+
+        baseline = None
+        self.stdout.write(f"{'parser':<26} {'scans/s':>12} {'speedup':>8} {'avg bytes':>10}")
+        for label, run, texts in cases:
+            _parse.cache_clear()
+            seconds = min(timeit.repeat(run, number=1, repeat=3))
+            rate = len(texts) / seconds
+            baseline = baseline or rate
+            size = sum(len(text.encode("utf-8")) for text in texts) / len(texts)
+            self.stdout.write(f"{label:<26} {rate:>12.0f} {rate / baseline:>7.2f}x {size:>10.1f}")
@@ -0,0 +1,73 @@
+import random
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from rest_framework.renderers import JSONRenderer
+from app.fast_json import ValuesSerializer
+from app.models import Category, Product
+from app.serializers import ProductSerializer
+
+# Names that exercise the encoder: non-ASCII, quotes, control characters and DRF's escaped separators
+AWKWARD_NAMES = ['Café "crème"', "tab\tnew\nline", "line\u2028sep\u2029para", "emoji \U0001F4E6", "back\\slash"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares rows/sec of the ProductSerializer + JSONRenderer path with ValuesSerializer on the stock "
+        "payload, and checks the two produce identical bytes. Runs against a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=20000)
+        parser.add_argument("--categories", type=int, default=50)
+        parser.add_argument("--repeat", type=int, default=3, help="Runs per path; the best is reported")
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self._seed(options)
+            queryset = ProductSerializer.optimize(Product.objects.all().order_by("product_id"))
+            fast = ValuesSerializer(ProductSerializer())
+
+            paths = [
+                ("ProductSerializer", lambda: JSONRenderer().render(ProductSerializer(queryset.all(), many=True).data)),
+                ("ValuesSerializer", lambda: fast.render(queryset.all())),
+            ]
+            outputs, baseline = {}, None
+            self.stdout.write(f"{'path':<20} {'rows':>8} {'seconds':>8} {'rows/s':>10} {'speedup':>8}")
+            for label, render in paths:
+                best = None
+                for _ in range(options["repeat"]):
+                    started = time.perf_counter()
+                    outputs[label] = render()
+                    elapsed = time.perf_counter() - started
+                    best = elapsed if best is None else min(best, elapsed)
+                rate = options["products"] / best
+                baseline = baseline or rate
+                self.stdout.write(
+                    f"{label:<20} {options['products']:>8} {best:>8.3f} {rate:>10.0f} {rate / baseline:>7.2f}x"
+                )
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if outputs["ProductSerializer"] != outputs["ValuesSerializer"]:
+            raise CommandError("ValuesSerializer output differs from ProductSerializer")
+        self.stdout.write(self.style.SUCCESS(f"Outputs identical ({len(outputs['ValuesSerializer'])} bytes)"))
+
+    def _seed(self, options):
+        rnd = random.Random(options["seed"])
+        categories = Category.objects.bulk_create([Category(name=f"category-{i}") for i in range(options["categories"])])
+        Product.objects.bulk_create([
+            Product(
+                name=AWKWARD_NAMES[i % len(AWKWARD_NAMES)] if i % 97 == 0 else f"product-{i}",
+                category=rnd.choice(categories),
+                available_quantity=rnd.randint(0, 500),
+                total_shipped=rnd.randint(0, 200),
+                total_required_quantity=rnd.randint(0, 600),
+                status=rnd.choice(["sufficient", "on_demand"]),
+            )
+            for i in range(options["products"])
+        ], batch_size=1000)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from app.inventory import SETTLE_SECONDS, compact_snapshots, rebuild_counters
+
+
+class Command(BaseCommand):
+    help = "Folds new inventory ledger movements into stock snapshots (run periodically, e.g. from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--settle-seconds", type=int, default=SETTLE_SECONDS,
+                            help="Leave movements younger than this for the next run")
+        parser.add_argument("--rebuild-counters", action="store_true",
+                            help="Also overwrite the cached Product counters with the ledger totals")
+
+    def handle(self, *args, **options):
+        written = compact_snapshots(options["settle_seconds"])
+        self.stdout.write(f"Wrote {written} stock snapshots")
+
+        if options["rebuild_counters"]:
+            drifted = rebuild_counters()
+            self.stdout.write(f"Rebuilt counters for {len(drifted)} products that had drifted from the ledger")
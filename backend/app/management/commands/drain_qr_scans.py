@@ -0,0 +1,37 @@
+import time
+from django.core.management.base import BaseCommand
+from app import lookup_cache
+from app.ingestion import backlog_stats, drain_scans
+
+
+class Command(BaseCommand):
+    help = "Books queued QR scans into stock (several drainers can run side by side)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Exit once the queue is empty")
+        parser.add_argument("--batch-size", type=int, default=None, help="Scans claimed per transaction")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument("--stats", action="store_true", help="Print the backlog and exit")
+
+    def handle(self, *args, **options):
+        if options["stats"]:
+            for key, value in backlog_stats().items():
+                self.stdout.write(f"{key}: {value}")
+            return
+
+        self.stdout.write("Draining QR scans...")
+
+        while True:
+            result = drain_scans(options["batch_size"])
+
+            if not result.processed and not result.failed:
+                if options["once"]:
+                    return
+                time.sleep(options["poll_interval"])
+                continue
+
+            self.stdout.write(
+                f"Booked {result.processed} scans ({result.failed} failed, {result.created_products} new products)"
+            )
+            if options["verbosity"] > 1:
+                self.stdout.write(f"Lookup cache: {lookup_cache.stats()}")
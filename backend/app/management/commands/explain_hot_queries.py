@@ -0,0 +1,76 @@
+import re
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from app.models import Employee, Order, Product, QRScan, Shipment, Truck
+
+# Plan lines that read a whole table: PostgreSQL's "Seq Scan on x", SQLite's "SCAN x" without an index
+SEQ_SCAN = {
+    "postgresql": re.compile(r"Seq Scan on (\w+)"),
+    "sqlite": re.compile(r"^[\d\s]*SCAN (\w+)(?!.*\bINDEX\b)", re.MULTILINE),
+}
+
+
+def hot_queries():
+    """(label, queryset) for each query the request paths and workers run most."""
+    product = Product.objects.order_by('product_id').values('name', 'category_id').first() or {
+        'name': '', 'category_id': 0
+    }
+    employee_id = Employee.objects.order_by('employee_id').values_list('employee_id', flat=True).first() or 0
+    in_transit_trucks = Shipment.objects.filter(status='in_transit').values('employee__truck')
+
+    return [
+        ("allocator: pending orders",
+         Order.objects.filter(status='pending').select_related('product', 'retailer').order_by('order_date', 'order_id')),
+        ("allocator: free trucks",
+         Employee.objects.filter(truck__isnull=False).exclude(truck__in=in_transit_trucks)
+         .select_related('truck').order_by('employee_id')),
+        ("get_orders: first page",
+         Order.objects.order_by('-order_date', '-order_id')[:11]),
+        ("get_orders: ?status=pending",
+         Order.objects.filter(status='pending').order_by('-order_date', '-order_id')[:11]),
+        ("get_shipments: first page",
+         Shipment.objects.order_by('-shipment_date', '-shipment_id')[:11]),
+        ("delivery signal: truck still in transit",
+         Shipment.objects.filter(employee_id=employee_id, status='in_transit')[:1]),
+        ("QR ingestion: product by (name, category)",
+         Product.objects.filter(name__in=[product['name']], category_id__in=[product['category_id']])
+         .order_by('product_id').values_list('name', 'category_id', 'product_id')),
+        ("QR drainer: unprocessed scans",
+         QRScan.objects.filter(processed=False).order_by('id')[:500]),
+        ("employee signal: first available truck",
+         Truck.objects.filter(is_available=True).order_by('truck_id')[:1]),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs EXPLAIN (ANALYZE on PostgreSQL) on the hot queries and flags sequential scans. "
+        "Run it against production-sized data: on small tables a sequential scan is often the right plan."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verbose-plans", action="store_true", help="Print every plan in full")
+        parser.add_argument("--fail-on-seq-scan", action="store_true", help="Exit with an error if any query scans a table")
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in SEQ_SCAN:
+            raise CommandError(f"explain_hot_queries supports PostgreSQL and SQLite, not {vendor}")
+        analyze = vendor == "postgresql"
+
+        flagged = []
+        for label, queryset in hot_queries():
+            plan = queryset.explain(analyze=True) if analyze else queryset.explain()
+            scans = SEQ_SCAN[vendor].findall(plan)
+            timing = re.search(r"Execution Time: ([\d.]+) ms", plan)
+
+            status = self.style.WARNING(f"SEQ SCAN on {', '.join(scans)}") if scans else self.style.SUCCESS("index")
+            took = f" {float(timing.group(1)):.2f} ms" if timing else ""
+            self.stdout.write(f"{label:<45} {status}{took}")
+            if options["verbose_plans"] or scans:
+                self.stdout.write("    " + plan.replace("\n", "\n    "))
+            if scans:
+                flagged.append(label)
+
+        if flagged and options["fail_on_seq_scan"]:
+            raise CommandError(f"Sequential scans in: {', '.join(flagged)}")
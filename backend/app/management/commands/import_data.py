@@ -0,0 +1,44 @@
+import os
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from app.imports import FORMATS, IMPORTERS, InvalidImport, can_copy, import_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-loads retailers, products or orders from a CSV (with a header row) or NDJSON file. "
+        "Rows are validated in chunks and loaded with COPY on PostgreSQL, bulk_create elsewhere."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("kind", choices=list(IMPORTERS))
+        parser.add_argument("path", help="File to read, or - for stdin")
+        parser.add_argument("--format", choices=FORMATS, help="Default: from the file extension")
+        parser.add_argument("--chunk-size", type=int, help="Rows per chunk (default IMPORT_CHUNK_SIZE)")
+        parser.add_argument("--no-copy", action="store_true", help="Use bulk_create even on PostgreSQL")
+
+    def handle(self, *args, **options):
+        fmt = options["format"] or os.path.splitext(options["path"])[1].lstrip(".").lower()
+        if fmt not in FORMATS:
+            raise CommandError("Cannot tell the format from the file name; pass --format")
+
+        stream = sys.stdin if options["path"] == "-" else open(options["path"], newline="", encoding="utf-8")
+        try:
+            result = import_rows(
+                options["kind"], stream, fmt, chunk_size=options["chunk_size"], use_copy=not options["no_copy"]
+            )
+        except InvalidImport as e:
+            raise CommandError(str(e))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        loader = "COPY" if can_copy() and not options["no_copy"] and IMPORTERS[options["kind"]].copy else "bulk_create"
+        self.stdout.write(
+            f"{result.kind}: {result.imported} imported, {result.rejected} rejected of {result.rows} rows "
+            f"in {result.seconds:.2f}s ({result.rows_per_second:.0f} rows/s, {loader})"
+        )
+        for error in result.errors:
+            self.stdout.write(self.style.WARNING(f"  line {error['line']}: {error['error']}"))
+        if result.rejected > len(result.errors):
+            self.stdout.write(self.style.WARNING(f"  ... and {result.rejected - len(result.errors)} more"))
@@ -1,71 +1,55 @@
 from django.core.management.base import BaseCommand
 import os
-import time
-import paho.mqtt.client as mqtt
-import requests
+import signal
+import socket
+import threading
 import logging
+from app.mqtt_pipeline import ScanPipeline, connect_listener
 
 # Configure logging
 logging.basicConfig(filename="mqtt_listener.log", level=logging.INFO, format="%(asctime)s - %(message)s")
 logger = logging.getLogger()
 
 class Command(BaseCommand):
-    help = "Starts the MQTT client to listen for QR code scans"
+    help = "Starts the MQTT client to listen for QR code scans and write them straight to the database"
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200, help="Most scans written per transaction")
+        parser.add_argument("--max-delay-ms", type=float, default=20, help="Longest a scan waits for its batch to fill")
+        parser.add_argument("--queue-size", type=int, default=5000, help="Scans buffered before the listener pushes back")
+
+    def handle(self, *args, **options):
         self.stdout.write("Starting MQTT client...")
 
         # Load MQTT settings from environment variables
         MQTT_BROKER = os.getenv("MQTT_BROKER_URL", "broker.hivemq.com")
         MQTT_PORT = int(os.getenv("MQTT_BROKER_PORT", 1883))
         MQTT_TOPIC = "warehouse/qr"
-        BACKEND_URL = "https://smartchainerp2.onrender.com/api/store_qr/"
-
-        def send_qr_data(qr_text):
-            """Send QR data to Django backend with retry logic"""
-            max_retries = 5
-            retry_delay = 3  # seconds
-
-            for attempt in range(max_retries):
-                try:
-                    response = requests.post(BACKEND_URL, json={"qr_text": qr_text})
-                    if response.status_code == 200:
-                        logger.info(f"[✅] QR Data sent: {response.json()}")
-                        return
-                    else:
-                        logger.warning(f"[❌] Failed to send QR data. Status: {response.status_code}, Attempt {attempt + 1}")
-                except requests.RequestException as e:
-                    logger.error(f"[⚠] Request error: {e}, Retrying... ({attempt + 1}/{max_retries})")
-                time.sleep(retry_delay)
-
-            logger.error(f"[🚨] Failed to send QR data after {max_retries} attempts.")
-
-        def on_connect(client, userdata, flags, rc):
-            logger.info(f"Connected to MQTT with result code {rc}")
-            client.subscribe(MQTT_TOPIC)
-
-        def on_message(client, userdata, msg):
-            data = msg.payload.decode()
-            logger.info(f"Received QR data: {data}")
-            send_qr_data(data)
-
-        def on_disconnect(client, userdata, rc):
-            logger.warning(f"[⚠] Disconnected from MQTT broker. Reconnecting...")
-            while True:
-                try:
-                    client.reconnect()
-                    logger.info("[✅] Reconnected to MQTT broker!")
-                    return
-                except:
-                    time.sleep(5)
+        # ✅ Must stay the same across restarts, so the broker can hand back our persistent session
+        MQTT_CLIENT_ID = os.getenv("MQTT_CLIENT_ID", f"smartchain-listener-{socket.gethostname()}")
 
-        mqtt_client = mqtt.Client()
-        mqtt_client.on_connect = on_connect
-        mqtt_client.on_message = on_message
-        mqtt_client.on_disconnect = on_disconnect
+        pipeline = ScanPipeline(
+            batch_size=options["batch_size"],
+            max_delay=options["max_delay_ms"] / 1000,
+            max_queue=options["queue_size"],
+        ).start()
+        mqtt_client = connect_listener(pipeline, MQTT_BROKER, MQTT_PORT, MQTT_TOPIC, MQTT_CLIENT_ID)
 
-        # Connect to MQTT broker
-        mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
 
         self.stdout.write("MQTT client started, waiting for messages...")
-        mqtt_client.loop_forever()
+        try:
+            stop.wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # Stop taking messages, then write what is already queued; anything
+            # left unacknowledged is redelivered through the persistent session
+            mqtt_client.disconnect()
+            mqtt_client.loop_stop()
+            pipeline.stop()
+            self.stdout.write(
+                f"Stopped after writing {pipeline.written} scans in {pipeline.batches} batches "
+                f"({pipeline.dropped} dropped)"
+            )
@@ -0,0 +1,31 @@
+import time
+from django.core.management.base import BaseCommand
+from app.jobs import claim_job, execute_job, recover_stale_jobs
+
+
+class Command(BaseCommand):
+    help = "Runs queued allocation jobs from the database (several workers can run side by side)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Exit once the queue is empty")
+        parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds to wait when the queue is empty")
+
+    def handle(self, *args, **options):
+        failed = recover_stale_jobs()
+        if failed:
+            self.stdout.write(f"Failed {failed} jobs left running by a stopped worker")
+        self.stdout.write("Waiting for allocation jobs...")
+
+        while True:
+            job = claim_job()
+
+            if job is None:
+                if options["once"]:
+                    return
+                time.sleep(options["poll_interval"])
+                continue
+
+            job = execute_job(job)
+            self.stdout.write(
+                f"Job {job.job_id} {job.status}: {job.allocated_count} allocated, {job.skipped_count} skipped"
+            )
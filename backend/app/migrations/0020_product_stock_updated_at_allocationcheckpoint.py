@@ -0,0 +1,29 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0019_qrscan'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AllocationCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_order_date', models.DateTimeField(blank=True, null=True)),
+                ('last_order_id', models.IntegerField(blank=True, null=True)),
+                ('stock_checked_at', models.DateTimeField(blank=True, null=True)),
+                ('truck_ids', models.JSONField(default=list, help_text='Trucks that were available during the last run')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stock_updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def record_opening_balances(apps, schema_editor):
+    """Start every existing product's ledger from its current counters."""
+    Product = apps.get_model('app', 'Product')
+    InventoryMovement = apps.get_model('app', 'InventoryMovement')
+    InventoryMovement.objects.bulk_create(
+        [
+            InventoryMovement(
+                product_id=product_id,
+                kind='opening',
+                available_delta=available,
+                shipped_delta=shipped,
+                required_delta=required,
+            )
+            for product_id, available, shipped, required in Product.objects.values_list(
+                'product_id', 'available_quantity', 'total_shipped', 'total_required_quantity'
+            ).iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0021_allocationjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryMovement',
+            fields=[
+                ('movement_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('opening', 'Opening Balance'), ('receipt', 'Receipt'), ('allocation', 'Allocation'), ('delivery', 'Delivery'), ('cancellation', 'Cancellation'), ('demand', 'Demand'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('available_delta', models.IntegerField(default=0)),
+                ('shipped_delta', models.IntegerField(default=0)),
+                ('required_delta', models.IntegerField(default=0)),
+                ('reference', models.CharField(blank=True, help_text='What caused the movement, e.g. order:42', max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='app.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'movement_id'], name='app_invento_product_deccad_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('snapshot_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('last_movement_id', models.BigIntegerField()),
+                ('as_of', models.DateTimeField(help_text='created_at of the last folded movement')),
+                ('available_quantity', models.IntegerField()),
+                ('total_shipped', models.IntegerField()),
+                ('total_required_quantity', models.IntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='app.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', '-last_movement_id'], name='app_stocksn_product_f93d06_idx')],
+            },
+        ),
+        migrations.RunPython(record_opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0022_inventory_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='qrscan',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='qrscan',
+            name='scan_id',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0023_qrscan_idempotency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='qrscan',
+            name='error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='qrscan',
+            name='processed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='qrscan',
+            index=models.Index(condition=models.Q(('processed', False)), fields=['id'], name='qrscan_pending_idx'),
+        ),
+    ]
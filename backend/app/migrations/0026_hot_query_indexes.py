@@ -0,0 +1,29 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0025_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['order_date', 'order_id'], name='order_pending_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name', 'category'], name='product_name_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shipment',
+            index=models.Index(condition=models.Q(('status', 'in_transit')), fields=['employee'], name='shipment_in_transit_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='truck',
+            index=models.Index(condition=models.Q(('is_available', True)), fields=['truck_id'], name='truck_available_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0027_response_cache_table'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='allocationcheckpoint',
+            name='retry_order_ids',
+            field=models.JSONField(default=list, help_text='Pending orders below the high-water mark that the last run had to skip'),
+        ),
+    ]
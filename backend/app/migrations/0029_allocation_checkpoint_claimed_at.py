@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0028_allocation_checkpoint_retry_orders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='allocationcheckpoint',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, help_text='Set while a chunked incremental run is using the checkpoint', null=True),
+        ),
+    ]
@@ -1,11 +1,36 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from django.db.models import Count
+from django.utils import timezone
+from django.db.models import Case, Count, F, Value, When
+from .response_cache import bump_version
+
+
+class VersionedQuerySet(models.QuerySet):
+    """
+    QuerySet whose bulk writes, which send no post_save signal, still
+    invalidate the cached responses built from its model (see app.response_cache).
+    bulk_update goes through update(), and deletes send post_delete.
+    """
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        if rows:
+            bump_version(self.model)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        created = super().bulk_create(objs, *args, **kwargs)
+        if created:
+            bump_version(self.model)
+        return created
+
 
 class Category(models.Model):
     category_id = models.AutoField(primary_key=True)
     name = models.CharField(max_length=255, unique=True)
 
+    objects = VersionedQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
@@ -17,6 +42,60 @@ class Category(models.Model):
         return cls.objects.annotate(product_count=Count('products'))
 
 
+def _per_product(amounts):
+    """CASE expression mapping product_id to the given amount, 0 for any other product."""
+    return Case(
+        *[When(product_id=product_id, then=Value(amount)) for product_id, amount in amounts.items()],
+        default=Value(0),
+    )
+
+
+class ProductQuerySet(VersionedQuerySet):
+    def refresh_status(self):
+        """
+        Recompute status for every product in the queryset with a single UPDATE.
+
+        Set-based equivalent of calling save() (and so update_status()) on each row.
+        """
+        return self.update(
+            status=Case(
+                When(available_quantity__gt=F('total_required_quantity'), then=Value('sufficient')),
+                default=Value('on_demand'),
+            )
+        )
+
+    def add_quantities(self, **amounts):
+        """
+        Add per-product amounts to counter fields with a single UPDATE.
+
+        Each keyword maps a field to {product_id: amount}, e.g.
+        add_quantities(available_quantity={1: -5, 2: -3}, total_required_quantity={3: 4}).
+        """
+        product_ids = set().union(*amounts.values())
+        if not product_ids:
+            return 0
+        return self.filter(product_id__in=product_ids).update(**{
+            field: F(field) + _per_product(per_product) for field, per_product in amounts.items()
+        })
+
+    def receive(self, quantities, reference=''):
+        """
+        Book received stock ({product_id: quantity}) with one UPDATE.
+
+        Like a full save, it bumps stock_updated_at; it also refreshes the
+        products' status and appends the receipts to the inventory ledger.
+        """
+        if not quantities:
+            return 0
+        updated = self.filter(product_id__in=quantities).update(
+            available_quantity=F('available_quantity') + _per_product(quantities),
+            stock_updated_at=timezone.now(),
+        )
+        self.filter(product_id__in=quantities).refresh_status()
+        InventoryMovement.objects.record('receipt', reference, available=quantities)
+        return updated
+
+
 class Product(models.Model):
     product_id = models.AutoField(primary_key=True)
     name = models.CharField(max_length=255)
@@ -30,6 +109,17 @@ class Product(models.Model):
         ('sufficient', 'Sufficient')
     ]
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='sufficient')
+    # Bumped by every full save (QR receipts, admin edits) but not by queryset
+    # updates, so incremental allocation can tell which products gained stock.
+    stock_updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # QR ingestion resolves products by (name, category)
+            models.Index(fields=['name', 'category'], name='product_name_category_idx'),
+        ]
 
     def update_status(self):
         """Update the status based on available and required quantity."""
@@ -38,9 +128,60 @@ class Product(models.Model):
 
         self.status = 'sufficient' if available > required else 'on_demand'
 
+    COUNTER_FIELDS = ('available_quantity', 'total_shipped', 'total_required_quantity')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_counters = {
+            field: value for field, value in zip(field_names, values) if field in cls.COUNTER_FIELDS
+        }
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using, fields, **kwargs)
+        # The next save's adjustment is measured from what was just read
+        self._loaded_counters = {
+            **getattr(self, '_loaded_counters', {}),
+            **{field: getattr(self, field) for field in self.COUNTER_FIELDS if fields is None or field in fields},
+        }
+
     def save(self, *args, **kwargs):
         self.update_status()
+        adding = self._state.adding
         super().save(*args, **kwargs)
+        self._record_counter_changes(adding, kwargs.get('update_fields'))
+
+    def _record_counter_changes(self, adding, update_fields):
+        """
+        Append what this save did to the counters to the inventory ledger.
+
+        New products are a receipt of their opening quantities; later saves are
+        adjustments. Counters assigned an expression (e.g. F() + n) are unknown
+        here and left to the caller, which records its own movement.
+        """
+        loaded = getattr(self, '_loaded_counters', {})
+        deltas = {}
+        for field in self.COUNTER_FIELDS:
+            value = getattr(self, field)
+            if update_fields is not None and field not in update_fields:
+                continue
+            if not isinstance(value, int):
+                loaded.pop(field, None)
+                continue
+            if adding or field in loaded:
+                deltas[field] = value - (0 if adding else loaded[field])
+            loaded[field] = value
+        self._loaded_counters = loaded
+
+        if any(deltas.values()):
+            InventoryMovement.objects.create(
+                product=self,
+                kind='receipt' if adding else 'adjustment',
+                available_delta=deltas.get('available_quantity', 0),
+                shipped_delta=deltas.get('total_shipped', 0),
+                required_delta=deltas.get('total_required_quantity', 0),
+            )
 
     def __str__(self):
         return self.name
@@ -54,10 +195,38 @@ class Retailer(models.Model):
     contact = models.CharField(max_length=20)
     distance_from_warehouse = models.FloatField()
 
+    objects = VersionedQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
 
+class OrderQuerySet(models.QuerySet):
+    def set_status(self, status):
+        """
+        Change the status of every order in the queryset without per-row signals.
+
+        Reads the affected rows once, then applies the net total_required_quantity
+        change per product in one aggregated UPDATE (or folds it into the active
+        stock.batched_order_updates() batch). Returns the number of orders updated.
+        """
+        from .stock import record_required_quantities
+
+        with transaction.atomic():
+            rows = list(self.select_for_update().values_list('order_id', 'product_id', 'status', 'required_qty'))
+            deltas = {}
+            for _, product_id, old_status, required_qty in rows:
+                delta = Order.required_quantity_delta(old_status, required_qty, status, required_qty)
+                if delta:
+                    deltas[product_id] = deltas.get(product_id, 0) + delta
+
+            updated = Order.objects.filter(order_id__in=[row[0] for row in rows]).update(
+                status=status, updated_at=timezone.now()
+            )
+            record_required_quantities(deltas, Order.movement_kind(status))
+        return updated
+
+
 class Order(models.Model):
     order_id = models.AutoField(primary_key=True)
     retailer = models.ForeignKey(Retailer, on_delete=models.CASCADE)
@@ -72,6 +241,62 @@ class Order(models.Model):
         ('cancelled', 'Cancelled')
     ]
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # Bumped by every save and status change (set_status() sets it too), so
+    # incremental allocation can find older orders that became pending again
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the order list, with and without ?status=
+            models.Index(fields=['-order_date', '-order_id'], name='order_date_id_idx'),
+            models.Index(fields=['status', '-order_date', '-order_id'], name='order_status_date_id_idx'),
+            # The allocator reads pending orders oldest first; they are a small slice of the table
+            models.Index(
+                fields=['order_date', 'order_id'], name='order_pending_date_idx', condition=models.Q(status='pending')
+            ),
+            # Incremental allocation looks up pending orders changed since the last run
+            models.Index(fields=['updated_at'], name='order_pending_updated_idx', condition=models.Q(status='pending')),
+        ]
+
+    # Orders in these states count towards Product.total_required_quantity
+    REQUIRING_STATUSES = ('pending', 'allocated')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what was loaded so batched saves can skip re-reading the row
+        loaded = dict(zip(field_names, values))
+        instance._loaded_status = loaded.get('status')
+        instance._loaded_required_qty = loaded.get('required_qty')
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using, fields, **kwargs)
+        if fields is None or 'status' in fields:
+            self._loaded_status = self.status
+        if fields is None or 'required_qty' in fields:
+            self._loaded_required_qty = self.required_qty
+
+    @staticmethod
+    def movement_kind(new_status):
+        """Ledger kind for a total_required_quantity change caused by moving to new_status."""
+        return {'delivered': 'delivery', 'cancelled': 'cancellation'}.get(new_status, 'demand')
+
+    @classmethod
+    def required_quantity_delta(cls, old_status, old_required_qty, new_status, new_required_qty):
+        """How much a change from (old_status, old qty) to (new_status, new qty) moves total_required_quantity."""
+        was_required = old_status in cls.REQUIRING_STATUSES
+        is_required = new_status in cls.REQUIRING_STATUSES
+
+        if was_required and is_required:
+            return new_required_qty - old_required_qty
+        if was_required:
+            return -old_required_qty
+        if is_required:
+            return new_required_qty
+        return 0
 
     def __str__(self):
         return f"Order {self.order_id} - {self.product.name} - {self.retailer.name}"
@@ -83,6 +308,13 @@ class Truck(models.Model):
     capacity = models.PositiveIntegerField(help_text="Maximum shipment capacity")
     is_available = models.BooleanField(default=True)
 
+    objects = VersionedQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['truck_id'], name='truck_available_idx', condition=models.Q(is_available=True)),
+        ]
+
     def __str__(self):
         return self.license_plate
 
@@ -110,36 +342,218 @@ class Shipment(models.Model):
     ]
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='in_transit')
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of the shipment list
+            models.Index(fields=['-shipment_date', '-shipment_id'], name='shipment_date_id_idx'),
+            # Trucks still on the road: the allocator's free-truck check and the delivery signal
+            models.Index(
+                fields=['employee'], name='shipment_in_transit_idx', condition=models.Q(status='in_transit')
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = dict(zip(field_names, values)).get('status')
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using, fields, **kwargs)
+        if fields is None or 'status' in fields:
+            self._loaded_status = self.status
+
     def save(self, *args, **kwargs):
         """
-        If shipment is marked as 'delivered', update:
-        - The corresponding order's status to 'delivered'.
-        - Reduce the product's total_required_quantity.
-        - Increase the product's total_shipped.
+        When a shipment becomes 'delivered':
+        - The corresponding order's status changes to 'delivered', which releases
+          its total_required_quantity through the Order signals.
+        - The product's total_shipped increases.
+        Both changes are recorded in the inventory ledger.
         """
-        if self.status == "delivered":
+        if self.status == "delivered" and getattr(self, '_loaded_status', None) != "delivered":
             order = self.order
-            product = order.product
 
             # Update order status
             order.status = "delivered"
             order.save(update_fields=["status"])
 
             # Update product details
-            product.total_required_quantity = max(0, product.total_required_quantity - order.required_qty)
-            product.total_shipped += order.required_qty
-            product.save(update_fields=["total_required_quantity", "total_shipped"])
+            Product.objects.add_quantities(total_shipped={order.product_id: order.required_qty})
+            InventoryMovement.objects.record(
+                'delivery', reference=f"order:{order.order_id}", shipped={order.product_id: order.required_qty}
+            )
 
         super().save(*args, **kwargs)
+        self._loaded_status = self.status
 
     def __str__(self):
         truck_license_plate = getattr(self.employee.truck, 'license_plate', 'No Truck Assigned')
         return f"Shipment {self.shipment_id} - {truck_license_plate}"
 
+class InventoryMovementQuerySet(models.QuerySet):
+    def record(self, kind, reference='', available=None, shipped=None, required=None):
+        """
+        Append one movement per product with a single INSERT.
+
+        available, shipped and required map product_id to the change made to
+        available_quantity, total_shipped and total_required_quantity.
+        """
+        available, shipped, required = available or {}, shipped or {}, required or {}
+        movements = []
+        for product_id in set(available) | set(shipped) | set(required):
+            deltas = (available.get(product_id, 0), shipped.get(product_id, 0), required.get(product_id, 0))
+            if any(deltas):
+                movements.append(InventoryMovement(
+                    product_id=product_id,
+                    kind=kind,
+                    reference=reference,
+                    available_delta=deltas[0],
+                    shipped_delta=deltas[1],
+                    required_delta=deltas[2],
+                ))
+        return self.bulk_create(movements)
+
+
+class InventoryMovement(models.Model):
+    """
+    Append-only ledger of every change to a product's stock counters.
+
+    Product.available_quantity, total_shipped and total_required_quantity are
+    still updated in place, in the same transaction as each movement, and are
+    what every reader uses. The ledger is an audit trail next to them, not a
+    replacement: a stock change costs the product UPDATE plus an INSERT here,
+    and contention on hot product rows is unchanged. See app.inventory for
+    reading stock at any point in time and rebuilding drifted counters.
+    """
+    movement_id = models.BigAutoField(primary_key=True)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="movements")
+
+    KIND_CHOICES = [
+        ('opening', 'Opening Balance'),
+        ('receipt', 'Receipt'),
+        ('allocation', 'Allocation'),
+        ('delivery', 'Delivery'),
+        ('cancellation', 'Cancellation'),
+        ('demand', 'Demand'),
+        ('adjustment', 'Adjustment')
+    ]
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    available_delta = models.IntegerField(default=0)
+    shipped_delta = models.IntegerField(default=0)
+    required_delta = models.IntegerField(default=0)
+    reference = models.CharField(max_length=100, blank=True, help_text="What caused the movement, e.g. order:42")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = InventoryMovementQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=['product', 'movement_id'])]
+
+    def __str__(self):
+        return f"{self.kind} of product {self.product_id} ({self.available_delta:+d} available)"
+
+
+class StockSnapshot(models.Model):
+    """A product's counters with every movement up to last_movement_id folded in (see app.inventory)."""
+    snapshot_id = models.BigAutoField(primary_key=True)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="snapshots")
+    last_movement_id = models.BigIntegerField()
+    as_of = models.DateTimeField(help_text="created_at of the last folded movement")
+    available_quantity = models.IntegerField()
+    total_shipped = models.IntegerField()
+    total_required_quantity = models.IntegerField()
+
+    class Meta:
+        indexes = [models.Index(fields=['product', '-last_movement_id'])]
+
+    def __str__(self):
+        return f"Snapshot of product {self.product_id} as of {self.as_of}"
+
+
+class AllocationCheckpoint(models.Model):
+    """
+    High-water mark left by the last incremental allocation run (a single row).
+
+    The next incremental run only re-plans pending orders newer than
+    (last_order_date, last_order_id), older pending orders that changed (say,
+    back to pending) or whose product gained stock since stock_checked_at, and
+    the retry_order_ids the last run never got to decide on because another
+    run held them.
+    """
+    last_order_date = models.DateTimeField(null=True, blank=True)
+    last_order_id = models.IntegerField(null=True, blank=True)
+    stock_checked_at = models.DateTimeField(null=True, blank=True)
+    truck_ids = models.JSONField(default=list, help_text="Trucks that were available during the last run")
+    retry_order_ids = models.JSONField(
+        default=list, help_text="Pending orders below the high-water mark that the last run had to skip"
+    )
+    # Chunked runs commit chunk by chunk, so they claim the checkpoint instead of holding its row lock
+    claimed_at = models.DateTimeField(
+        null=True, blank=True, help_text="Set while a chunked incremental run is using the checkpoint"
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def load(cls, lock=False):
+        queryset = cls.objects.select_for_update() if lock else cls.objects
+        checkpoint, _ = queryset.get_or_create(pk=1)
+        return checkpoint
+
+    def __str__(self):
+        return f"Allocation checkpoint (order {self.last_order_id}, stock {self.stock_checked_at})"
+
+class AllocationJob(models.Model):
+    """An allocation run queued from the API and executed by a background worker (see app.jobs)."""
+    job_id = models.AutoField(primary_key=True)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    options = models.JSONField(default=dict, help_text="run_allocation() keyword arguments")
+
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed')
+    ]
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+
+    total_orders = models.PositiveIntegerField(default=0)
+    processed_orders = models.PositiveIntegerField(default=0)
+    allocated_count = models.PositiveIntegerField(default=0)
+    skipped_count = models.PositiveIntegerField(default=0)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def duration(self):
+        """Seconds spent running, so far if the job is still running."""
+        if not self.started_at:
+            return None
+        return ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+
+    def __str__(self):
+        return f"Allocation job {self.job_id} - {self.status}"
+
 class QRScan(models.Model):
     data = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     processed = models.BooleanField(default=False)
-    
+    # Client-supplied id that makes re-sending a scan harmless (see app.ingestion)
+    scan_id = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    # SHA-256 of data, to drop repeats of the same payload within the dedup window
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)  # Why the drainer could not book the scan, if it could not
+
+    class Meta:
+        indexes = [
+            # The drainer only ever reads the unprocessed tail, oldest first
+            models.Index(fields=['id'], name='qrscan_pending_idx', condition=models.Q(processed=False)),
+        ]
+
     def __str__(self):
         return f"{self.data[:30]}... - {self.timestamp.strftime('%Y-%m-%d %H:%M:%S')}"
\ No newline at end of file
@@ -0,0 +1,188 @@
+import json
+import logging
+import queue
+import threading
+import time
+import paho.mqtt.client as mqtt
+from django.db import InterfaceError, OperationalError, close_old_connections
+from .ingestion import enqueue_scans
+
+logger = logging.getLogger(__name__)
+
+# Longest wait between attempts while the database is unreachable
+MAX_RETRY_DELAY = 30.0
+
+# Bounds of paho's exponential backoff between reconnect attempts, in seconds
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+
+
+def scan_from_payload(payload):
+    """
+    Turn an MQTT message body into a scan for enqueue_scans().
+
+    The body is either the QR text itself or a JSON object {"qr_text", "scan_id"}.
+    """
+    text = payload.decode("utf-8", errors="replace").strip()
+    if text.startswith("{"):
+        try:
+            data = json.loads(text)
+            return {"qr_text": str(data.get("qr_text", "")), "scan_id": data.get("scan_id")}
+        except (ValueError, AttributeError):
+            pass
+    return {"qr_text": text}
+
+
+class ScanPipeline:
+    """
+    Writes scans handed over by the MQTT network thread to the database in micro-batches.
+
+    submit() blocks once ``max_queue`` scans are waiting, which stalls the
+    network thread and so pushes back on the broker instead of buffering
+    without bound. A writer thread collects up to ``batch_size`` scans, or
+    whatever arrived within ``max_delay`` seconds of the first one, and
+    queues them with a single enqueue_scans() call. If the database is
+    unreachable, the batch is retried with exponential backoff. Any other
+    error is taken to be a bad scan: the batch is split until the offending
+    scans are isolated, and those are logged and dropped. Callbacks given to
+    submit() run once their scan is committed or dropped.
+    """
+
+    def __init__(self, batch_size=200, max_delay=0.02, max_queue=5000):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0  # Scans the database refused, acked so the broker stops redelivering them
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="scan-writer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def submit(self, scan, on_written=None):
+        self._queue.put((scan, on_written))
+
+    def stop(self, timeout=None):
+        """Write what is still queued, then stop the writer thread."""
+        self._stopping.set()
+        self._thread.join(timeout)
+
+    @property
+    def backlog(self):
+        return self._queue.qsize()
+
+    def _collect(self):
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        delay = 0.5
+        while True:
+            # The writer lives as long as the listener; drop connections the database has closed
+            close_old_connections()
+            try:
+                self._write_scans([scan for scan, _ in batch])
+                break
+            except (OperationalError, InterfaceError) as e:
+                logger.error(f"Could not write {len(batch)} scans, retrying in {delay:.1f}s: {str(e)}")
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+
+        self.batches += 1
+        for _, on_written in batch:
+            if on_written is not None:
+                on_written()
+
+
+    def _write_scans(self, scans):
+        """Write scans, halving the batch around any scan the database refuses and dropping that scan."""
+        try:
+            result = enqueue_scans(scans)
+        except (OperationalError, InterfaceError):
+            raise
+        except Exception as e:
+            if len(scans) == 1:
+                self.dropped += 1
+                logger.error(f"Dropped QR scan {scans[0].get('scan_id')!r} the database refused: {str(e)}")
+                return
+            middle = len(scans) // 2
+            self._write_scans(scans[:middle])
+            self._write_scans(scans[middle:])
+            return
+
+        self.written += len(scans)
+        if result.rejected:
+            logger.warning(f"Rejected {len(result.rejected)} scans: {result.rejected[:5]}")
+
+
+def connect_listener(pipeline, host, port, topic, client_id, qos=1):
+    """
+    Start an MQTT client that feeds ``topic`` into ``pipeline`` and return it.
+
+    The session is persistent (clean_session=False under a fixed client id),
+    so the broker keeps QoS 1 messages for us while we are away. Messages are
+    acknowledged by hand only once the pipeline has committed them, so a scan
+    the listener dies holding is redelivered rather than lost. Reconnects,
+    including the first connection, are left to paho's network thread with
+    exponential backoff.
+    """
+
+    # Packet ids are per connection: an ack for a message received before a
+    # reconnect could acknowledge a different message, so it is skipped
+    # (the broker redelivers the original, and scan_ids make that harmless)
+    connection = {"generation": 0}
+
+    def on_connect(client, userdata, flags, reason_code, properties):
+        connection["generation"] += 1
+        logger.info(f"Connected to MQTT with result code {reason_code} (session present: {flags.session_present})")
+        # Re-subscribing is harmless when the broker kept the session
+        client.subscribe(topic, qos=qos)
+
+    def on_message(client, userdata, msg):
+        generation = connection["generation"]
+
+        def ack():
+            if connection["generation"] == generation:
+                client.ack(msg.mid, msg.qos)
+
+        # Blocks only when the pipeline's queue is full, which holds back the broker
+        pipeline.submit(scan_from_payload(msg.payload), on_written=ack)
+
+    def on_disconnect(client, userdata, flags, reason_code, properties):
+        logger.warning(f"Disconnected from MQTT broker ({reason_code}), paho will reconnect")
+
+    client = mqtt.Client(
+        mqtt.CallbackAPIVersion.VERSION2,
+        client_id=client_id,
+        clean_session=False,
+        protocol=mqtt.MQTTv311,
+        manual_ack=True,
+    )
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.on_disconnect = on_disconnect
+    client.reconnect_delay_set(min_delay=RECONNECT_MIN_DELAY, max_delay=RECONNECT_MAX_DELAY)
+
+    client.connect_async(host, port, keepalive=60)
+    client.loop_start()
+    return client
@@ -0,0 +1,110 @@
+import base64
+import json
+from datetime import datetime
+from django.db.models import Q
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a (timestamp, id) pair, newest first.
+
+    Each page is fetched with a WHERE on the last row of the previous page
+    instead of an OFFSET, so it costs the same at any depth given an index on
+    (timestamp, id) (see Order.Meta and Shipment.Meta). The total is only
+    counted when the client asks for it with ?count=true. Responses carry
+    opaque ``next``/``previous`` links.
+    """
+
+    page_size = 10
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    cursor_query_param = "cursor"
+    count_query_param = "count"
+
+    def __init__(self, date_field, id_field):
+        self.date_field = date_field
+        self.id_field = id_field
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+
+        self.count = None
+        if request.query_params.get(self.count_query_param, "").lower() == "true":
+            self.count = queryset.count()
+
+        if position is not None:
+            date, pk = position
+            # Spelled with a plain range bound as well, so the planner can seek the index
+            if reverse:
+                queryset = queryset.filter(**{f"{self.date_field}__gte": date}).filter(
+                    Q(**{f"{self.date_field}__gt": date}) | Q(**{self.date_field: date, f"{self.id_field}__gt": pk})
+                )
+            else:
+                queryset = queryset.filter(**{f"{self.date_field}__lte": date}).filter(
+                    Q(**{f"{self.date_field}__lt": date}) | Q(**{self.date_field: date, f"{self.id_field}__lt": pk})
+                )
+
+        ordering = (self.date_field, self.id_field) if reverse else (f"-{self.date_field}", f"-{self.id_field}")
+        # One extra row tells whether there is anything beyond this page
+        rows = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.page = rows
+        self.has_next = has_more if not reverse else position is not None
+        self.has_previous = position is not None if not reverse else has_more
+        return rows
+
+    def get_paginated_response(self, data):
+        payload = {"next": self.get_next_link(), "previous": self.get_previous_link()}
+        if self.count is not None:
+            payload["count"] = self.count
+        payload["results"] = data
+        return Response(payload)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            # An empty cursor, not none, so the link stays in keyset mode (see get_orders)
+            return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, "")
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, row, reverse):
+        position = [getattr(row, self.date_field).isoformat(), getattr(row, self.id_field), int(reverse)]
+        cursor = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        """((timestamp, id), reverse) from the cursor parameter, or (None, False) on the first page."""
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            date, pk, reverse = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return (datetime.fromisoformat(date), int(pk)), bool(reverse)
+        except (TypeError, ValueError):
+            raise InvalidCursor("Invalid cursor")
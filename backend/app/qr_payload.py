@@ -0,0 +1,105 @@
+"""
+Parsing of the text carried by QR labels.
+
+The regex parser and the QRPayload it builds cost more than the split-based
+parsing store_qr_code used to do: an uncached parse runs at about 0.35x the
+old speed (see ``manage.py benchmark_qr_parser``). The speedup comes entirely
+from the LRU cache, so it holds only while labels repeat often enough to hit it.
+"""
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+
+# Version 1, what the labels have always carried: "name=Widget|category=Tools|quantity=5"
+# (any order, unknown keys ignored, the last occurrence of a key wins)
+V1_PAIR = re.compile(r'(?:^|\|)([^|=]*)=([^|]*)')
+
+# Version 2, the compact form: "2|Widget|Tools|5", or "2|#17|5" to name the product by its id
+V2_PREFIX = "2|"
+V2_PAYLOAD = re.compile(r'2\|(?:#(?P<product_id>[0-9]+)|(?P<name>[^|]*)\|(?P<category>[^|]*))\|(?P<quantity>[^|]*)')
+
+QUANTITY = re.compile(r'[0-9]+')
+
+# Labels repeat constantly, so parsed payloads are kept for the raw text
+CACHE_SIZE = 4096
+
+
+class InvalidScan(ValueError):
+    """A QR payload that cannot be booked; the message is safe to return to the client."""
+
+
+@dataclass(frozen=True, slots=True)
+class QRPayload:
+    quantity: int
+    name: str = ""
+    category: str = ""
+    product_id: int | None = None  # Set by compact payloads that name the product by id
+    version: int = 1
+
+    def encode(self, version=None):
+        """The payload as label text, in its own format or the given version."""
+        version = version or self.version
+        if version == 1:
+            return f"name={self.name}|category={self.category}|quantity={self.quantity}"
+        if self.product_id is not None:
+            return f"{V2_PREFIX}#{self.product_id}|{self.quantity}"
+        return f"{V2_PREFIX}{self.name}|{self.category}|{self.quantity}"
+
+
+def parse_qr_text(qr_text):
+    """
+    Parse the text of a QR label into a QRPayload.
+
+    Raises InvalidScan with the same messages store_qr_code has always returned.
+    """
+    return _parse((qr_text or "").strip())
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse(qr_text):
+    if not qr_text:
+        raise InvalidScan("QR Code data is empty")
+    if qr_text.startswith(V2_PREFIX):
+        return _parse_v2(qr_text)
+    return _parse_v1(qr_text)
+
+
+def _parse_v1(qr_text):
+    data_dict = dict(V1_PAIR.findall(qr_text))
+
+    product_name = data_dict.get("name", "").strip()
+    category_name = data_dict.get("category", "").strip()
+    quantity = _quantity(data_dict.get("quantity", "0"))
+
+    if not product_name or not category_name or quantity <= 0:
+        raise InvalidScan("Invalid QR Code data")
+    return QRPayload(quantity=quantity, name=product_name, category=category_name)
+
+
+def _parse_v2(qr_text):
+    match = V2_PAYLOAD.fullmatch(qr_text)
+    if match is None:
+        raise InvalidScan("Invalid QR Code data")
+
+    quantity = _quantity(match["quantity"])
+    if match["product_id"] is not None:
+        payload = QRPayload(quantity=quantity, product_id=int(match["product_id"]), version=2)
+    else:
+        payload = QRPayload(quantity=quantity, name=match["name"].strip(), category=match["category"].strip(), version=2)
+        if not payload.name or not payload.category:
+            raise InvalidScan("Invalid QR Code data")
+
+    if quantity <= 0:
+        raise InvalidScan("Invalid QR Code data")
+    return payload
+
+
+def _quantity(text):
+    text = text.strip()
+    if not QUANTITY.fullmatch(text):
+        raise InvalidScan("Quantity must be a positive integer")
+    return int(text)
+
+
+def cache_info():
+    return _parse.cache_info()
@@ -0,0 +1,158 @@
+import hashlib
+import threading
+import time
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from .fast_json import wants_plain_json
+
+KEY_PREFIX = "response-cache"
+CACHE_ALIAS = "responses"
+# Backends private to one process, where a write made elsewhere could never bump the version
+PER_PROCESS_BACKENDS = (LocMemCache, DummyCache)
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def enabled():
+    """True when the responses cache is shared between processes; otherwise nothing is cached."""
+    return not isinstance(_cache(), PER_PROCESS_BACKENDS)
+
+
+def _version_key(model):
+    return f"{KEY_PREFIX}:version:{model._meta.label_lower}"
+
+
+def bump_version(model):
+    """
+    Invalidate every cached response built from model, once the current transaction commits.
+
+    Called from the post_save/post_delete signals and from VersionedQuerySet,
+    whose bulk writes send no signals. Bumping after the commit means no request
+    can cache pre-commit data under the new version. However many writes a
+    transaction makes to a model, its version is bumped once.
+    """
+    if not enabled():
+        return
+    key = _version_key(model)
+    connection = transaction.get_connection()
+    # Django drops the callbacks of rolled-back savepoints from this list, so a
+    # queued bump found here is one that will really run
+    if connection.in_atomic_block and any(
+        isinstance(func, _Bump) and func.key == key and not func.ran for _, func, _ in connection.run_on_commit
+    ):
+        return
+    transaction.on_commit(_Bump(key))
+
+
+class _Bump:
+    """on_commit callback that gives one model a new version."""
+
+    def __init__(self, key):
+        self.key = key
+        self.ran = False  # Tests run callbacks without leaving the transaction
+
+    def __call__(self):
+        # A plain set of a fresh value: incr is a read-modify-write on most
+        # backends, so two commits could both write the same next version
+        _cache().set(self.key, _new_version(), None)
+        self.ran = True
+
+
+_last_version = 0
+_version_lock = threading.Lock()
+
+
+def _new_version():
+    """The clock in nanoseconds, made strictly increasing within this process."""
+    global _last_version
+    with _version_lock:
+        _last_version = max(time.time_ns(), _last_version + 1)
+        return _last_version
+
+
+def current_versions(models):
+    cache = _cache()
+    keys = [_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            started = _new_version()
+            versions[key] = started if cache.add(key, started, None) else cache.get(key, started)
+    return [versions[key] for key in keys]
+
+
+def _role(user):
+    if user.is_staff:
+        return "staff"
+    return "user" if user.is_authenticated else "anonymous"
+
+
+def _matches(if_none_match, etag):
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag in tags
+
+
+def cached_response(*models, timeout=None):
+    """
+    Cache a GET view's JSON response until one of models changes.
+
+    Goes directly above the view function, under @api_view and
+    @permission_classes, so authentication and permissions still run on every
+    request. Responses are keyed by path, query string and the user's role,
+    and tagged with an ETag derived from that key and the models' version
+    counters (see bump_version). A poll whose If-None-Match still matches gets
+    a 304 without touching the database or the cached body. Only compact JSON
+    is cached; the browsable API always runs the view. Nothing is cached
+    unless the "responses" cache is shared between processes (see enabled()).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != "GET" or not wants_plain_json(request) or not enabled():
+                return view(request, *args, **kwargs)
+            cache = _cache()
+
+            # Versions are read before the view runs, so a change made meanwhile is never cached as current
+            query = sorted((key, sorted(values)) for key, values in request.GET.lists())
+            tag = f"{request.path}|{query}|{_role(request.user)}|{current_versions(models)}"
+            etag = f'"{hashlib.sha1(tag.encode()).hexdigest()}"'
+
+            if _matches(request.headers.get("If-None-Match", ""), etag):
+                response = HttpResponseNotModified()
+                response["ETag"] = etag
+                return response
+
+            entry_key = f"{KEY_PREFIX}:entry:{etag}"
+            entry = cache.get(entry_key)
+            if entry is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                entry = _render(request, response)
+                cache.set(entry_key, entry, settings.RESPONSE_CACHE_TIMEOUT if timeout is None else timeout)
+
+            content, content_type = entry
+            response = HttpResponse(content, content_type=content_type)
+            response["ETag"] = etag
+            # Browsers keep the body but revalidate every poll, which is then a 304
+            response["Cache-Control"] = "private, no-cache"
+            return response
+        return wrapper
+    return decorator
+
+
+def _render(request, response):
+    """(bytes, content type) of a view's response, rendered the way DRF would have."""
+    if response.streaming:
+        return b"".join(response.streaming_content), response["Content-Type"]
+    if hasattr(response, "data"):
+        renderer = request.accepted_renderer
+        return renderer.render(response.data, request.accepted_media_type, {"request": request}), renderer.media_type
+    return response.content, response["Content-Type"]
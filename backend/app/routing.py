@@ -0,0 +1,103 @@
+import bisect
+import numpy as np
+
+# Widest spread of Retailer.distance_from_warehouse allowed on one route
+DEFAULT_BAND_WIDTH = 10.0
+
+
+class Route:
+    """One truck's run: its employee, the orders it carries and their stops ordered by distance."""
+
+    def __init__(self, employee, orders):
+        self.employee = employee
+        self.orders = orders
+        self.load = sum(order.required_qty for order in orders)
+
+    @property
+    def distance(self):
+        # Out to the farthest stop and back; nearer stops lie on the way
+        return 2 * max(order.retailer.distance_from_warehouse for order in self.orders)
+
+    def as_dict(self):
+        truck = self.employee.truck
+        return {
+            "employee_id": self.employee.employee_id,
+            "truck_id": truck.truck_id,
+            "license_plate": truck.license_plate,
+            "capacity": truck.capacity,
+            "load": self.load,
+            "distance": round(self.distance, 2),
+            "stops": [
+                {
+                    "order_id": order.order_id,
+                    "retailer_id": order.retailer.retailer_id,
+                    "distance_from_warehouse": order.retailer.distance_from_warehouse,
+                    "required_qty": order.required_qty,
+                }
+                for order in self.orders
+            ],
+        }
+
+
+def plan_routes(orders, employees, band_width=DEFAULT_BAND_WIDTH):
+    """
+    Batch orders for nearby retailers onto shared trucks.
+
+    Orders are sorted by distance in one vectorised pass. Each route then takes
+    the longest run of consecutive orders whose distances span at most
+    ``band_width`` and whose quantities fit the largest truck still free, both
+    found with a binary search over NumPy prefix arrays. The run is finally
+    handed to the smallest free truck that can carry it.
+
+    Returns (routes, unrouted_orders).
+    """
+    if not orders:
+        return [], []
+
+    distances = np.fromiter((order.retailer.distance_from_warehouse for order in orders), dtype=float, count=len(orders))
+    quantities = np.fromiter((order.required_qty for order in orders), dtype=np.int64, count=len(orders))
+
+    # Nearest first; larger orders first among retailers at the same distance
+    sequence = np.lexsort((-quantities, distances))
+    distances = distances[sequence]
+    cumulative = np.concatenate(([0], np.cumsum(quantities[sequence])))
+    # Furthest position each order's band reaches, for every start at once
+    band_ends = np.searchsorted(distances, distances + band_width, side='right')
+
+    free = sorted((emp.truck.capacity, i) for i, emp in enumerate(employees))
+    routes = []
+    unrouted = []
+    start = 0
+
+    while start < len(orders):
+        if not free:
+            unrouted.extend(orders[i] for i in sequence[start:])
+            break
+
+        largest = free[-1][0]
+        end = min(
+            int(band_ends[start]),
+            int(np.searchsorted(cumulative, cumulative[start] + largest, side='right')) - 1,
+        )
+
+        if end <= start:
+            # Bigger than any truck still free
+            unrouted.append(orders[sequence[start]])
+            start += 1
+            continue
+
+        load = int(cumulative[end] - cumulative[start])
+        _, position = free.pop(bisect.bisect_left(free, (load, -1)))
+        routes.append(Route(employees[position], [orders[i] for i in sequence[start:end]]))
+        start = end
+
+    return routes, unrouted
+
+
+def route_summary(routes, orders):
+    """Compare the batched plan against sending one truck per order."""
+    return {
+        "routes": len(routes),
+        "total_distance": round(sum(route.distance for route in routes), 2),
+        "unbatched_distance": round(sum(2 * order.retailer.distance_from_warehouse for order in orders), 2),
+    }
@@ -1,68 +1,117 @@
+from django.contrib.auth.models import User
 from rest_framework import serializers
-from .models import Product, Category, Retailer, Order,  Employee, Truck, Shipment
+from .models import Product, Category, Retailer, Order,  Employee, Truck, Shipment, AllocationJob
+
+
+def _query_list(request, name):
+    return [item for item in request.query_params.get(name, "").split(",") if item]
+
+
+class SparseFieldsetMixin:
+    """
+    Sparse fieldsets (?fields=order_id,status) and nested expansion (?expand=retailer,product).
+
+    Subclasses declare the joins every row needs in ``select_related`` and,
+    in ``expandable``, the relations a client may expand, as
+    field -> (serializer class, select_related path). optimize() applies those
+    joins up front, so a page costs the same number of queries at any size.
+    """
+
+    select_related = ()
+    expandable = {}
+
+    def __init__(self, *args, fields=None, expand=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in expand:
+            if name in self.expandable:
+                self.fields[name] = self.expandable[name][0](read_only=True)
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def request_options(cls, request):
+        """The fields/expand keyword arguments asked for in the query string."""
+        return {"fields": _query_list(request, "fields"), "expand": _query_list(request, "expand")}
+
+    @classmethod
+    def optimize(cls, queryset, fields=None, expand=()):
+        joins = [*cls.select_related, *(cls.expandable[name][1] for name in expand if name in cls.expandable)]
+        return queryset.select_related(*joins) if joins else queryset
+
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = '__all__'
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     category = serializers.CharField(source='category.name')  # Fetching category name instead of ID
+    select_related = ('category',)
 
     class Meta:
         model = Product
-        fields = '__all__'  # Keep all fields from the Product model, but override 'category'
+        exclude = ['stock_updated_at']  # Keep all other fields from the Product model, but override 'category'
 
 
-class RetailerSerializer(serializers.ModelSerializer):
+class RetailerSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Retailer
         fields = '__all__'
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    expandable = {
+        'retailer': (RetailerSerializer, 'retailer'),
+        'product': (ProductSerializer, 'product__category'),
+    }
+
     class Meta:
         model = Order
-        fields = '__all__'
+        exclude = ['updated_at']  # Internal change marker for incremental allocation
 
 
 
-class TruckSerializer(serializers.ModelSerializer):
+class TruckSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Truck
         fields = '__all__'
 
-class EmployeeSerializer(serializers.ModelSerializer):
+class UserSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['id', 'username']
+
+class EmployeeSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    expandable = {
+        'user': (UserSummarySerializer, 'user'),
+        'truck': (TruckSerializer, 'truck'),
+    }
+
     class Meta:
         model = Employee
         fields = '__all__'
 
-class ShipmentSerializer(serializers.ModelSerializer):
+class ShipmentSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    # Delivery side effects (order status, product counters, ledger) live in Shipment.save()
+    expandable = {
+        'order': (OrderSerializer, 'order'),
+        'employee': (EmployeeSerializer, 'employee'),
+    }
+
     class Meta:
         model = Shipment
         fields = '__all__'
+class AllocationJobSerializer(serializers.ModelSerializer):
+    duration = serializers.FloatField(read_only=True)  # Seconds spent running so far
 
-    def update(self, instance, validated_data):
-        """
-        When status is updated to 'delivered', update:
-        - The order's status
-        - The product's total_required_quantity and total_shipped
-        """
-        if "status" in validated_data and validated_data["status"] == "delivered":
-            order = instance.order
-            product = order.product
-
-            # Update order status
-            order.status = "delivered"
-            order.save(update_fields=["status"])
-
-            # Update product details
-            product.total_required_quantity = max(0, product.total_required_quantity - order.required_qty)
-            product.total_shipped += order.required_qty
-            product.save(update_fields=["total_required_quantity", "total_shipped"])
-
-        return super().update(instance, validated_data)
-    
-class CategorySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AllocationJob
+        fields = [
+            'job_id', 'status', 'options', 'total_orders', 'processed_orders', 'allocated_count',
+            'skipped_count', 'result', 'error', 'created_at', 'started_at', 'finished_at', 'duration'
+        ]
+
+class CategoryStockSerializer(serializers.ModelSerializer):
     product_count = serializers.IntegerField(read_only=True)
 
     class Meta:
@@ -1,8 +1,9 @@
 from django.db.models.signals import post_save, post_delete, pre_save
-from django.db.models import F
 from django.dispatch import receiver
 from django.contrib.auth.models import User, Group
-from .models import Order, Product, Shipment, Truck, Employee
+from . import lookup_cache, response_cache
+from .models import Category, Order, Product, Retailer, Shipment, Truck, Employee
+from .stock import current_batch, record_required_quantities
 
 
 # ===================== EMPLOYEE SIGNAL =====================
@@ -45,6 +46,18 @@ def make_truck_available(sender, instance, **kwargs):
 @receiver(pre_save, sender=Order)
 def store_old_order_status(sender, instance, **kwargs):
     """Stores the old order status and quantity before saving."""
+    if instance.pk is None:
+        # Not in the database yet, nothing to look up
+        instance._old_status = None
+        instance._old_required_qty = None
+        return
+
+    if current_batch() is not None and hasattr(instance, '_loaded_status'):
+        # Batched writes trust the values the instance was loaded with
+        instance._old_status = instance._loaded_status
+        instance._old_required_qty = instance._loaded_required_qty
+        return
+
     try:
         old_order = Order.objects.get(pk=instance.pk)
         instance._old_status = old_order.status
@@ -57,32 +70,19 @@ def store_old_order_status(sender, instance, **kwargs):
 @receiver(post_save, sender=Order)
 def update_product_required_quantity_on_save(sender, instance, created, **kwargs):
     """Updates total_required_quantity in Product when an Order is created or updated."""
-    product = instance.product
-
     if created:
-        if instance.status in ['pending', 'allocated']:
-            Product.objects.filter(product_id=product.product_id).update(
-                total_required_quantity=F('total_required_quantity') + instance.required_qty
-            )
+        delta = Order.required_quantity_delta(None, 0, instance.status, instance.required_qty)
     else:
-        old_status = instance._old_status
-        old_required_qty = instance._old_required_qty
-
-        if old_status in ['pending', 'allocated'] and instance.status in ['delivered', 'cancelled']:
-            Product.objects.filter(product_id=product.product_id).update(
-                total_required_quantity=F('total_required_quantity') - old_required_qty
-            )
+        delta = Order.required_quantity_delta(
+            instance._old_status, instance._old_required_qty, instance.status, instance.required_qty
+        )
 
-        elif old_status in ['delivered', 'cancelled'] and instance.status in ['pending', 'allocated']:
-            Product.objects.filter(product_id=product.product_id).update(
-                total_required_quantity=F('total_required_quantity') + instance.required_qty
-            )
+    if delta:
+        record_required_quantities({instance.product_id: delta}, Order.movement_kind(instance.status))
 
-        elif old_status in ['pending', 'allocated'] and instance.status in ['pending', 'allocated']:
-            quantity_difference = instance.required_qty - old_required_qty
-            Product.objects.filter(product_id=product.product_id).update(
-                total_required_quantity=F('total_required_quantity') + quantity_difference
-            )
+    # Later saves of the same instance start from what was just written
+    instance._loaded_status = instance.status
+    instance._loaded_required_qty = instance.required_qty
 
 
 # ===================== SHIPMENT SIGNALS =====================
@@ -100,8 +100,37 @@ def update_truck_availability_on_shipment(sender, instance, created, **kwargs):
                 truck.is_available = True
         truck.save()
 
-    # ✅ Ensure product's total_required_quantity never goes negative
+    # ✅ Delivery changed the product's counters in Shipment.save(); bring its status in line
     if instance.status == "delivered":
-        product = instance.order.product
-        product.update_status()
-        product.save(update_fields=["total_required_quantity", "total_shipped", "status"])
\ No newline at end of file
+        Product.objects.filter(product_id=instance.order.product_id).refresh_status()
+
+
+# ===================== LOOKUP CACHE SIGNALS =====================
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_lookup(sender, instance, **kwargs):
+    """Forget the cached id of a renamed or deleted category (see app.lookup_cache)."""
+    lookup_cache.category_ids.discard(instance.name, instance.category_id)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_lookup(sender, instance, **kwargs):
+    """Forget the cached id of a renamed, moved or deleted product."""
+    lookup_cache.product_ids.discard((instance.name, instance.category_id), instance.product_id)
+
+
+# ===================== RESPONSE CACHE SIGNALS =====================
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Retailer)
+@receiver(post_delete, sender=Retailer)
+@receiver(post_save, sender=Truck)
+@receiver(post_delete, sender=Truck)
+def invalidate_cached_responses(sender, **kwargs):
+    """Drop the cached read responses built from this model (see app.response_cache)."""
+    response_cache.bump_version(sender)
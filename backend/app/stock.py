@@ -0,0 +1,79 @@
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from django.db import transaction
+from .models import InventoryMovement, Product
+
+_state = threading.local()
+
+
+class RequiredQuantityBatch:
+    """Net total_required_quantity changes per ledger kind and product, collected while a batch is open."""
+
+    def __init__(self):
+        self.deltas = defaultdict(lambda: defaultdict(int))
+
+    def add(self, product_id, delta, kind='demand'):
+        self.deltas[kind][product_id] += delta
+
+    def flush(self):
+        """Apply every collected change in one UPDATE, append it to the ledger and start over."""
+        totals = defaultdict(int)
+        for kind, per_product in self.deltas.items():
+            InventoryMovement.objects.record(kind, required=per_product)
+            for product_id, delta in per_product.items():
+                totals[product_id] += delta
+        self.deltas.clear()
+        return Product.objects.add_quantities(
+            total_required_quantity={product_id: delta for product_id, delta in totals.items() if delta}
+        )
+
+
+def current_batch():
+    """The batch opened by batched_order_updates() on this thread, if any."""
+    return getattr(_state, 'batch', None)
+
+
+@contextmanager
+def batched_order_updates():
+    """
+    Open a batch for Order writes made inside the block.
+
+    While it is open, the Order signals skip their extra SELECT for rows loaded
+    from the database and, instead of one UPDATE on Product per save, add the
+    change to the batch. The net change per product is applied in a single
+    aggregated UPDATE (plus one ledger INSERT per movement kind) just before
+    the block's transaction commits. Nested
+    blocks join the outer batch.
+
+        with batched_order_updates():
+            for order in orders:
+                order.save()
+    """
+    if current_batch() is not None:
+        yield current_batch()
+        return
+
+    batch = RequiredQuantityBatch()
+    _state.batch = batch
+    try:
+        with transaction.atomic():
+            yield batch
+            batch.flush()
+    finally:
+        _state.batch = None
+
+
+def record_required_quantities(deltas, kind='demand'):
+    """
+    Apply {product_id: delta} to total_required_quantity and the ledger now,
+    or add it to the open batch.
+    """
+    batch = current_batch()
+    if batch is None:
+        InventoryMovement.objects.record(kind, required=deltas)
+        return Product.objects.add_quantities(total_required_quantity=deltas)
+
+    for product_id, delta in deltas.items():
+        batch.add(product_id, delta, kind)
+    return 0
@@ -1,3 +1,1390 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import random
+import threading
+from contextlib import nullcontext
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import DataError, OperationalError, connection, transaction
+from django.db.models import QuerySet, Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+from app import allocation, lookup_cache, response_cache
+from app.fast_json import ValuesSerializer
+from app.imports import import_rows
+from app.jobs import execute_job, recover_stale_jobs
+from app.lookup_cache import LRUCache
+from app.management.commands.explain_hot_queries import SEQ_SCAN, hot_queries
+from app.inventory import compact_snapshots, current_stock, rebuild_counters, stock_at
+from app.ingestion import IngestionResult, _insert_scans, backlog_stats, drain_scans, enqueue_scans
+from app.mqtt_pipeline import ScanPipeline, connect_listener, scan_from_payload
+from app.qr_payload import InvalidScan, QRPayload, parse_qr_text
+from app.serializers import OrderSerializer, ProductSerializer
+from app.stock import batched_order_updates, current_batch
+from app.models import (
+    AllocationCheckpoint, AllocationJob, Category, Employee, InventoryMovement, Order, Product, QRScan, Retailer, Shipment,
+    StockSnapshot, Truck,
+)
 
-# Create your tests here.
+
+@override_settings(QR_DRAIN_IN_PROCESS=False)
+class EnqueueScansTests(TestCase):
+    def test_malformed_items_are_rejected_by_index(self):
+        result = enqueue_scans([
+            {"qr_text": 5},
+            {"qr_text": "name=Widget|category=Tools|quantity=2", "scan_id": "x" * 65},
+            {"qr_text": "name=Widget|category=Tools|quantity=2", "scan_id": {"id": 1}},
+            "name=Widget|category=Tools|quantity=2",
+            {"qr_text": "name=Widget|category=Tools|quantity=2", "scan_id": "ok-1"},
+        ])
+
+        self.assertEqual(result.accepted, 1)
+        self.assertEqual([item["index"] for item in result.rejected], [0, 1, 2, 3])
+        self.assertEqual(QRScan.objects.count(), 1)
+
+    def test_only_rows_really_inserted_are_counted(self):
+        # A concurrent request queued race-1 after enqueue_scans checked for it
+        QRScan.objects.create(data="name=Widget|category=Tools|quantity=2", scan_id="race-1")
+
+        inserted = _insert_scans([
+            QRScan(data="name=Widget|category=Tools|quantity=2", scan_id="race-1"),
+            QRScan(data="name=Widget|category=Tools|quantity=3", scan_id="race-2"),
+        ])
+
+        self.assertEqual(inserted, 1)
+        self.assertEqual(QRScan.objects.count(), 2)
+
+
+def legacy_parse(qr_data):
+    """The parsing store_qr_code did inline before app.qr_payload: (name, category, quantity) or the error message."""
+    qr_data = qr_data.strip()
+    if not qr_data:
+        return "QR Code data is empty"
+    data_dict = {}
+    for item in qr_data.split("|"):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            data_dict[key] = value
+    product_name = data_dict.get("name", "").strip()
+    category_name = data_dict.get("category", "").strip()
+    quantity_str = data_dict.get("quantity", "0").strip()
+    if not quantity_str.isdigit():
+        return "Quantity must be a positive integer"
+    quantity = int(quantity_str)
+    if not product_name or not category_name or quantity <= 0:
+        return "Invalid QR Code data"
+    return product_name, category_name, quantity
+
+
+class QRPayloadTests(SimpleTestCase):
+    def parsed(self, qr_text):
+        try:
+            payload = parse_qr_text(qr_text)
+        except InvalidScan as e:
+            return str(e)
+        return payload.name, payload.category, payload.quantity
+
+    def test_v1_payloads(self):
+        self.assertEqual(parse_qr_text(" name=Widget|category=Tools|quantity=5\n"), QRPayload(quantity=5, name="Widget", category="Tools"))
+        # Any order, unknown keys ignored, the last occurrence of a key wins, values may contain '='
+        self.assertEqual(self.parsed("quantity=1|lot=A7|category=Tools|name=a=b|quantity= 7 "), ("a=b", "Tools", 7))
+
+    def test_v2_payloads(self):
+        self.assertEqual(parse_qr_text("2| Widget |Tools|5"), QRPayload(quantity=5, name="Widget", category="Tools", version=2))
+        self.assertEqual(parse_qr_text("2|#17|3"), QRPayload(quantity=3, product_id=17, version=2))
+
+    def test_payloads_survive_encoding(self):
+        for payload in (QRPayload(quantity=4, name="Widget", category="Tools"), QRPayload(quantity=4, product_id=9, version=2)):
+            self.assertEqual(parse_qr_text(payload.encode()), payload)
+        self.assertEqual(parse_qr_text(QRPayload(quantity=4, name="Widget", category="Tools").encode(2)).name, "Widget")
+
+    def test_malformed_payloads(self):
+        cases = {
+            "": "QR Code data is empty",
+            None: "QR Code data is empty",
+            "name=Widget|category=Tools": "Invalid QR Code data",
+            "name=Widget|category=Tools|quantity=-2": "Quantity must be a positive integer",
+            "name=Widget|category=Tools|quantity=2.5": "Quantity must be a positive integer",
+            "name=|category=Tools|quantity=2": "Invalid QR Code data",
+            "2|Widget|Tools": "Invalid QR Code data",
+            "2|Widget||4": "Invalid QR Code data",
+            "2|#17|0": "Invalid QR Code data",
+            "2|#x|4": "Invalid QR Code data",
+            "2|Widget|Tools|many": "Quantity must be a positive integer",
+            "2|Widget|Tools|4|extra": "Invalid QR Code data",
+        }
+        for qr_text, message in cases.items():
+            with self.subTest(qr_text=qr_text):
+                self.assertEqual(self.parsed(qr_text), message)
+
+    def test_v1_parsing_matches_the_old_inline_parsing(self):
+        rnd = random.Random(12)
+        keys = ["name", "category", "quantity", "quantity", " name", "lot", ""]
+        values = ["Widget", " Tools ", "", "7", " 42 ", "03", "0", "-1", "x", "a=b", "2|", " "]
+
+        def segment():
+            if rnd.random() < 0.1:
+                return rnd.choice(values)  # No '=' at all
+            return f"{rnd.choice(keys)}={rnd.choice(values)}"
+
+        texts = ["|".join(segment() for _ in range(rnd.randint(0, 5))) for _ in range(5000)]
+        for text in texts:
+            if text.strip().startswith("2|"):
+                continue
+            with self.subTest(qr_text=text):
+                self.assertEqual(self.parsed(text), legacy_parse(text))
+
+
+class StoreQRTests(APITestCase):
+    @override_settings(QR_DRAIN_IN_PROCESS=False)
+    def test_batch_with_a_non_string_qr_text_rejects_only_that_item(self):
+        response = self.client.post("/api/store_qr/batch/", {"scans": [
+            {"qr_text": 5}, {"qr_text": "name=Widget|category=Tools|quantity=2"},
+        ]}, format="json")
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data["accepted"], 1)
+        self.assertEqual(response.data["rejected"][0]["index"], 0)
+
+    @override_settings(QR_DRAIN_IN_PROCESS=False)
+    def test_identical_labels_posted_singly_are_separate_items_unless_dedup_is_asked_for(self):
+        label = "name=Widget|category=Tools|quantity=2"
+        for _ in range(2):
+            self.assertEqual(self.client.post("/api/store_qr/", {"qr_text": label}, format="json").status_code, 200)
+        self.assertEqual(QRScan.objects.count(), 2)
+
+        response = self.client.post("/api/store_qr/", {"qr_text": label, "dedup": True}, format="json")
+        self.assertTrue(response.data["duplicate"])
+        self.assertEqual(QRScan.objects.count(), 2)
+
+    @override_settings(QR_DRAIN_IN_PROCESS=False)
+    def test_batch_drops_repeated_payloads_only_without_a_scan_id(self):
+        label = "name=Widget|category=Tools|quantity=2"
+        response = self.client.post("/api/store_qr/batch/", {"scans": [
+            label, label, {"qr_text": label, "scan_id": "a"}, {"qr_text": label, "scan_id": "b"},
+        ]}, format="json")
+
+        self.assertEqual((response.data["accepted"], response.data["duplicates"]), (3, 1))
+        self.assertEqual(QRScan.objects.count(), 3)
+
+    def test_single_scan_with_a_non_string_qr_text_is_a_bad_request(self):
+        response = self.client.post("/api/store_qr/", {"qr_text": 5}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+
+class ScanPipelineTests(SimpleTestCase):
+    def run_pipeline(self, scans, fake_enqueue):
+        acked = []
+        pipeline = ScanPipeline(batch_size=len(scans), max_delay=0.2)
+        with mock.patch("app.mqtt_pipeline.enqueue_scans", side_effect=fake_enqueue), \
+                mock.patch("app.mqtt_pipeline.close_old_connections"), \
+                mock.patch("app.mqtt_pipeline.time.sleep"):
+            pipeline.start()
+            for scan in scans:
+                pipeline.submit(scan, on_written=lambda scan=scan: acked.append(scan["scan_id"]))
+            pipeline.stop(timeout=5)
+        return pipeline, acked
+
+    def test_a_poison_scan_is_dropped_and_the_rest_written(self):
+        written = []
+
+        def fake_enqueue(batch):
+            if any(scan["scan_id"] == "poison" for scan in batch):
+                raise DataError("value too long for type character varying(64)")
+            written.extend(scan["scan_id"] for scan in batch)
+            return IngestionResult()
+
+        scans = [{"qr_text": "q", "scan_id": scan_id} for scan_id in ("a", "b", "poison", "c", "d")]
+        pipeline, acked = self.run_pipeline(scans, fake_enqueue)
+
+        self.assertEqual(sorted(written), ["a", "b", "c", "d"])
+        self.assertEqual(pipeline.dropped, 1)
+        self.assertEqual(sorted(acked), ["a", "b", "c", "d", "poison"])
+
+    def test_connection_errors_are_retried(self):
+        calls = []
+
+        def fake_enqueue(batch):
+            calls.append(len(batch))
+            if len(calls) < 3:
+                raise OperationalError("server closed the connection unexpectedly")
+            return IngestionResult()
+
+        pipeline, acked = self.run_pipeline([{"qr_text": "q", "scan_id": "a"}], fake_enqueue)
+
+        self.assertEqual(calls, [1, 1, 1])
+        self.assertEqual((pipeline.written, pipeline.dropped), (1, 0))
+        self.assertEqual(acked, ["a"])
+
+
+class MQTTListenerTests(SimpleTestCase):
+    def setUp(self):
+        self.submitted = []  # (scan, on_written)
+        pipeline = SimpleNamespace(submit=lambda scan, on_written: self.submitted.append((scan, on_written)))
+        with mock.patch("app.mqtt_pipeline.mqtt.Client") as client_class:
+            self.client = connect_listener(pipeline, "broker", 1883, "warehouse/qr", "listener-1")
+        self.client_options = client_class.call_args.kwargs
+
+    def connect(self):
+        self.client.on_connect(self.client, None, SimpleNamespace(session_present=True), 0, None)
+
+    def receive(self, mid, payload=b"name=Widget|category=Tools|quantity=2"):
+        self.client.on_message(self.client, None, SimpleNamespace(mid=mid, qos=1, payload=payload))
+        return self.submitted[-1][1]
+
+    def test_the_session_survives_restarts_and_acks_are_manual(self):
+        self.assertEqual(self.client_options["client_id"], "listener-1")
+        self.assertFalse(self.client_options["clean_session"])
+        self.assertTrue(self.client_options["manual_ack"])
+
+    def test_a_written_scan_is_acked_on_the_connection_it_came_from(self):
+        self.connect()
+        ack = self.receive(7)
+        self.client.ack.assert_not_called()
+
+        ack()
+
+        self.client.ack.assert_called_once_with(7, 1)
+        self.client.subscribe.assert_called_once_with("warehouse/qr", qos=1)
+
+    def test_acks_from_before_a_reconnect_are_skipped(self):
+        self.connect()
+        stale_ack = self.receive(7)
+        self.connect()
+        fresh_ack = self.receive(7)
+
+        stale_ack()
+        fresh_ack()
+
+        # The packet id now belongs to the redelivered message, which is acked once
+        self.client.ack.assert_called_once_with(7, 1)
+
+    def test_payloads_are_plain_text_or_json(self):
+        self.assertEqual(scan_from_payload(b" name=Widget|category=Tools|quantity=2\n"), {"qr_text": "name=Widget|category=Tools|quantity=2"})
+        self.assertEqual(scan_from_payload(b'{"qr_text": "2|#4|1", "scan_id": "s-1"}'), {"qr_text": "2|#4|1", "scan_id": "s-1"})
+        self.assertEqual(scan_from_payload(b"{not json"), {"qr_text": "{not json"})
+
+
+class ResponseCacheTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_superuser("cache-admin", password="unused"))
+        with self.captureOnCommitCallbacks(execute=True):
+            Truck.objects.create(license_plate="QC-1", capacity=10)
+
+    def test_unchanged_data_is_a_304_and_a_write_changes_the_etag(self):
+        first = self.client.get("/api/trucks/")
+        self.assertEqual(first.status_code, 200)
+        etag = first["ETag"]
+
+        self.assertEqual(self.client.get("/api/trucks/", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Truck.objects.filter(license_plate="QC-1").update(capacity=20)
+        changed = self.client.get("/api/trucks/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], etag)
+        self.assertEqual(changed.json()["results"][0]["capacity"], 20)
+
+    def test_writes_in_one_transaction_bump_each_model_once_without_expiry(self):
+        key = response_cache._version_key(Truck)
+        before = response_cache.current_versions([Truck])
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                Truck.objects.update(capacity=20)
+                Truck.objects.update(capacity=30)
+                Truck.objects.create(license_plate="QC-2", capacity=10)
+
+        self.assertEqual(len([func for func in callbacks if getattr(func, "key", None) == key]), 1)
+        self.assertNotEqual(response_cache.current_versions([Truck]), before)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT expires FROM response_cache WHERE cache_key LIKE %s", [f"%{key}"])
+            (expires,), = cursor.fetchall()
+        self.assertGreater(str(expires), "9999")
+
+    def test_a_bump_in_a_rolled_back_savepoint_does_not_hide_a_later_one(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            with transaction.atomic():
+                try:
+                    with transaction.atomic():
+                        Truck.objects.update(capacity=20)
+                        raise DataError("rolled back")
+                except DataError:
+                    pass
+                Truck.objects.update(capacity=30)
+
+        self.assertEqual(len(callbacks), 1)
+
+    @override_settings(CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "responses": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    })
+    def test_a_per_process_cache_turns_caching_off(self):
+        response = self.client.get("/api/trucks/")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("ETag", response)
+
+
+class AllocationTestCase(TestCase):
+    """Two trucks, one well-stocked product and helpers to place orders for it."""
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="Widget", category=Category.objects.create(name="Tools"), available_quantity=100
+        )
+        self.retailer = Retailer.objects.create(name="Corner Shop", address="-", contact="-", distance_from_warehouse=5)
+        self.employees = [
+            Employee.objects.create(
+                user=User.objects.create(username=f"driver-{i}"),
+                truck=Truck.objects.create(license_plate=f"QC-{i}", capacity=50),
+            )
+            for i in range(2)
+        ]
+
+    def order(self, quantity=1):
+        return Order.objects.create(retailer=self.retailer, product=self.product, required_qty=quantity)
+
+    def allocated_ids(self, payload):
+        return {entry["order_id"] for entry in payload["allocated_orders"]}
+
+
+class IncrementalCheckpointTests(AllocationTestCase):
+    def test_orders_locked_out_of_a_run_are_retried_by_the_next(self):
+        allocation.run_allocation(incremental=True)
+        locked, free = self.order(), self.order()
+
+        def lock_first(orders):
+            return [order for order in orders if order != locked], [
+                {"order_id": locked.order_id, "reason": allocation.LOCKED_REASON}
+            ]
+
+        with mock.patch("app.allocation.lock_order_products", lock_first):
+            first = allocation.run_allocation(incremental=True)
+        self.assertEqual(self.allocated_ids(first), {free.order_id})
+        self.assertEqual(AllocationCheckpoint.load().retry_order_ids, [locked.order_id])
+
+        Shipment.objects.update(status="delivered")
+        second = allocation.run_allocation(incremental=True)
+        self.assertEqual(self.allocated_ids(second), {locked.order_id})
+        self.assertEqual(AllocationCheckpoint.load().retry_order_ids, [])
+
+    def test_orders_skipped_by_the_locked_read_are_retried_by_the_next_run(self):
+        allocation.run_allocation(incremental=True)
+        held, free = self.order(), self.order()
+        load = allocation.load_pending_orders
+
+        def skip_held(*args, **kwargs):
+            # What select_for_update(skip_locked=True) does to a row another run holds
+            return [order for order in load(*args, **kwargs) if order != held]
+
+        with mock.patch("app.allocation.load_pending_orders", skip_held):
+            first = allocation.run_allocation(incremental=True)
+        self.assertEqual(self.allocated_ids(first), {free.order_id})
+        self.assertEqual(AllocationCheckpoint.load().last_order_id, free.order_id)
+
+        Shipment.objects.update(status="delivered")
+        self.assertEqual(self.allocated_ids(allocation.run_allocation(incremental=True)), {held.order_id})
+
+
+    def test_an_order_back_to_pending_is_planned_again(self):
+        order, newer = self.order(), self.order()
+        order.status = "cancelled"
+        order.save()
+        # Moves the high-water mark past the cancelled order
+        self.assertEqual(self.allocated_ids(allocation.run_allocation(incremental=True)), {newer.order_id})
+
+        order.status = "pending"
+        order.save()
+
+        self.assertEqual(self.allocated_ids(allocation.run_allocation(incremental=True)), {order.order_id})
+
+    def test_an_order_set_back_to_pending_in_bulk_is_planned_again(self):
+        order, newer = self.order(), self.order()
+        Order.objects.filter(pk=order.pk).set_status("cancelled")
+        self.assertEqual(self.allocated_ids(allocation.run_allocation(incremental=True)), {newer.order_id})
+
+        Order.objects.filter(pk=order.pk).set_status("pending")
+
+        self.assertEqual(self.allocated_ids(allocation.run_allocation(incremental=True)), {order.order_id})
+
+    def test_stock_restored_by_rebuild_counters_is_seen(self):
+        Product.objects.filter(pk=self.product.pk).update(available_quantity=0)
+        order = self.order(5)
+        first = allocation.run_allocation(incremental=True)
+        self.assertEqual(self.allocated_ids(first), set())
+
+        # The ledger still has the opening stock the update above bypassed
+        InventoryMovement.objects.record("opening", available={self.product.pk: 100})
+        self.assertEqual(rebuild_counters([self.product.pk]), [self.product.pk])
+
+        self.assertEqual(self.allocated_ids(allocation.run_allocation(incremental=True)), {order.order_id})
+
+
+    def test_backdated_imported_orders_are_planned_by_the_next_run(self):
+        newer = self.order()
+        self.assertEqual(self.allocated_ids(allocation.run_allocation(incremental=True)), {newer.order_id})
+
+        result = import_rows("orders", [json.dumps({
+            "retailer": self.retailer.pk, "product": self.product.pk, "required_qty": 2, "order_date": "2020-01-01T00:00:00Z",
+        })], "ndjson")
+        self.assertEqual(result.imported, 1)
+        imported = Order.objects.get(order_date__year=2020)
+
+        self.assertEqual(self.allocated_ids(allocation.run_allocation(incremental=True)), {imported.order_id})
+
+
+class CheckpointClaimTests(AllocationTestCase):
+    def test_a_chunked_run_holds_the_checkpoint_until_it_finishes(self):
+        order = self.order()
+        seen = []
+
+        def progress(done, total):
+            seen.append(AllocationCheckpoint.load().claimed_at)
+            # Neither kind of incremental run may start while a chunked one is between chunks
+            for chunk_size in (None, 1):
+                with self.assertRaisesMessage(allocation.AllocationError, "in progress"):
+                    allocation.run_allocation(incremental=True, chunk_size=chunk_size)
+
+        payload = allocation.run_allocation(incremental=True, chunk_size=1, progress=progress)
+
+        self.assertEqual(self.allocated_ids(payload), {order.order_id})
+        self.assertIsNotNone(seen[0])
+        self.assertIsNone(AllocationCheckpoint.load().claimed_at)
+
+    def test_a_failed_run_releases_its_claim(self):
+        with mock.patch("app.allocation.apply_plan", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                allocation.run_allocation(incremental=True, chunk_size=1)
+
+        self.assertIsNone(AllocationCheckpoint.load().claimed_at)
+
+    @override_settings(ALLOCATION_JOB_TIMEOUT=60)
+    def test_a_claim_left_by_a_dead_run_is_taken_over(self):
+        checkpoint = AllocationCheckpoint.load()
+        checkpoint.claimed_at = timezone.now() - timedelta(minutes=5)
+        checkpoint.save()
+        order = self.order()
+
+        self.assertEqual(self.allocated_ids(allocation.run_allocation(incremental=True, chunk_size=1)), {order.order_id})
+
+
+class AvailableEmployeesTests(AllocationTestCase):
+    def test_an_in_transit_shipment_without_a_truck_does_not_hide_every_truck(self):
+        busy, free = self.employees
+        Shipment.objects.create(order=self.order(), employee=busy, status="in_transit")
+        Shipment.objects.create(
+            order=self.order(), status="in_transit",
+            employee=Employee.objects.create(user=User.objects.create(username="walker")),
+        )
+
+        self.assertEqual(allocation.load_available_employees(), [free])
+
+
+class CategoryStockTests(APITestCase):
+    def test_each_category_reports_its_product_count(self):
+        tools = Category.objects.create(name="Tools")
+        Category.objects.create(name="Empty")
+        for name in ("Hammer", "Saw"):
+            Product.objects.create(name=name, category=tools, available_quantity=1)
+        self.client.force_authenticate(User.objects.create_superuser("stock-admin", password="unused"))
+
+        response = self.client.get("/api/category-stock/")
+
+        self.assertEqual(response.status_code, 200)
+        counts = {category["name"]: (category["product_count"], category["value"]) for category in response.json()["data"]}
+        self.assertEqual(counts, {"Tools": (2, 2), "Empty": (0, 0)})
+
+
+# Count what the views run, not response cache lookups
+@override_settings(CACHES={
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "responses": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+})
+class QueryCountTests(APITestCase):
+    """Every list endpoint runs the same number of queries whatever the page size, so a serializer N+1 fails here."""
+
+    # (endpoint, query string) for every list endpoint and each expansion it offers
+    ENDPOINTS = [
+        ("/api/employees/", ""),
+        ("/api/employees/", "expand=user,truck"),
+        ("/api/retailers/", ""),
+        ("/api/orders/", ""),
+        ("/api/orders/", "expand=retailer,product"),
+        ("/api/orders/", "fields=order_id,status"),
+        ("/api/orders/", "cursor="),
+        ("/api/trucks/", ""),
+        ("/api/shipments/", ""),
+        ("/api/shipments/", "expand=order,employee"),
+        ("/api/shipments/", "cursor="),
+        ("/api/stock/", ""),
+        ("/api/category-stock/", ""),
+    ]
+    ROWS = 30
+    PAGE_SIZES = [1, 10, 30]
+
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_superuser("query-count-admin", password="unused"))
+
+    def test_query_counts_do_not_grow_with_page_size_or_rows(self):
+        self.seed(offset=0)
+        expected = {endpoint: self.count(*endpoint, self.PAGE_SIZES[0]) for endpoint in self.ENDPOINTS}
+
+        for size in self.PAGE_SIZES[1:]:
+            for endpoint in self.ENDPOINTS:
+                with self.subTest(endpoint=endpoint, page_size=size), self.assertNumQueries(expected[endpoint]):
+                    self.get(*endpoint, size)
+
+        # Twice the rows also catches endpoints that return the whole table
+        self.seed(offset=self.ROWS)
+        for endpoint in self.ENDPOINTS:
+            with self.subTest(endpoint=endpoint, rows=2 * self.ROWS), self.assertNumQueries(expected[endpoint]):
+                self.get(*endpoint, self.PAGE_SIZES[-1])
+
+    def count(self, path, query, page_size):
+        with CaptureQueriesContext(connection) as captured:
+            self.get(path, query, page_size)
+        return len(captured)
+
+    def get(self, path, query, page_size):
+        response = self.client.get(f"{path}?page_size={page_size}" + (f"&{query}" if query else ""))
+        self.assertEqual(response.status_code, 200, path)
+        if response.streaming:
+            # Streamed responses only query as they are read
+            b"".join(response.streaming_content)
+
+    def seed(self, offset):
+        # Plain bulk inserts: the counters and signals do not matter for counting reads
+        names = range(offset, offset + self.ROWS)
+        categories = Category.objects.bulk_create([Category(name=f"category-{i}") for i in names])
+        products = Product.objects.bulk_create([
+            Product(name=f"product-{i}", category=category, available_quantity=100)
+            for i, category in zip(names, categories)
+        ])
+        retailers = Retailer.objects.bulk_create([
+            Retailer(name=f"retailer-{i}", address="-", contact="-", distance_from_warehouse=i) for i in names
+        ])
+        trucks = Truck.objects.bulk_create([Truck(license_plate=f"QC-{i}", capacity=100, is_available=False) for i in names])
+        users = User.objects.bulk_create([User(username=f"driver-{i}") for i in names])
+        employees = Employee.objects.bulk_create([Employee(user=user, truck=truck) for user, truck in zip(users, trucks)])
+        orders = Order.objects.bulk_create([
+            Order(retailer=retailer, product=product, required_qty=1) for retailer, product in zip(retailers, products)
+        ])
+        Shipment.objects.bulk_create([Shipment(order=order, employee=employee) for order, employee in zip(orders, employees)])
+
+
+class AllocationRunTests(AllocationTestCase):
+    def test_a_run_allocates_what_fits_and_keeps_counters_on_the_ledger(self):
+        small, large = self.order(30), self.order(60)
+
+        payload = allocation.run_allocation()
+
+        self.assertEqual(self.allocated_ids(payload), {small.order_id})
+        self.assertEqual(payload["skipped_orders"], [{"order_id": large.order_id, "reason": "No suitable truck available"}])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_quantity, 70)
+        ledger = current_stock(self.product.product_id)
+        for counter in ("available_quantity", "total_shipped", "total_required_quantity"):
+            self.assertEqual(ledger[counter], getattr(self.product, counter), counter)
+
+    def test_a_dry_run_writes_nothing(self):
+        order = self.order(10)
+
+        payload = allocation.run_allocation(dry_run=True)
+
+        self.assertEqual(self.allocated_ids(payload), {order.order_id})
+        order.refresh_from_db()
+        self.assertEqual(order.status, "pending")
+        self.assertFalse(Shipment.objects.exists())
+
+
+class RoutedAllocationTests(AllocationTestCase):
+    def test_stock_held_by_an_unrouted_order_goes_to_later_orders(self):
+        too_big, fits = self.order(60), self.order(50)  # Trucks carry 50; stock is 100
+
+        payload = allocation.run_allocation(strategy="route")
+
+        self.assertEqual(self.allocated_ids(payload), {fits.order_id})
+        self.assertEqual(payload["skipped_orders"], [{"order_id": too_big.order_id, "reason": "No suitable truck available"}])
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.available_quantity, self.product.total_required_quantity), (50, 110))
+
+    def test_orders_taken_between_chunks_leave_the_plan_totals(self):
+        far = Retailer.objects.create(name="Far Shop", address="-", contact="-", distance_from_warehouse=40)
+        for retailer, quantity in ((self.retailer, 10), (far, 20), (far, 15)):
+            Order.objects.create(retailer=retailer, product=self.product, required_qty=quantity)
+
+        def progress(done, total):
+            # Another run takes every order the first chunk did not write
+            Order.objects.filter(status="pending").update(status="cancelled")
+
+        payload = allocation.run_allocation(strategy="route", chunk_size=1, progress=progress)
+
+        (allocated,) = Order.objects.filter(status="allocated")
+        self.assertEqual(self.allocated_ids(payload), {allocated.order_id})
+        self.assertEqual(len(payload["skipped_orders"]), 2)
+        utilization = payload["truck_utilization"]
+        self.assertEqual(sum(truck["loaded"] for truck in utilization["trucks"]), allocated.required_qty)
+        self.assertEqual(utilization["total_distance"], 2 * allocated.retailer.distance_from_warehouse)
+        (route,) = payload["routes"]
+        self.assertEqual([stop["order_id"] for stop in route["stops"]], [allocated.order_id])
+        self.assertEqual((route["load"], route["distance"]), (allocated.required_qty, utilization["total_distance"]))
+
+
+class InventoryLedgerTests(AllocationTestCase):
+    COUNTERS = ("available_quantity", "total_shipped", "total_required_quantity")
+
+    def assert_ledger_matches_counters(self):
+        self.product.refresh_from_db()
+        self.assertEqual(
+            current_stock(self.product.product_id), {counter: getattr(self.product, counter) for counter in self.COUNTERS}
+        )
+
+    def test_every_write_path_appends_what_it_did_to_the_counters(self):
+        delivered, cancelled = self.order(10), self.order(5)
+        self.assert_ledger_matches_counters()
+
+        allocation.run_allocation()
+        self.assert_ledger_matches_counters()
+
+        shipment = delivered.shipment
+        elsewhere = Shipment.objects.get(pk=shipment.pk)
+        elsewhere.status = "delivered"
+        elsewhere.save()
+        # A stale copy that catches up and is saved again must not deliver twice
+        shipment.refresh_from_db()
+        shipment.save()
+        Order.objects.filter(pk=cancelled.pk).set_status("cancelled")
+        Product.objects.receive({self.product.product_id: 7}, "qr")
+        self.product.refresh_from_db()
+        self.product.available_quantity += 3
+        self.product.save()
+        self.assert_ledger_matches_counters()
+
+        kinds = set(InventoryMovement.objects.values_list("kind", flat=True))
+        self.assertEqual(kinds, {"receipt", "demand", "allocation", "delivery", "cancellation", "adjustment"})
+        self.assertEqual((self.product.available_quantity, self.product.total_shipped), (95, 10))
+
+    def test_stock_is_read_back_at_a_past_moment_across_a_snapshot(self):
+        self.order(10)
+        compact_snapshots(settle_seconds=0)
+        before = timezone.now()
+        Product.objects.receive({self.product.product_id: 7}, "qr")
+
+        self.assertEqual(StockSnapshot.objects.count(), 1)
+        self.assertEqual(stock_at(self.product.product_id, before)["available_quantity"], 100)
+        self.assertEqual(stock_at(self.product.product_id, before)["total_required_quantity"], 10)
+        self.assert_ledger_matches_counters()
+
+    def rows_read(self, function, *args):
+        """Snapshot rows loaded and ledger rows iterated while function runs."""
+        movements = []
+        iterate = QuerySet.iterator
+
+        def counting_iterator(queryset, *iterator_args, **kwargs):
+            for row in iterate(queryset, *iterator_args, **kwargs):
+                if queryset.model is InventoryMovement:
+                    movements.append(row)
+                yield row
+
+        with mock.patch.object(StockSnapshot, "from_db", side_effect=StockSnapshot.from_db) as loaded, \
+                mock.patch.object(QuerySet, "iterator", counting_iterator):
+            function(*args)
+        return loaded.call_count, len(movements)
+
+    def test_reads_stay_flat_as_snapshots_pile_up(self):
+        cold = Product.objects.create(name="Spare", category=self.product.category, available_quantity=5)
+        compact_snapshots(settle_seconds=0)
+        for _ in range(20):
+            Product.objects.receive({self.product.product_id: 1}, "qr")
+            compact_snapshots(settle_seconds=0)
+        Product.objects.receive({self.product.product_id: 1}, "qr")
+
+        # The latest snapshot of each product, and only the hot product's one new movement
+        self.assertEqual(self.rows_read(stock_at, self.product.product_id), (1, 0))
+        self.assertEqual(self.rows_read(rebuild_counters), (2, 1))
+        self.assertEqual(self.rows_read(compact_snapshots, 0), (2, 1))
+
+        self.assert_ledger_matches_counters()
+        self.assertEqual(current_stock(cold.product_id)["available_quantity"], 5)
+        self.assertEqual(StockSnapshot.objects.filter(product=cold).count(), 1)
+
+    def test_the_admin_cannot_write_the_ledger_or_its_snapshots(self):
+        self.client.force_login(User.objects.create_superuser("ledger-admin", password="unused"))
+        compact_snapshots(settle_seconds=0)
+        counts = (InventoryMovement.objects.count(), StockSnapshot.objects.count())
+
+        for model in (InventoryMovement, StockSnapshot):
+            url = f"/admin/app/{model._meta.model_name}/"
+            pk = model.objects.values_list("pk", flat=True).first()
+            with self.subTest(model=model.__name__):
+                self.assertEqual(self.client.get(url).status_code, 200)
+                self.assertEqual(self.client.post(f"{url}add/", {"product": self.product.pk}).status_code, 403)
+                self.assertEqual(self.client.post(f"{url}{pk}/change/", {"product": self.product.pk}).status_code, 403)
+                self.assertEqual(self.client.post(f"{url}{pk}/delete/", {"post": "yes"}).status_code, 403)
+        self.assertEqual((InventoryMovement.objects.count(), StockSnapshot.objects.count()), counts)
+
+    def test_rebuild_resets_counters_changed_behind_the_ledger(self):
+        Product.objects.filter(pk=self.product.pk).update(available_quantity=999)
+
+        self.assertEqual(rebuild_counters(), [self.product.product_id])
+        self.assert_ledger_matches_counters()
+        self.assertEqual(self.product.available_quantity, 100)
+        self.assertEqual(rebuild_counters(), [])
+
+
+@skipUnlessDBFeature("has_select_for_update_skip_locked")
+class ShardedAllocationTests(TransactionTestCase):
+    """Shards running at the same time split the orders between them without taking anything twice."""
+
+    def setUp(self):
+        category = Category.objects.create(name="Tools")
+        self.products = [
+            Product.objects.create(name=f"product-{i}", category=category, available_quantity=20) for i in range(4)
+        ]
+        retailers = [
+            Retailer.objects.create(name=f"retailer-{i}", address="-", contact="-", distance_from_warehouse=i)
+            for i in range(3)
+        ]
+        # Every retailer orders every product, so shards by retailer would compete for product rows
+        self.orders = [
+            Order.objects.create(retailer=retailer, product=product, required_qty=5)
+            for product in self.products for retailer in retailers
+        ]
+        for i in range(4):
+            Employee.objects.create(
+                user=User.objects.create(username=f"driver-{i}"),
+                truck=Truck.objects.create(license_plate=f"QC-{i}", capacity=100),
+            )
+
+    def run_shards(self, key):
+        together = threading.Barrier(2, timeout=10)
+        plan = allocation.plan_allocation
+        payloads, errors = {}, []
+
+        def plan_together(*args, **kwargs):
+            # Both shards hold their row locks before either one plans
+            together.wait()
+            return plan(*args, **kwargs)
+
+        def run(index):
+            try:
+                payloads[index] = allocation.run_allocation(shard={"key": key, "index": index, "count": 2})
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        with mock.patch("app.allocation.plan_allocation", plan_together):
+            threads = [threading.Thread(target=run, args=(index,)) for index in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(errors, [])
+        return payloads[0], payloads[1]
+
+    def assert_each_order_allocated_once(self, key):
+        first, second = self.run_shards(key)
+
+        first_ids, second_ids = (
+            {entry["order_id"] for entry in payload["allocated_orders"]} for payload in (first, second)
+        )
+        self.assertEqual(first_ids & second_ids, set())
+        self.assertEqual(first_ids | second_ids, {order.order_id for order in self.orders})
+        self.assertEqual(first["skipped_orders"] + second["skipped_orders"], [])
+        self.assertEqual(Shipment.objects.count(), len(self.orders))
+        self.assertEqual(set(Product.objects.values_list("available_quantity", flat=True)), {5})
+
+    def test_product_shards(self):
+        self.assert_each_order_allocated_once("product")
+
+    def test_category_shards(self):
+        Product.objects.filter(pk__in=[product.pk for product in self.products[::2]]).update(
+            category=Category.objects.create(name="Garden")
+        )
+        self.assert_each_order_allocated_once("category")
+
+
+class AllocationQueryCountTests(TestCase):
+    """A run costs the same number of queries however many orders and products it plans."""
+
+    STRATEGIES = ["first_fit", "best_fit_decreasing", "route"]
+    SIZES = [2, 10, 40]  # Products, with two orders each
+
+    def setUp(self):
+        for i in range(3):
+            Employee.objects.create(
+                user=User.objects.create(username=f"driver-{i}"),
+                truck=Truck.objects.create(license_plate=f"QC-{i}", capacity=200),
+            )
+
+    def test_query_count_does_not_grow_with_orders_or_products(self):
+        for strategy in self.STRATEGIES:
+            with self.subTest(strategy=strategy):
+                counts = [self.count(strategy, size) for size in self.SIZES]
+                self.assertEqual(len(set(counts)), 1, f"queries for {self.SIZES} products: {counts}")
+
+    def count(self, strategy, size):
+        # Every size starts from the same empty catalogue
+        with transaction.atomic():
+            self.seed(size)
+            with CaptureQueriesContext(connection) as captured:
+                payload = allocation.run_allocation(strategy=strategy)
+            self.assertTrue(payload["allocated_orders"])
+            self.assertTrue(payload["skipped_orders"])
+            transaction.set_rollback(True)
+        return len(captured)
+
+    def seed(self, size):
+        category = Category.objects.create(name="Tools")
+        for i in range(size):
+            product = Product.objects.create(name=f"product-{i}", category=category, available_quantity=10)
+            retailer = Retailer.objects.create(name=f"retailer-{i}", address="-", contact="-", distance_from_warehouse=i)
+            # The second order always runs out of stock
+            for quantity in (4, 8):
+                Order.objects.create(retailer=retailer, product=product, required_qty=quantity)
+
+
+class BatchedOrderUpdatesTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Tools")
+        self.products = [
+            Product.objects.create(name=f"product-{i}", category=category, available_quantity=100) for i in range(2)
+        ]
+        self.retailer = Retailer.objects.create(name="Corner Shop", address="-", contact="-", distance_from_warehouse=5)
+        for quantity in (2, 3, 4, 5):
+            for product in self.products:
+                Order.objects.create(retailer=self.retailer, product=product, required_qty=quantity)
+
+    def counters(self):
+        return (
+            list(Product.objects.order_by("product_id").values_list("total_required_quantity", flat=True)),
+            sorted(
+                InventoryMovement.objects.values("kind", "product_id")
+                .annotate(total=Sum("required_delta")).values_list("kind", "product_id", "total")
+            ),
+        )
+
+    def write_orders(self):
+        orders = list(Order.objects.order_by("order_id"))
+        orders[0].required_qty = 7
+        orders[0].save()
+        orders[1].status = "allocated"
+        orders[1].save()
+        orders[1].status = "delivered"
+        orders[1].save()
+        orders[2].status = "cancelled"
+        orders[2].save()
+        orders[3].status = "cancelled"
+        orders[3].save()
+        orders[3].status = "pending"
+        orders[3].save()
+        Order.objects.filter(pk__in=[orders[4].pk, orders[5].pk]).set_status("delivered")
+        Order.objects.create(retailer=self.retailer, product=self.products[0], required_qty=6)
+
+    def counters_after_writes(self, batched):
+        with transaction.atomic():
+            with batched_order_updates() if batched else nullcontext():
+                self.write_orders()
+            counters = self.counters()
+            transaction.set_rollback(True)
+        return counters
+
+    def test_batched_writes_give_the_counters_of_per_row_signals(self):
+        self.assertEqual(self.counters_after_writes(batched=True), self.counters_after_writes(batched=False))
+
+    def test_the_batch_is_applied_in_one_update_when_the_block_ends(self):
+        before = self.counters()[0]
+        with CaptureQueriesContext(connection) as captured:
+            with batched_order_updates():
+                self.write_orders()
+                self.assertEqual(self.counters()[0], before)
+
+        product_updates = [q["sql"] for q in captured if q["sql"].startswith('UPDATE "app_product"')]
+        self.assertEqual(len(product_updates), 1)
+        self.assertNotEqual(self.counters()[0], before)
+        self.assertIsNone(current_batch())
+
+    def test_nested_blocks_join_the_outer_batch(self):
+        with batched_order_updates() as outer:
+            with batched_order_updates() as inner:
+                self.assertIs(inner, outer)
+            self.assertIs(current_batch(), outer)
+
+    def test_an_error_rolls_back_the_orders_and_the_batch(self):
+        before = self.counters()
+        statuses = list(Order.objects.order_by("order_id").values_list("status", flat=True))
+
+        with self.assertRaises(RuntimeError):
+            with batched_order_updates():
+                self.write_orders()
+                raise RuntimeError
+
+        self.assertIsNone(current_batch())
+        self.assertEqual(self.counters(), before)
+        self.assertEqual(list(Order.objects.order_by("order_id").values_list("status", flat=True)), statuses)
+
+    def test_a_refreshed_order_is_measured_from_what_was_read(self):
+        order = Order.objects.filter(product=self.products[0]).first()
+        Order.objects.filter(pk=order.pk).set_status("cancelled")
+        order.refresh_from_db()
+        before = Product.objects.get(pk=self.products[0].pk).total_required_quantity
+
+        with batched_order_updates():
+            order.status = "delivered"
+            order.save()
+
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).total_required_quantity, before)
+
+
+class ImportTests(TestCase):
+    def ndjson(self, *rows):
+        return [row if isinstance(row, str) else json.dumps(row) for row in rows]
+
+    def test_rows_failing_the_model_field_checks_are_rejected_in_line_order(self):
+        shop = {"name": "Corner Shop", "address": "1 High St", "contact": "555-0100", "distance_from_warehouse": 3}
+        result = import_rows("retailers", self.ndjson(
+            {**shop, "name": {"first": "Corner"}},
+            {**shop, "contact": "5" * 21},
+            "not json",
+            {**shop, "name": "x" * 256},
+            {**shop, "contact": 5550100},
+            shop,
+        ), "ndjson")
+
+        self.assertEqual((result.imported, result.rejected), (2, 4))
+        self.assertEqual([error["line"] for error in result.errors], [1, 2, 3, 4])
+        self.assertEqual(result.errors[0]["error"], "name must be text")
+        self.assertIn("contact", result.errors[1]["error"])
+        self.assertIn("name", result.errors[3]["error"])
+        self.assertEqual(sorted(Retailer.objects.values_list("contact", flat=True)), ["555-0100", "5550100"])
+
+    def test_products_and_orders_keep_counters_on_the_ledger(self):
+        products = import_rows("products", [
+            "name,category,available_quantity\n", "Hammer,Tools,10\n", f"{'x' * 256},Tools,1\n", "Saw,Tools,-1\n",
+        ], "csv")
+        self.assertEqual((products.imported, [error["line"] for error in products.errors]), (1, [3, 4]))
+
+        hammer = Product.objects.get(name="Hammer")
+        retailer = Retailer.objects.create(name="Corner Shop", address="-", contact="-", distance_from_warehouse=1)
+        orders = import_rows("orders", self.ndjson(
+            {"retailer": retailer.retailer_id, "product": hammer.product_id, "required_qty": 4},
+            {"retailer": retailer.retailer_id, "product": hammer.product_id, "required_qty": 2, "status": ["pending"]},
+            {"retailer": retailer.retailer_id, "product": hammer.product_id + 1, "required_qty": 1},
+        ), "ndjson")
+        self.assertEqual((orders.imported, [error["line"] for error in orders.errors]), (1, [2, 3]))
+
+        hammer.refresh_from_db()
+        self.assertEqual((hammer.available_quantity, hammer.total_required_quantity), (10, 4))
+        ledger = current_stock(hammer.product_id)
+        self.assertEqual((ledger["available_quantity"], ledger["total_required_quantity"]), (10, 4))
+
+
+class ValuesSerializerTests(AllocationTestCase, APITestCase):
+    """The fast path must produce exactly the bytes of the serializer and DRF's JSONRenderer."""
+
+    NAMES = [
+        "Plain", 'Quote " and \\ backslash', "Line\u2028and\u2029paragraph", "Tab\tnew\nline\x01\x1f\x7f",
+        "Ünïcödé 漢字 \U0001F600", "<script>&amp;</script>", "",
+    ]
+
+    def setUp(self):
+        super().setUp()
+        for name in self.NAMES:
+            Product.objects.create(name=name, category=self.product.category, available_quantity=3)
+            self.order(2)
+
+    def assert_same_bytes(self, serializer, queryset):
+        expected = JSONRenderer().render(type(serializer)(queryset, many=True, fields=serializer.fields.keys()).data)
+        fast = ValuesSerializer.for_serializer(serializer)
+        self.assertEqual(fast.render(queryset), expected)
+        # However the rows are split into chunks
+        self.assertEqual(b"".join(fast.stream(queryset, chunk_size=2)), expected)
+
+    def test_products_render_like_the_serializer(self):
+        self.assert_same_bytes(ProductSerializer(), Product.objects.order_by("product_id"))
+        self.assert_same_bytes(ProductSerializer(fields=["name", "status"]), Product.objects.order_by("product_id"))
+
+    def test_datetimes_render_like_the_serializer(self):
+        self.assert_same_bytes(OrderSerializer(), Order.objects.order_by("order_id"))
+
+    def test_the_stock_endpoint_sends_the_serializer_bytes(self):
+        self.client.force_authenticate(User.objects.create_superuser("fast-admin", password="unused"))
+
+        response = self.client.get("/api/stock/")
+
+        expected = JSONRenderer().render(ProductSerializer(Product.objects.order_by("product_id"), many=True).data)
+        self.assertEqual(response.getvalue(), expected)
+
+    def test_expanded_relations_fall_back_to_the_serializer(self):
+        self.assertIsNone(ValuesSerializer.for_serializer(OrderSerializer(expand=["product"])))
+
+
+class ExportTests(AllocationTestCase, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.orders = [self.order(quantity) for quantity in (1, 2, 3)]
+        Order.objects.filter(pk=self.orders[0].pk).update(order_date=timezone.make_aware(timezone.datetime(2025, 1, 1, 12)))
+        Order.objects.filter(pk=self.orders[1].pk).update(order_date=timezone.make_aware(timezone.datetime(2025, 1, 2, 12)))
+        Order.objects.filter(pk=self.orders[2].pk).update(status="delivered")
+        self.client.force_authenticate(User.objects.create_superuser("export-admin", password="unused"))
+
+    def export(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+    def test_csv_starts_with_the_header_and_escapes_values(self):
+        Product.objects.create(name='Comma, "quote"\nand newline', category=self.product.category, available_quantity=1)
+
+        lines = list(csv.reader(io.StringIO(self.export("/api/stock/export/csv/?fields=product_id,name"))))
+
+        self.assertEqual(lines[0], ["product_id", "name"])
+        self.assertEqual(lines[1:], [[str(pk), name] for pk, name in Product.objects.order_by("product_id").values_list("pk", "name")])
+
+    def test_ndjson_rows_match_the_serializer(self):
+        rows = [json.loads(line) for line in self.export("/api/orders/export/ndjson/").splitlines()]
+
+        expected = json.loads(JSONRenderer().render(OrderSerializer(Order.objects.order_by("order_date", "order_id"), many=True).data))
+        self.assertEqual(rows, expected)
+
+    def test_status_and_date_range_filter_the_rows(self):
+        def exported_ids(query):
+            return [json.loads(line)["order_id"] for line in self.export(f"/api/orders/export/ndjson/?fields=order_id&{query}").splitlines()]
+
+        self.assertEqual(exported_ids("status=delivered"), [self.orders[2].order_id])
+        # ?to= with a bare date takes in the whole of that day
+        self.assertEqual(exported_ids("from=2025-01-01&to=2025-01-01"), [self.orders[0].order_id])
+        self.assertEqual(exported_ids("from=2025-01-01T13:00:00Z&to=2025-01-02"), [self.orders[1].order_id])
+
+    def test_bad_formats_and_dates_are_rejected(self):
+        self.assertEqual(self.client.get("/api/orders/export/xlsx/").status_code, 400)
+        self.assertEqual(self.client.get("/api/orders/export/csv/?from=yesterday").status_code, 400)
+
+    @override_settings(STREAM_CHUNK_SIZE=2)
+    def test_rows_are_read_through_an_iterator_and_written_in_chunks(self):
+        with mock.patch.object(QuerySet, "iterator", autospec=True, side_effect=QuerySet.iterator) as iterator:
+            response = self.client.get("/api/orders/export/ndjson/?fields=order_id")
+            chunks = list(response.streaming_content)
+
+        iterator.assert_called_once_with(mock.ANY, chunk_size=2)
+        self.assertEqual([chunk.count(b"\n") for chunk in chunks], [2, 1])
+
+
+class ImportViewTests(APITestCase):
+    def setUp(self):
+        self.client.force_authenticate(User.objects.create_superuser("import-admin", password="unused"))
+
+    def post(self, path, body, content_type="text/csv"):
+        return self.client.post(path, body, content_type=content_type)
+
+    def test_rows_are_imported_and_errors_reported_by_line(self):
+        response = self.post("/api/import/products/csv/", (
+            "name,category,available_quantity\n"
+            "Hammer,Tools,10\n"
+            "Saw,Tools,-1\n"
+            "Drill,Tools,4,extra\n"
+            "Chisel,Tools,2\n"
+        ))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data["rows"], response.data["imported"], response.data["rejected"]), (4, 2, 2))
+        self.assertEqual([error["line"] for error in response.data["errors"]], [3, 4])
+        self.assertEqual(sorted(Product.objects.values_list("name", flat=True)), ["Chisel", "Hammer"])
+
+    def test_ndjson_lines_are_numbered_from_one(self):
+        response = self.post("/api/import/retailers/ndjson/", "\n".join([
+            json.dumps({"name": "Corner Shop", "address": "-", "contact": "-", "distance_from_warehouse": 3}),
+            "{not json",
+        ]), content_type="application/x-ndjson")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["imported"], 1)
+        self.assertEqual([error["line"] for error in response.data["errors"]], [2])
+
+    def test_an_empty_body_is_a_bad_request(self):
+        response = self.post("/api/import/products/csv/", b"")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("body is empty", response.data["error"])
+
+    def test_unknown_kinds_and_formats_are_bad_requests(self):
+        for path in ("/api/import/trucks/csv/", "/api/import/products/xml/"):
+            with self.subTest(path=path):
+                self.assertEqual(self.post(path, "name\nx\n").status_code, 400)
+
+    def test_only_admins_can_import(self):
+        self.client.force_authenticate(User.objects.create_user("clerk", password="unused"))
+        self.assertEqual(self.post("/api/import/products/csv/", "name\nx\n").status_code, 403)
+
+
+class OrderPaginationTests(AllocationTestCase, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.orders = [self.order() for _ in range(5)]
+        self.client.force_authenticate(User.objects.create_superuser("orders-admin", password="unused"))
+
+    def test_page_numbers_are_the_default(self):
+        response = self.client.get("/api/orders/?page_size=2&page=3")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 5)
+        self.assertEqual([order["order_id"] for order in response.data["results"]], [self.orders[0].order_id])
+
+    def test_an_empty_cursor_opts_into_keyset_pages(self):
+        seen = []
+        url = "/api/orders/?page_size=2&cursor="
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn("count", response.data)
+            seen.extend(order["order_id"] for order in response.data["results"])
+            url = response.data["next"]
+
+        self.assertEqual(seen, [order.order_id for order in reversed(self.orders)])
+
+
+class HotQueryIndexTests(TestCase):
+    """The indexes added for the hot filters (migration 0026) exist and the queries they serve use them."""
+
+    INDEXES = {
+        "allocator: pending orders": (Order, "order_pending_date_idx"),
+        "QR ingestion: product by (name, category)": (Product, "product_name_category_idx"),
+        "delivery signal: truck still in transit": (Shipment, "shipment_in_transit_idx"),
+        "employee signal: first available truck": (Truck, "truck_available_idx"),
+    }
+    # Partial indexes on the same condition, which the planner may also pick for a query on a small table
+    ALTERNATIVES = {"order_pending_date_idx": ["order_pending_updated_idx"]}
+
+    def test_the_migrations_create_the_indexes(self):
+        with connection.cursor() as cursor:
+            for model, name in self.INDEXES.values():
+                constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+                self.assertIn(name, constraints)
+                self.assertTrue(constraints[name]["index"])
+
+    def test_the_models_need_no_new_migration(self):
+        call_command("makemigrations", "app", check=True, dry_run=True, stdout=io.StringIO())
+
+    def test_the_hot_queries_use_their_indexes(self):
+        postgres = connection.vendor == "postgresql"
+        if postgres:
+            # On a near-empty table a sequential scan is cheaper; ask whether the index can serve the query at all
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        queries = dict(hot_queries())
+
+        for label, (_, name) in self.INDEXES.items():
+            with self.subTest(label):
+                plan = queries[label].explain()
+                self.assertEqual(SEQ_SCAN[connection.vendor].findall(plan), [])
+                # SQLite may pick another index that also avoids the scan; production runs PostgreSQL
+                if postgres:
+                    self.assertTrue(
+                        any(index in plan for index in [name, *self.ALTERNATIVES.get(name, [])]), plan
+                    )
+
+    def test_the_command_reports_every_hot_query(self):
+        out = io.StringIO()
+
+        call_command("explain_hot_queries", stdout=out)
+
+        for label, _ in hot_queries():
+            self.assertIn(label, out.getvalue())
+
+
+class AllocationJobTests(TestCase):
+    def test_a_completed_job_keeps_the_totals_its_progress_recorded(self):
+        job = AllocationJob.objects.create(status="running", started_at=timezone.now())
+
+        def fake_run(progress, **options):
+            progress(3, 3)
+            return {"allocated_orders": [{"order_id": 1}, {"order_id": 2}], "skipped_orders": [{"order_id": 3}]}
+
+        with mock.patch("app.jobs.run_allocation", fake_run):
+            job = execute_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, "completed")
+        self.assertEqual((job.total_orders, job.processed_orders), (3, 3))
+        self.assertEqual((job.allocated_count, job.skipped_count), (2, 1))
+
+    @override_settings(ALLOCATION_JOB_TIMEOUT=60)
+    def test_jobs_running_past_the_timeout_are_failed(self):
+        stale = AllocationJob.objects.create(status="running", started_at=timezone.now() - timedelta(minutes=5))
+        live = AllocationJob.objects.create(status="running", started_at=timezone.now())
+
+        self.assertEqual(recover_stale_jobs(), 1)
+
+        stale.refresh_from_db()
+        live.refresh_from_db()
+        self.assertEqual((stale.status, live.status), ("failed", "running"))
+        self.assertIsNotNone(stale.finished_at)
+
+
+class BestFitIndexTests(SimpleTestCase):
+    def test_places_like_a_scan_for_the_tightest_truck(self):
+        rng = random.Random(7)
+        for _ in range(200):
+            capacities = [rng.randint(0, 60) for _ in range(rng.randint(0, 12))]
+            employees = [SimpleNamespace(truck=SimpleNamespace(capacity=capacity)) for capacity in capacities]
+            index = allocation.BestFitIndex(employees)
+            for _ in range(40):
+                quantity = rng.randint(0, 70)
+                fits = [(left, position) for position, left in enumerate(capacities) if left >= quantity]
+                expected = min(fits, default=None)
+                placed = index.place(quantity)
+                if expected is None:
+                    self.assertIsNone(placed)
+                else:
+                    self.assertIs(placed, employees[expected[1]])
+                    capacities[expected[1]] -= quantity
+
+
+class LRUCacheTests(SimpleTestCase):
+    def test_discard_drops_every_key_of_a_value_and_nothing_else(self):
+        cache = LRUCache(maxsize=3)
+        cache.set_many({"a": 1, "b": 1, "c": 2})
+        cache.set_many({"b": 3})  # Overwritten: no longer points at 1
+        cache.get_many(["a"])
+        cache.set_many({"d": 1})  # Evicts c, the least recently used
+
+        cache.discard("x", 1)
+
+        self.assertEqual(cache.get_many(["a", "b", "c", "d"]), {"b": 3})
+        self.assertEqual(cache._keys, {3: {"b"}})
+
+
+# Commits for real: foreign keys pointing at deleted rows only fail at COMMIT
+@override_settings(QR_DRAIN_IN_PROCESS=False)
+@override_settings(QR_DRAIN_IN_PROCESS=False)
+class DrainScansTests(TestCase):
+    def setUp(self):
+        lookup_cache.clear()
+
+    def test_scans_are_booked_with_one_increment_per_product(self):
+        enqueue_scans([
+            {"qr_text": text} for text in ("name=Widget|category=Tools|quantity=2", "2|Widget|Tools|3", "name=Gadget|category=Tools|quantity=1")
+        ])
+
+        result = drain_scans()
+
+        self.assertEqual((result.processed, result.failed, result.created_products), (3, 0, 2))
+        self.assertEqual(dict(Product.objects.values_list("name", "available_quantity")), {"Widget": 5, "Gadget": 1})
+        self.assertFalse(QRScan.objects.filter(processed=False).exists())
+        self.assertFalse(QRScan.objects.filter(processed_at=None).exists())
+        self.assertEqual(set(QRScan.objects.values_list("error", flat=True)), {""})
+
+    def test_scans_that_cannot_be_booked_keep_their_error(self):
+        QRScan.objects.create(data="name=Widget|category=Tools")
+        unknown = QRScan.objects.create(data="2|#999|4")
+        enqueue_scans([{"qr_text": "name=Widget|category=Tools|quantity=2"}])
+
+        result = drain_scans()
+
+        self.assertEqual((result.processed, result.failed), (1, 2))
+        self.assertEqual(
+            list(QRScan.objects.order_by("id").values_list("processed", "error")),
+            [(True, "Invalid QR Code data"), (True, "Unknown product"), (True, "")],
+        )
+        self.assertIsNotNone(QRScan.objects.get(pk=unknown.pk).processed_at)
+        self.assertEqual(Product.objects.get(name="Widget").available_quantity, 2)
+
+    def test_a_batch_claims_the_oldest_scans_first(self):
+        enqueue_scans([{"qr_text": f"name=Widget|category=Tools|quantity={quantity}"} for quantity in (1, 2, 3)])
+
+        self.assertEqual(drain_scans(batch_size=2).processed, 2)
+
+        self.assertEqual(Product.objects.get(name="Widget").available_quantity, 3)
+        self.assertEqual(list(QRScan.objects.filter(processed=False).values_list("data", flat=True)), ["name=Widget|category=Tools|quantity=3"])
+
+    def test_the_command_drains_until_the_queue_is_empty(self):
+        enqueue_scans([{"qr_text": f"name=Widget|category=Tools|quantity={quantity}"} for quantity in (1, 2, 3)])
+        out = io.StringIO()
+
+        call_command("drain_qr_scans", "--once", "--batch-size", "2", stdout=out)
+
+        self.assertIn("Booked 2 scans", out.getvalue())
+        self.assertIn("Booked 1 scans", out.getvalue())
+        self.assertEqual(Product.objects.get(name="Widget").available_quantity, 6)
+        self.assertEqual(backlog_stats()["pending"], 0)
+
+
+@skipUnlessDBFeature("has_select_for_update_skip_locked")
+@override_settings(QR_DRAIN_IN_PROCESS=False)
+class ConcurrentDrainTests(TransactionTestCase):
+    def test_a_drainer_skips_scans_another_one_has_claimed(self):
+        enqueue_scans([{"qr_text": f"name=Widget|category=Tools|quantity={quantity}"} for quantity in (1, 2, 3)])
+        first = QRScan.objects.order_by("id").first()
+        claimed, release = threading.Event(), threading.Event()
+
+        def hold_first_scan():
+            try:
+                with transaction.atomic():
+                    list(QRScan.objects.select_for_update().filter(pk=first.pk))
+                    claimed.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        holder = threading.Thread(target=hold_first_scan)
+        holder.start()
+        try:
+            self.assertTrue(claimed.wait(10))
+            result = drain_scans()
+        finally:
+            release.set()
+            holder.join()
+
+        self.assertEqual(result.processed, 2)
+        self.assertEqual(list(QRScan.objects.filter(processed=False).values_list("pk", flat=True)), [first.pk])
+        self.assertEqual(drain_scans().processed, 1)
+        self.assertEqual(Product.objects.get(name="Widget").available_quantity, 6)
+
+
+@override_settings(QR_DRAIN_IN_PROCESS=False)
+class DrainLookupCacheTests(TransactionTestCase):
+    LABEL = "name=Widget|category=Tools|quantity=2"
+
+    def setUp(self):
+        lookup_cache.clear()
+        self.drain("first")
+        self.product = Product.objects.get(name="Widget")
+
+    def drain(self, scan_id):
+        enqueue_scans([{"qr_text": self.LABEL, "scan_id": scan_id}])
+        return drain_scans()
+
+    def assert_booked_into_a_new_product(self, old_product_id):
+        result = self.drain("second")
+
+        self.assertEqual((result.processed, result.failed, result.created_products), (1, 0, 1))
+        product = Product.objects.get(name="Widget")
+        self.assertNotEqual(product.product_id, old_product_id)
+        self.assertEqual(product.available_quantity, 2)
+        self.assertFalse(QRScan.objects.filter(processed=False).exists())
+
+    def test_a_product_deleted_by_another_process_is_booked_anew(self):
+        product_id = self.product.product_id
+        # Another process's delete never reaches this process's cache
+        with mock.patch.object(lookup_cache.product_ids, "discard"):
+            self.product.delete()
+
+        self.assert_booked_into_a_new_product(product_id)
+
+    def test_a_category_deleted_by_another_process_is_booked_anew(self):
+        product_id = self.product.product_id
+        with mock.patch.object(lookup_cache.product_ids, "discard"), \
+                mock.patch.object(lookup_cache.category_ids, "discard"):
+            self.product.category.delete()
+
+        self.assert_booked_into_a_new_product(product_id)
+        self.assertTrue(Category.objects.filter(name="Tools").exists())
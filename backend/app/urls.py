@@ -3,7 +3,8 @@ from rest_framework_simplejwt.views import TokenRefreshView, TokenObtainPairView
 from rest_framework.urlpatterns import format_suffix_patterns  # ✅ For better API format handling
 from .views import (
     logout_view, get_employees, get_retailers,
-    get_orders, allocate_orders, get_trucks, get_shipments,get_stock_data,category_stock_data,store_qr_code
+    get_orders, allocate_orders, get_trucks, get_shipments,get_stock_data,category_stock_data,store_qr_code,store_qr_batch,
+    get_allocation_job, export_orders, export_shipments, export_stock, import_data
 )
 
 urlpatterns = [
@@ -17,11 +18,17 @@ urlpatterns = [
     path("retailers/", get_retailers, name="get_retailers"),  # Admin Only
     path("orders/", get_orders, name="get_orders"),  # Admin & Employees
     path("allocate-orders/", allocate_orders, name="allocate_orders"),  # Employees Only
+    path("allocation-jobs/<int:job_id>/", get_allocation_job, name="get_allocation_job"),  # Poll async allocation runs
     path("trucks/", get_trucks, name="get_trucks"),  # Admin Only
     path("shipments/", get_shipments, name="get_shipments"),  # Admin & Employees.
+    path("orders/export/<str:fmt>/", export_orders, name="export_orders"),  # ✅ Streamed ndjson or csv
+    path("shipments/export/<str:fmt>/", export_shipments, name="export_shipments"),
+    path("stock/export/<str:fmt>/", export_stock, name="export_stock"),  # Admin Only
+    path("import/<str:kind>/<str:fmt>/", import_data, name="import_data"),  # ✅ Bulk csv/ndjson upload, Admin Only
     path('stock/', get_stock_data, name='stock-data'),
     path('category-stock/', category_stock_data, name='category-stock-data'),
     path('store_qr/', store_qr_code, name='store_qr'),
+    path('store_qr/batch/', store_qr_batch, name='store_qr_batch'),  # ✅ Many scans per request
 ]
 
 # ✅ Support API requests with format suffixes (e.g., /orders.json, /orders.xml)
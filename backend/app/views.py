@@ -1,5 +1,4 @@
 import json
-from django.db import transaction
 from django.shortcuts import render
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
@@ -9,14 +8,20 @@ from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework import status
 from rest_framework.pagination import PageNumberPagination
 from django.db.models import Count
-from .models import Employee, Retailer, Order, Truck, Shipment, Product, Category
+from .models import Employee, Retailer, Order, Truck, Shipment, Product, Category, AllocationJob
 from .serializers import (
     EmployeeSerializer, RetailerSerializer, 
-    OrderSerializer, ProductSerializer, TruckSerializer, ShipmentSerializer, CategorySerializer
+    OrderSerializer, ProductSerializer, TruckSerializer, ShipmentSerializer, CategoryStockSerializer,
+    AllocationJobSerializer
 )
-from .allocation import allocate_shipments
+from .allocation import AllocationError, allocate_shipments, allocation_options, request_flag
+from .exports import InvalidExport, export_response, filter_export
+from .imports import InvalidImport, import_rows
+from .fast_json import ValuesSerializer, wants_plain_json
+from .jobs import enqueue_allocation
+from .pagination import InvalidCursor, KeysetPagination
+from .response_cache import cached_response
 from .permissions import IsAdminUser
-from django.db.models import F
 
 from django.shortcuts import redirect
 
@@ -65,10 +70,12 @@ def logout_view(request):
 @permission_classes([IsAuthenticated, IsAdminUser])
 def get_employees(request):
     try:
-        employees = Employee.objects.all()
+        # ✅ ?fields=... trims the response, ?expand=user,truck nests them; joins are applied up front
+        options = EmployeeSerializer.request_options(request)
+        employees = EmployeeSerializer.optimize(Employee.objects.all().order_by("employee_id"), **options)
         paginator = StandardPagination()
         paginated_employees = paginator.paginate_queryset(employees, request)
-        serializer = EmployeeSerializer(paginated_employees, many=True)
+        serializer = EmployeeSerializer(paginated_employees, many=True, **options)
         return paginator.get_paginated_response(serializer.data)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -76,12 +83,14 @@ def get_employees(request):
 # ✅ Get Retailers (Admin Only)
 @api_view(["GET"])
 @permission_classes([IsAuthenticated, IsAdminUser])
+@cached_response(Retailer)  # ✅ Served from cache / 304 until a retailer changes
 def get_retailers(request):
     try:
-        retailers = Retailer.objects.all()
+        options = RetailerSerializer.request_options(request)
+        retailers = Retailer.objects.all().order_by("retailer_id")
         paginator = StandardPagination()
         paginated_retailers = paginator.paginate_queryset(retailers, request)
-        serializer = RetailerSerializer(paginated_retailers, many=True)
+        serializer = RetailerSerializer(paginated_retailers, many=True, **options)
         return paginator.get_paginated_response(serializer.data)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -92,27 +101,34 @@ def get_retailers(request):
 def get_orders(request):
     try:
         status_filter = request.GET.get("status")
-        orders = Order.objects.all().order_by("-order_date")
+        # ✅ ?fields=... trims the response, ?expand=retailer,product nests them; joins are applied up front
+        options = OrderSerializer.request_options(request)
+        orders = OrderSerializer.optimize(Order.objects.all().order_by("-order_date", "-order_id"), **options)
 
         if status_filter:
             orders = orders.filter(status=status_filter)
 
-        paginator = StandardPagination()
+        # ✅ Page numbers by default; ?cursor= (empty for the first page) opts into keyset pagination
+        paginator = KeysetPagination("order_date", "order_id") if "cursor" in request.GET else StandardPagination()
         paginated_orders = paginator.paginate_queryset(orders, request)
-        serializer = OrderSerializer(paginated_orders, many=True)
+        serializer = OrderSerializer(paginated_orders, many=True, **options)
         return paginator.get_paginated_response(serializer.data)
+    except InvalidCursor as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 # ✅ Get Trucks (Admin Only)
 @api_view(["GET"])
 @permission_classes([IsAuthenticated, IsAdminUser])
+@cached_response(Truck)
 def get_trucks(request):
     try:
-        trucks = Truck.objects.all()
+        options = TruckSerializer.request_options(request)
+        trucks = Truck.objects.all().order_by("truck_id")
         paginator = StandardPagination()
         paginated_trucks = paginator.paginate_queryset(trucks, request)
-        serializer = TruckSerializer(paginated_trucks, many=True)
+        serializer = TruckSerializer(paginated_trucks, many=True, **options)
         return paginator.get_paginated_response(serializer.data)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -122,11 +138,77 @@ def get_trucks(request):
 @permission_classes([IsAuthenticated])
 def get_shipments(request):
     try:
-        shipments = Shipment.objects.all().order_by("-created_at")
-        paginator = StandardPagination()
+        # ✅ ?fields=... trims the response, ?expand=order,employee nests them; joins are applied up front
+        options = ShipmentSerializer.request_options(request)
+        shipments = ShipmentSerializer.optimize(
+            Shipment.objects.all().order_by("-shipment_date", "-shipment_id"), **options
+        )
+        # ✅ Page numbers by default; ?cursor= (empty for the first page) opts into keyset pagination
+        paginator = KeysetPagination("shipment_date", "shipment_id") if "cursor" in request.GET else StandardPagination()
         paginated_shipments = paginator.paginate_queryset(shipments, request)
-        serializer = ShipmentSerializer(paginated_shipments, many=True)
+        serializer = ShipmentSerializer(paginated_shipments, many=True, **options)
         return paginator.get_paginated_response(serializer.data)
+    except InvalidCursor as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+# ✅ Export Orders as NDJSON or CSV (Anyone Logged In)
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def export_orders(request, fmt):
+    try:
+        # ✅ ?status=, ?from= and ?to= filter on order_date; ?fields= picks the columns
+        orders = filter_export(Order.objects.order_by("order_date", "order_id"), request, "order_date")
+        serializer = OrderSerializer(fields=OrderSerializer.request_options(request)["fields"])
+        return export_response(serializer, orders, fmt, "orders")
+    except InvalidExport as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+# ✅ Export Shipments as NDJSON or CSV (Anyone Logged In)
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def export_shipments(request, fmt):
+    try:
+        shipments = filter_export(
+            Shipment.objects.order_by("shipment_date", "shipment_id"), request, "shipment_date"
+        )
+        serializer = ShipmentSerializer(fields=ShipmentSerializer.request_options(request)["fields"])
+        return export_response(serializer, shipments, fmt, "shipments")
+    except InvalidExport as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+# ✅ Export Stock as NDJSON or CSV (Admin Only)
+@api_view(["GET"])
+@permission_classes([IsAuthenticated, IsAdminUser])
+def export_stock(request, fmt):
+    try:
+        # ✅ The date range applies to stock_updated_at
+        products = filter_export(Product.objects.order_by("product_id"), request, "stock_updated_at")
+        serializer = ProductSerializer(fields=ProductSerializer.request_options(request)["fields"])
+        return export_response(serializer, products, fmt, "stock")
+    except InvalidExport as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+# ✅ Bulk Import of Retailers, Products or Orders as CSV or NDJSON (Admin Only)
+@api_view(["POST"])
+@permission_classes([IsAuthenticated, IsAdminUser])
+def import_data(request, kind, fmt):
+    try:
+        # ✅ DRF gives no stream for an empty body, or one sent without Content-Length
+        if request.stream is None:
+            raise InvalidImport("Request body is empty (send the rows with a Content-Length header)")
+        # ✅ The raw body is read line by line, never parsed into memory as a whole
+        result = import_rows(kind, request.stream, fmt)
+        return Response(result.as_dict(), status=status.HTTP_200_OK)
+    except InvalidImport as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -134,33 +216,55 @@ def get_shipments(request):
 @permission_classes([IsAuthenticated])  
 def allocate_orders(request):
     try:
-        with transaction.atomic():
-            allocation_result = allocate_shipments(request)
-
-            if isinstance(allocation_result, Response):
-                return allocation_result
-
-            # ✅ Ensure all product statuses are updated
-            products = Product.objects.all()
-            for product in products:
-                product.save()  # This will call update_status() before saving
+        # ✅ Large runs can be queued and polled instead of holding the request open
+        if request_flag(request, "async"):
+            job = enqueue_allocation(allocation_options(request), request.user)
+            return Response(
+                {
+                    "job_id": job.job_id,
+                    "status": job.status,
+                    "status_url": f"/api/allocation-jobs/{job.job_id}/",
+                },
+                status=status.HTTP_202_ACCEPTED,
+            )
 
-        return Response(
-            {"message": "Orders allocated and stock status updated successfully"},
-            status=status.HTTP_200_OK,
-        )
+        # ✅ allocate_shipments refreshes the status of every product it touched
+        return allocate_shipments(request)
+    except AllocationError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+# ✅ Allocation Job Status (Anyone Logged In)
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def get_allocation_job(request, job_id):
+    try:
+        job = AllocationJob.objects.get(job_id=job_id)
+    except AllocationJob.DoesNotExist:
+        return Response({"error": "Allocation job not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    serializer = AllocationJobSerializer(job)
+    return Response(serializer.data)
+
 # ✅ Get Stock Data (Admin Only)
 @api_view(["GET"])
 @permission_classes([IsAuthenticated, IsAdminUser])
+@cached_response(Product, Category)
 def get_stock_data(request):
     if not request.user.is_staff:
         return Response({"detail": "Access denied. Admins only."}, status=status.HTTP_403_FORBIDDEN)
 
-    products = Product.objects.all()
-    serializer = ProductSerializer(products, many=True)
+    # ✅ Category names come from the same query instead of one lookup per product
+    options = ProductSerializer.request_options(request)
+    products = ProductSerializer.optimize(Product.objects.all().order_by("product_id"), **options)
+
+    # ✅ Whole catalogue: streamed from value rows, same bytes as the serializer; the browsable API still uses it
+    fast = ValuesSerializer.for_serializer(ProductSerializer(**options))
+    if fast is not None and wants_plain_json(request):
+        return fast.streaming_response(products)
+
+    serializer = ProductSerializer(products, many=True, **options)
     return Response(serializer.data)
 
 # ✅ MQTT Client View
@@ -169,6 +273,7 @@ def mqtt_client_view(request):
 
 # ✅ Get Category Stock Data (Accessible by Anyone)
 @api_view(["GET"])
+@cached_response(Category, Product)
 def category_stock_data(request):
     """
     Returns category names and product count for visualization.
@@ -177,91 +282,75 @@ def category_stock_data(request):
         categories = Category.objects.annotate(product_count=Count('products'))  # ✅ Count products per category
 
         # Serialize the data
-        serialized_data = CategorySerializer(categories, many=True).data
+        serialized_data = CategoryStockSerializer(categories, many=True).data
 
-        # Attach product_count to each category in serialized data
+        # Attach product_count to each category in serialized data (already annotated, no query per category)
         for category in serialized_data:
-            category["value"] = next(
-                (cat["product_count"] for cat in categories.values("name", "product_count") if cat["name"] == category["name"]),
-                0
-            )
+            category["value"] = category["product_count"]
 
         return Response({"success": True, "data": serialized_data})
     except Exception as e:
         return Response({"error": str(e)}, status=500)
 
 import logging
+from django.conf import settings
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
-from .models import Category, Product
+from .ingestion import enqueue_scans, validate_scan
+from .qr_payload import InvalidScan
 
 logger = logging.getLogger(__name__)
 
-from django.db.models import F
-
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def store_qr_code(request):
-    """API to process and store QR code data into the Product model"""
+    """API to queue QR code data for booking into the Product model (see app.ingestion.drain_scans)"""
     try:
-        qr_data = request.data.get("qr_text", "").strip()  # Get and clean QR text
-        logger.info(f"Received QR data: {qr_data}")
+        scan = {"qr_text": request.data.get("qr_text"), "scan_id": request.data.get("scan_id")}
+        # ✅ Identical labels are separate items; repeats of a payload are only dropped if the client asks
+        dedup_window = settings.QR_DEDUP_WINDOW_SECONDS if request.data.get("dedup") is True else 0
+        logger.debug(f"Received QR data: {scan['qr_text']}")
 
-        if not qr_data:
-            return Response({"error": "QR Code data is empty"}, status=400)
-
-        # Safe parsing
         try:
-            data_dict = {}
-            for item in qr_data.split("|"):
-                if "=" in item:
-                    key, value = item.split("=", 1)  # Ensure only one split
-                    data_dict[key] = value
-        except ValueError as e:
-            logger.error(f"Error parsing QR code data: {e}")
-            return Response({"error": "Invalid QR Code data format"}, status=400)
-
-        logger.info(f"Parsed QR data: {data_dict}")
-
-        product_name = data_dict.get("name", "").strip()
-        category_name = data_dict.get("category", "").strip()
-        quantity_str = data_dict.get("quantity", "0").strip()
-
-        # Validate quantity
-        if not quantity_str.isdigit():
-            logger.error("Quantity must be a positive integer.")
-            return Response({"error": "Quantity must be a positive integer"}, status=400)
-
-        quantity = int(quantity_str)
-
-        # Validate data
-        if not product_name or not category_name or quantity <= 0:
-            logger.error(f"Invalid QR Code data: product_name={product_name}, category_name={category_name}, quantity={quantity}")
-            return Response({"error": "Invalid QR Code data"}, status=400)
-
-        # Fetch or create the category
-        category, _ = Category.objects.get_or_create(name=category_name)
-        logger.info(f"Category: {category.name}")
-
-        # 🔍 Fix: Use filter() instead of get() to handle multiple products
-        existing_products = Product.objects.filter(name=product_name, category=category)
-
-        if existing_products.exists():
-            product = existing_products.first()  # Pick the first one to update
-            product.available_quantity = F('available_quantity') + quantity
-            product.save()
-            logger.info(f"Updated product {product_name} with quantity {quantity}. New available quantity: {product.available_quantity}")
-        else:
-            product = Product.objects.create(
-                name=product_name,
-                category=category,
-                available_quantity=quantity
-            )
-            logger.info(f"Created new product {product_name} with quantity {quantity}.")
+            validate_scan(scan)
+        except InvalidScan as e:
+            logger.error(f"Invalid QR Code data {scan['qr_text']!r}: {e}")
+            return Response({"error": str(e)}, status=400)
 
-        return Response({"success": "QR Code data stored successfully"}, status=200)
+        # ✅ A repeat of the same scan_id (or, with "dedup": true, of the same payload inside the window) is not counted twice
+        result = enqueue_scans([scan], dedup_window)
+        return Response({"success": "QR Code data stored successfully", "duplicate": bool(result.duplicates)}, status=200)
 
     except Exception as e:
         logger.error(f"Error processing QR code data: {str(e)}")
         return Response({"error": str(e)}, status=500)
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def store_qr_batch(request):
+    """
+    API to queue many QR scans at once.
+
+    Body: {"scans": [...]}, each item either the QR text or {"qr_text": ..., "scan_id": ...}.
+    Invalid scans are reported per index and do not fail the rest of the batch.
+    Scans without a scan_id are dropped if the same payload arrived within
+    QR_DEDUP_WINDOW_SECONDS, so clients counting identical labels must send
+    scan_ids. Accepted scans are booked into stock by the QRScan drainer.
+    """
+    try:
+        scans = request.data.get("scans")
+        if not isinstance(scans, list):
+            return Response({"error": "scans must be a list"}, status=400)
+        if len(scans) > settings.QR_BATCH_MAX:
+            return Response({"error": f"At most {settings.QR_BATCH_MAX} scans per batch"}, status=400)
+
+        # ✅ Bare strings are QR texts; anything else malformed is rejected by index in enqueue_scans
+        scans = [{"qr_text": scan} if isinstance(scan, str) else scan for scan in scans]
+        result = enqueue_scans(scans, settings.QR_DEDUP_WINDOW_SECONDS)
+        return Response({"success": True, **result.as_dict()}, status=202)
+
+    except Exception as e:
+        logger.error(f"Error processing QR batch: {str(e)}")
+        return Response({"error": str(e)}, status=500)
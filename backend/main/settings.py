@@ -151,3 +151,43 @@ CORS_ALLOW_ALL_ORIGINS = True
 CSRF_TRUSTED_ORIGINS = [
     "https://smartchainerp2.onrender.com",
 ]
+
+# Background allocation jobs (see app/jobs.py)
+ALLOCATION_JOB_WORKERS = int(os.getenv("ALLOCATION_JOB_WORKERS", 2))
+ALLOCATION_JOB_CHUNK_SIZE = int(os.getenv("ALLOCATION_JOB_CHUNK_SIZE", 500))
+# Turn off to leave queued jobs to `python manage.py run_allocation_jobs`
+ALLOCATION_JOBS_IN_PROCESS = os.getenv("ALLOCATION_JOBS_IN_PROCESS", "true").lower() == "true"
+# Seconds after which a job still 'running' is taken to have lost its worker; keep it above the longest run
+ALLOCATION_JOB_TIMEOUT = int(os.getenv("ALLOCATION_JOB_TIMEOUT", 3600))
+
+# QR ingestion (see app/ingestion.py)
+# Repeats of the same payload without a scan_id inside this window are counted once by /api/store_qr/batch/,
+# and by /api/store_qr/ when the request sets "dedup": true (0 turns it off)
+QR_DEDUP_WINDOW_SECONDS = int(os.getenv("QR_DEDUP_WINDOW_SECONDS", 10))
+QR_BATCH_MAX = int(os.getenv("QR_BATCH_MAX", 1000))
+# Off: queued scans wait for `python manage.py drain_qr_scans` instead of an in-process drainer
+QR_DRAIN_IN_PROCESS = os.getenv("QR_DRAIN_IN_PROCESS", "true").lower() == "true"
+QR_DRAIN_BATCH_SIZE = int(os.getenv("QR_DRAIN_BATCH_SIZE", 500))
+# Entries per in-process name -> id cache used by QR ingestion (see app/lookup_cache.py)
+LOOKUP_CACHE_SIZE = int(os.getenv("LOOKUP_CACHE_SIZE", 10000))
+# Rows per chunk when large JSON responses are streamed (see app/fast_json.py)
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", 2000))
+# Rows validated and loaded per chunk by bulk imports (see app/imports.py)
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", 5000))
+# The read-endpoint response cache (see app/response_cache.py) keeps its version counters in the
+# "responses" cache, which every process must share: web workers, mqtt_listener, drain_qr_scans and
+# run_allocation_jobs all bump them. The database cache works out of the box (its table is created by
+# migration 0027); set RESPONSE_CACHE_BACKEND to django.core.cache.backends.redis.RedisCache and
+# RESPONSE_CACHE_LOCATION to the server URL for Redis. A per-process backend (local memory, dummy)
+# turns response caching off.
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv("CACHE_LOCATION", ""),
+    },
+    "responses": {
+        "BACKEND": os.getenv("RESPONSE_CACHE_BACKEND", "django.core.cache.backends.db.DatabaseCache"),
+        "LOCATION": os.getenv("RESPONSE_CACHE_LOCATION", "response_cache"),
+    },
+}
+RESPONSE_CACHE_TIMEOUT = int(os.getenv("RESPONSE_CACHE_TIMEOUT", 300))